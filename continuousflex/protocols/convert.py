@@ -30,7 +30,8 @@ import os
 from collections import OrderedDict
 
 from pwem.emlib import (MDL_NMA_MODEFILE, MDL_NMA_COLLECTIVITY, MDL_NMA_SCORE, MDL_NMA_EIGENVAL,
-                        MDL_ORDER)
+                        MDL_ORDER, MDL_ANGLE_ROT, MDL_ANGLE_TILT, MDL_ANGLE_PSI, MDL_SHIFT_X, MDL_SHIFT_Y,
+                        MDL_SHIFT_Z, MDL_ANGLE_Y)
 from pyworkflow.utils import Environ
 from pwem.objects import NormalMode
 
@@ -130,6 +131,93 @@ def matrix2eulerAngles(A):
     return alpha, beta, gamma, A[0,3], A[1,3], A[2,3]
 
 
+def eulerAngles2matrices(params):
+    """
+    Batched eulerAngles2matrix
+    :param np.ndarray params: (N, 6) rot, tilt, psi, shift x, shift y, shift z
+    :return np.ndarray: (N, 4, 4) matrices
+    """
+    params = np.asarray(params, dtype=np.float64).reshape(-1, 6)
+    sa, sb, sg = np.sin(np.deg2rad(params[:, :3])).T
+    ca, cb, cg = np.cos(np.deg2rad(params[:, :3])).T
+    cc = cb * ca
+    cs = cb * sa
+    sc = sb * ca
+    ss = sb * sa
+    A = np.zeros((len(params), 4, 4))
+    A[:, 3, 3] = 1
+    A[:, 0:3, 3] = params[:, 3:]
+    A[:, 0, 0] = cg * cc - sg * sa
+    A[:, 0, 1] = cg * cs + sg * ca
+    A[:, 0, 2] = -cg * sb
+    A[:, 1, 0] = -sg * cc - cg * sa
+    A[:, 1, 1] = -sg * cs + cg * ca
+    A[:, 1, 2] = sg * sb
+    A[:, 2, 0] = sc
+    A[:, 2, 1] = ss
+    A[:, 2, 2] = cb
+    return A
+
+
+def matrices2eulerAngles(A):
+    """
+    Batched matrix2eulerAngles
+    :param np.ndarray A: (N, 4, 4) matrices
+    :return np.ndarray: (N, 6) rot, tilt, psi, shift x, shift y, shift z
+    """
+    A = np.asarray(A, dtype=np.float64)
+    abs_sb = np.sqrt(A[:, 0, 2] * A[:, 0, 2] + A[:, 1, 2] * A[:, 1, 2])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = np.arctan2(A[:, 1, 2], -A[:, 0, 2])
+        alpha = np.arctan2(A[:, 2, 1], A[:, 2, 0])
+        sin_g = np.sin(gamma)
+        sign_sb = np.where(np.abs(sin_g) < np.exp(-5), np.sign(-A[:, 0, 2] / np.cos(gamma)),
+                           np.where(sin_g > 0, np.sign(A[:, 1, 2]), -np.sign(A[:, 1, 2])))
+        beta = np.arctan2(sign_sb * abs_sb, A[:, 2, 2])
+    # Gimbal lock, tilt is 0 or 180
+    lock = abs_sb <= 16*np.exp(-5)
+    up = A[:, 2, 2] > 0
+    alpha = np.where(lock, 0, alpha)
+    beta = np.where(lock, np.where(up, 0, np.pi), beta)
+    gamma = np.where(lock, np.where(up, np.arctan2(-A[:, 1, 0], A[:, 0, 0]), np.arctan2(A[:, 1, 0], -A[:, 0, 0])),
+                     gamma)
+    return np.column_stack((np.rad2deg(alpha), np.rad2deg(beta), np.rad2deg(gamma), A[:, 0, 3], A[:, 1, 3],
+                            A[:, 2, 3]))
+
+
+ALIGNMENT_LABELS = [MDL_ANGLE_ROT, MDL_ANGLE_TILT, MDL_ANGLE_PSI, MDL_SHIFT_X, MDL_SHIFT_Y, MDL_SHIFT_Z]
+
+
+def readAlignment(mdIn):
+    """
+    :param MetaData mdIn: metadata with angles and shifts
+    :return np.ndarray: (N, 6) rot, tilt, psi, shift x, shift y, shift z of the rows
+    """
+    return np.column_stack([np.array(mdIn.getColumnValues(label), dtype=np.float64) for label in ALIGNMENT_LABELS])
+
+
+def writeAlignment(mdOut, params):
+    """
+    Set the angles and shifts of all the rows of a metadata (the rows are added if the metadata is empty)
+    :param MetaData mdOut: metadata
+    :param np.ndarray params: (N, 6) rot, tilt, psi, shift x, shift y, shift z
+    """
+    for label, values in zip(ALIGNMENT_LABELS, np.asarray(params, dtype=np.float64).T):
+        mdOut.setColumnValues(label, values.tolist())
+
+
+def removeAngleY90(mdImgs):
+    """
+    Express the alignments of volumes aligned with a rotation of 90 degrees about Y (missing wedge compensation)
+    without it, the alignment becomes inv(T * T90) and MDL_ANGLE_Y is set to 0
+    :param MetaData mdImgs: metadata to update
+    """
+    T = eulerAngles2matrices(readAlignment(mdImgs))
+    T0 = eulerAngles2matrix(0, 90, 0, 0, 0, 0)
+    writeAlignment(mdImgs, matrices2eulerAngles(np.linalg.inv(np.matmul(T, T0))))
+    mdImgs.setColumnValues(MDL_ANGLE_Y, [0.0] * len(T))
+
+
 def l2(Vec1, Vec2):
     Vec1 = np.array(Vec1)
     Vec2 = np.array(Vec2)
@@ -26,8 +26,15 @@
 
 """
 Define some classes to store Data points for clustering.
+
+The coordinates, weights and states of the points are stored in NumPy arrays by Data, so that the selections, the
+filtering by expression and the assignment to clusters are computed on all the points at once. A Point is a view of one
+row of these arrays (it keeps its own values until it is added to a Data).
 """
 
+import ast
+import numpy as np
+
 
 class Point:
     """ Return x, y 2d coordinates and some other properties
@@ -40,11 +47,43 @@ class Point:
     
     def __init__(self, pointId, data, weight, state=0):
         self._id = pointId
-        self._data = data
-        self._weight = weight
-        self._state = state
         self._container = None
-        
+        # Row of the point in the arrays of its container, None until it is stored there
+        self._index = None
+        self._values = [data, weight, state]
+
+    @property
+    def _data(self):
+        if self._index is None:
+            return self._values[0]
+        return self._container._coords[self._index]
+
+    @property
+    def _weight(self):
+        if self._index is None:
+            return self._values[1]
+        return self._container._weights[self._index]
+
+    @_weight.setter
+    def _weight(self, value):
+        if self._index is None:
+            self._values[1] = value
+        else:
+            self._container._weights[self._index] = value
+
+    @property
+    def _state(self):
+        if self._index is None:
+            return self._values[2]
+        return int(self._container._states[self._index])
+
+    @_state.setter
+    def _state(self, value):
+        if self._index is None:
+            self._values[2] = value
+        else:
+            self._container._states[self._index] = value
+
     def getId(self):
         return self._id
     
@@ -68,6 +107,9 @@ class Point:
     
     def getWeight(self):
         return self._weight
+
+    def setWeight(self, value):
+        self._weight = value
     
     def getState(self):
         return self._state
@@ -96,6 +138,49 @@ class Point:
     def getData(self):
         return self._data 
 
+
+class _VectorizeExpression(ast.NodeTransformer):
+    """ Rewrite the boolean operators of an expression (and, or, not, chained comparisons)
+    into their elementwise NumPy equivalents.
+    """
+    def _call(self, func, args):
+        return ast.Call(func=ast.Attribute(value=ast.Name(id='np', ctx=ast.Load()), attr=func, ctx=ast.Load()),
+                        args=args, keywords=[])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = self._call(func, [result, value])
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call('logical_not', [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        left = node.left
+        result = None
+        for op, right in zip(node.ops, node.comparators):
+            compare = ast.Compare(left=left, ops=[op], comparators=[right])
+            result = compare if result is None else self._call('logical_and', [result, compare])
+            left = right
+        return result
+
+
+def compileExpression(expression):
+    """ Compile an expression of the point coordinates x1, x2... (as used by Point.eval)
+    to be evaluated on arrays of coordinates.
+    """
+    tree = _VectorizeExpression().visit(ast.parse(expression, mode='eval'))
+    return compile(ast.fix_missing_locations(tree), '<expression>', 'eval')
+
     
 class Data():
     """ Store data points. """
@@ -107,48 +192,145 @@ class Data():
     def addPoint(self, point, position=None):
         point._container = self
         if position is None:
+            # Points are stored in the arrays when they are accessed
+            self._pending.append(point)
             self._points.append(point)
         else:
+            self._sync()
+            data, weight, state = point._values
+            if not self._points:
+                self._coords = self._coords.reshape(0, len(data))
+            self._coords = np.insert(self._coords, position, np.asarray(data, dtype=float), axis=0)
+            self._weights = np.insert(self._weights, position, weight)
+            self._states = np.insert(self._states, position, state)
             self._points.insert(position, point)
+            for i in range(position, len(self._points)):
+                self._points[i]._index = i
+            point._values = None
+
+    def _sync(self):
+        """ Store the points added since the last access in the arrays. """
+        if not self._pending:
+            return
+        values = [p._values for p in self._pending]
+        coords = np.array([v[0] for v in values], dtype=float).reshape(len(values), -1)
+        start = len(self._weights)
+        if start == 0:
+            self._coords = coords
+        else:
+            self._coords = np.concatenate((self._coords, coords))
+        self._weights = np.concatenate((self._weights, np.array([v[1] for v in values], dtype=float)))
+        self._states = np.concatenate((self._states, np.array([v[2] for v in values], dtype=np.int8)))
+        for i, p in enumerate(self._pending, start):
+            p._index = i
+            p._values = None
+        self._pending = []
             
     def getPoint(self, index):
+        self._sync()
         return self._points[index]
         
     def __iter__(self):
+        self._sync()
         for point in self._points:
             if not point.isDiscarded():
                 yield point
                 
     def iterAll(self):
         """ Iterate over all points, including the discarded ones."""
+        self._sync()
         return iter(self._points)
-            
+
+    def getCoords(self):
+        """ Coordinates of all points (N, dim), including the discarded ones. """
+        self._sync()
+        return self._coords
+
+    def getStates(self):
+        """ States of all points, including the discarded ones. """
+        self._sync()
+        return self._states
+
+    def getAllWeights(self):
+        """ Weights of all points, including the discarded ones. """
+        self._sync()
+        return self._weights
+
+    def getVisibleMask(self):
+        """ Mask of the points that are not discarded. """
+        return self.getStates() != Point.DISCARDED
+
+    def getSelectedMask(self):
+        return self.getStates() == Point.SELECTED
+
+    def setStates(self, mask, state):
+        """ Set the state of the points of a mask (or an array of indexes). """
+        self.getStates()[mask] = state
+
+    def setWeights(self, values, mask=None):
+        """ Set the weights of all points, or of the points of a mask. """
+        weights = self.getAllWeights()
+        if mask is None:
+            weights[:] = values
+        else:
+            weights[mask] = values
+
+    def selectRectangle(self, xmin, xmax, ymin, ymax, select=True):
+        """ Find the points (not discarded) inside a rectangle of the X and Y axes,
+        if select is True, they are set as selected. Return the mask of these points.
+        """
+        coords = self.getCoords()
+        x = coords[:, self.XIND]
+        y = coords[:, self.YIND]
+        inside = (xmin <= x) & (x <= xmax) & (ymin <= y) & (y <= ymax) & self.getVisibleMask()
+        if select:
+            self.setStates(inside, Point.SELECTED)
+        return inside
+
+    def evalExpression(self, expression):
+        """ Evaluate an expression of x1, x2... (see Point.eval) on all the points at once.
+        Return the mask of the points (not discarded) for which it is true.
+        """
+        coords = self.getCoords()
+        localDict = {'x%d' % (i+1): coords[:, i] for i in range(coords.shape[1])}
+        try:
+            result = eval(compileExpression(expression), {"__builtins__": None, "np": np}, localDict)
+            result = np.broadcast_to(np.asarray(result, dtype=bool), (len(coords),))
+        except Exception:
+            # Expressions that can not be vectorized are evaluated point by point
+            result = np.array([bool(p.eval(expression)) for p in self.iterAll()], dtype=bool)
+        return result & self.getVisibleMask()
+
     def getXData(self):
-        return [p.getX() for p in self]
+        return self.getCoords()[self.getVisibleMask(), self.XIND]
     
     def getYData(self):
-        return [p.getY() for p in self]
+        return self.getCoords()[self.getVisibleMask(), self.YIND]
     
     def getZData(self):
-        return [p.getZ() for p in self]
+        return self.getCoords()[self.getVisibleMask(), self.ZIND]
     
     def getWeights(self):
-        return [p.getWeight() for p in self]
+        return self.getAllWeights()[self.getVisibleMask()]
     
     def getSize(self):
         return len(self._points)
     
     def getSelectedSize(self):
-        return len([p for p in self if p.isSelected()])
+        return int(np.count_nonzero(self.getSelectedMask()))
     
     def getDiscardedSize(self):
-        return len([p for p in self.iterAll() if p.isDiscarded()])
+        return int(np.count_nonzero(self.getStates() == Point.DISCARDED))
     
     def clear(self):
         self.XIND = 0
         self.YIND = 1
         self.ZIND = 2
         self._points = []
+        self._pending = []
+        self._coords = np.zeros((0, self._dim or 0))
+        self._weights = np.zeros(0)
+        self._states = np.zeros(0, dtype=np.int8)
 
 
 class PathData(Data):
@@ -187,4 +369,8 @@ class PathData(Data):
         return point
     
     def removeLastPoint(self):
+        self._sync()
+        self._coords = self._coords[:-1]
+        self._weights = self._weights[:-1]
+        self._states = self._states[:-1]
         del self._points[-1]
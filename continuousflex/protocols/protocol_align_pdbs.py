@@ -23,15 +23,16 @@
 from pyworkflow.protocol.params import (PointerParam, EnumParam, IntParam)
 from pwem.protocols import ProtAnalysis3D
 from pyworkflow.protocol import params
-from continuousflex.protocols.utilities.genesis_utilities import numpyArr2dcd, dcd2numpyArr
-from .utilities.pdb_handler import ContinuousFlexPDBHandler
+from continuousflex.protocols.utilities.genesis_utilities import DCDTrajectory, DCDWriter
+from .utilities.pdb_handler import ContinuousFlexPDBHandler, ALIGN_CHUNK_SIZE
 from pwem.objects import AtomStruct, SetOfParticles, SetOfVolumes
 from xmipp3.convert import writeSetOfVolumes, writeSetOfParticles, readSetOfVolumes, readSetOfParticles
 from pwem.constants import ALIGN_PROJ
-from continuousflex.protocols.convert import matrix2eulerAngles
+from continuousflex.protocols.convert import matrices2eulerAngles, writeAlignment
 
 import numpy as np
 import glob
+import os
 import pwem.emlib.metadata as md
 
 PDB_SOURCE_PATTERN = 0
@@ -124,36 +125,30 @@ class FlexProtAlignPdb(ProtAnalysis3D):
     def readInputFiles(self):
         inputFiles = self.getInputFiles()
 
-        # Get pdbs coordinates
-        if self.pdbSource.get() == PDB_SOURCE_TRAJECT:
-            pdbs_arr = dcd2numpyArr(inputFiles[0])
-            nframe, natom, _ = pdbs_arr.shape
-            pdbs_arr = pdbs_arr
-            for i in range(1,len(inputFiles)):
-                pdb_arr_i = dcd2numpyArr(inputFiles[i])
-                pdbs_arr = np.concatenate((pdbs_arr, pdb_arr_i), axis=0)
+        # Get pdbs coordinates and save as dcd file
+        with DCDWriter(self._getExtraPath("coords.dcd")) as dcd:
+            if self.pdbSource.get() == PDB_SOURCE_TRAJECT:
+                for dcdfn in inputFiles:
+                    traj = DCDTrajectory(dcdfn)
+                    for coords in traj:
+                        dcd.write(coords)
+                    traj.close()
 
-        else:
-            pdbs_matrix = []
-            for pdbfn in inputFiles:
-                try:
-                    # Read PDBs
-                    mol = ContinuousFlexPDBHandler(pdbfn)
-                    pdbs_matrix.append(mol.coords)
-                except RuntimeError:
-                    print("Warning : Can not read PDB file %s " % pdbfn)
-            pdbs_arr = np.array(pdbs_matrix)
-
-        # save as dcd file
-        numpyArr2dcd(pdbs_arr, self._getExtraPath("coords.dcd"))
+            else:
+                for pdbfn in inputFiles:
+                    try:
+                        # Read PDBs
+                        mol = ContinuousFlexPDBHandler(pdbfn)
+                        dcd.write(mol.coords)
+                    except RuntimeError:
+                        print("Warning : Can not read PDB file %s " % pdbfn)
 
     def rigidBodyAlignementStep(self):
 
         # open files
         inputPDB = ContinuousFlexPDBHandler(self.getPDBRef())
         refPDB = ContinuousFlexPDBHandler(self.alignRefPDB.get().getFileName())
-        arrDCD = dcd2numpyArr(self._getExtraPath("coords.dcd"))
-        nframe, natom,_ =arrDCD.shape
+        trajDCD = DCDTrajectory(self._getExtraPath("coords.dcd"))
         alignXMD = md.MetaData()
 
         # find matching index between reference and pdbs
@@ -167,45 +162,38 @@ class FlexProtAlignPdb(ProtAnalysis3D):
             idx_matching_atoms = None
         refPDB.write_pdb(self._getExtraPath("reference.pdb"))
 
-        # loop over all pdbs
-        for i in range(nframe):
-            print("Aligning PDB %i ... " %i)
-
-            # rotate
-            if self.matchingType.get() != 0 :
-                coord = arrDCD[i][idx_matching_atoms[:, 0]]
-            else:
-                coord = arrDCD[i]
-            rot_mat, tran = ContinuousFlexPDBHandler.alignCoords(refPDB.coords, coord)
-            arrDCD[i] = (np.dot(arrDCD[i], rot_mat) + tran).astype(np.float32)
-
-            # add to MD
-            trans_mat = np.zeros((4,4))
-            trans_mat[:3,:3] = rot_mat
-            trans_mat[:,3] = tran
-            rot, tilt, psi,shftx, shfty, shftz = matrix2eulerAngles(trans_mat)
-            index = alignXMD.addObject()
-            alignXMD.setValue(md.MDL_ANGLE_ROT, rot, index)
-            alignXMD.setValue(md.MDL_ANGLE_TILT, tilt, index)
-            alignXMD.setValue(md.MDL_ANGLE_PSI, psi, index)
-            alignXMD.setValue(md.MDL_SHIFT_X, shftx, index)
-            alignXMD.setValue(md.MDL_SHIFT_Y, shfty, index)
-            alignXMD.setValue(md.MDL_SHIFT_Z, shftz, index)
-            alignXMD.setValue(md.MDL_IMAGE, "", index)
-
-        numpyArr2dcd(arrDCD, self._getExtraPath("coords.dcd"))
+        # align all pdbs
+        if self.matchingType.get() != 0 :
+            atoms = idx_matching_atoms[:, 0]
+        else:
+            atoms = None
+        rot_mats, trans, _ = ContinuousFlexPDBHandler.alignCoordsBatch(refPDB.coords, trajDCD.coords, atoms=atoms)
+
+        with DCDWriter(self._getExtraPath("coords_aligned.dcd")) as dcd:
+            for start in range(0, len(trajDCD), ALIGN_CHUNK_SIZE):
+                end = min(start + ALIGN_CHUNK_SIZE, len(trajDCD))
+                dcd.write(np.matmul(trajDCD[start:end], rot_mats[start:end]) + trans[start:end, None, :])
+
+        # add to MD
+        trans_mats = np.zeros((len(trajDCD), 4, 4))
+        trans_mats[:, :3, :3] = rot_mats
+        trans_mats[:, :3, 3] = trans
+        alignXMD.setColumnValues(md.MDL_IMAGE, [""] * len(trajDCD))
+        writeAlignment(alignXMD, matrices2eulerAngles(trans_mats))
+
+        trajDCD.close()
+        os.replace(self._getExtraPath("coords_aligned.dcd"), self._getExtraPath("coords.dcd"))
         alignXMD.write(self._getExtraPath("alignement.xmd"))
 
 
     def createOutputStep(self):
         pdbset = self._createSetOfPDBs("outputPDBs")
-        arrDCD = dcd2numpyArr(self._getExtraPath("coords.dcd"))
+        trajDCD = DCDTrajectory(self._getExtraPath("coords.dcd"))
         refPDB = ContinuousFlexPDBHandler(self._getExtraPath("reference.pdb"))
 
-        nframe, natom,_ = arrDCD.shape
-        for i in range(nframe):
+        for i, coords in enumerate(trajDCD):
             filename = self._getExtraPath("output_%s.pdb" %str(i+1).zfill(6))
-            refPDB.coords = arrDCD[i]
+            refPDB.coords = coords
             refPDB.write_pdb(filename)
             pdb = AtomStruct(filename=filename)
             pdbset.append(pdb)
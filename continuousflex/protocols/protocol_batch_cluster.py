@@ -33,6 +33,8 @@ from xmipp3.convert import writeSetOfParticles
 from pwem.utils import runProgram
 import pwem.emlib.metadata as md
 import numpy as np
+from continuousflex.protocols.utilities.nma_utilities import NMADeformer
+from continuousflex.protocols.utilities.metadata_utilities import joinColumn
 
 
 class FlexBatchProtNMACluster(BatchProtocol):
@@ -78,16 +80,7 @@ class FlexBatchProtNMACluster(BatchProtocol):
         # Add the NMA displacement to clusters XMD files
         md_file_nma = md.MetaData(self.inputNmaDimred.get().getParticlesMD())
         md_file_org = md.MetaData(imagesMd)
-        for objID in md_file_org:
-            # if image name is the same, we add the nma displacement from nma to org
-            id_org = md_file_org.getValue(md.MDL_ITEM_ID, objID)
-            for j in md_file_nma:
-                id_nma = md_file_nma.getValue(md.MDL_ITEM_ID, j)
-                print(id_nma)
-                if id_org == id_nma:
-                    displacements = md_file_nma.getValue(md.MDL_NMA, j)
-                    md_file_org.setValue(md.MDL_NMA, displacements, objID)
-                    break
+        joinColumn(md_file_org, md_file_nma, md.MDL_ITEM_ID, md.MDL_NMA)
         md_file_org.write(imagesMd)
 
 
@@ -109,11 +102,7 @@ class FlexBatchProtNMACluster(BatchProtocol):
         fnPDB, pseudo = self.getFnPDB()
         fnModeList = self.getFnModes()
         fnOutPDB = self._getExtraPath('centroid.pdb')
-        params = " --pdb " + fnPDB
-        params += " --nma " + fnModeList
-        params += " -o " + fnOutPDB
-        params += " --deformations " + ' '.join(str(i) for i in ampl)
-        runProgram('xmipp_pdb_nma_deform', params)
+        NMADeformer(fnPDB, fnModeList).writePDB(ampl, fnOutPDB)
     
     def createOutputStep(self, outputVol):
         vol = Volume()
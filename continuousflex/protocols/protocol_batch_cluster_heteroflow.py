@@ -25,8 +25,7 @@ from pyworkflow.protocol.params import PointerParam, FileParam, IntParam
 from pwem.protocols import BatchProtocol
 from pwem.objects import Volume, SetOfVolumes
 from xmipp3.convert import writeSetOfVolumes
-import pwem.emlib.metadata as md
-import os
+from continuousflex.protocols.utilities.volume_averaging import readAlignedVolumes, averageVolumes
 
 
 class FlexBatchProtHeteroFlowCluster(BatchProtocol):
@@ -71,28 +70,8 @@ class FlexBatchProtHeteroFlowCluster(BatchProtocol):
 
     def averagingStep(self):
         volumesMd = self._getExtraPath('volumes.xmd')
-        mdVols = md.MetaData(volumesMd)
-        counter = 0
-        for objId in mdVols:
-            counter = counter + 1
-            imgPath = mdVols.getValue(md.MDL_IMAGE, objId)
-            outputVol = self._getExtraPath('average.spi')
-            tempVol = self._getExtraPath('temp.spi')
-            extra = self._getExtraPath()
-
-            params = '-i %(imgPath)s -o %(tempVol)s --type vol ' % locals()
-            self.runJob('xmipp_image_convert',params)
-
-            if counter == 1 :
-                os.system("mv %(tempVol)s %(outputVol)s" % locals())
-
-            else:
-                params = '-i %(tempVol)s --plus %(outputVol)s -o %(outputVol)s ' % locals()
-                self.runJob('xmipp_image_operate', params)
-
-        params = '-i %(outputVol)s --divide %(counter)s -o %(outputVol)s ' % locals()
-        self.runJob('xmipp_image_operate', params)
-        os.system("rm -f %(tempVol)s" % locals())
+        outputVol = self._getExtraPath('average.spi')
+        averageVolumes(readAlignedVolumes(volumesMd, align=False), outputVol)
 
 
     def createOutputStep(self, outputVol):
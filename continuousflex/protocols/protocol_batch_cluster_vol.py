@@ -29,9 +29,10 @@ from pwem.protocols import BatchProtocol
 from pwem.objects import Volume, SetOfVolumes, AtomStruct
 from xmipp3.convert import writeSetOfVolumes
 import pwem.emlib.metadata as md
-import os
-from pwem.utils import runProgram
 import numpy as np
+from continuousflex.protocols.utilities.nma_utilities import NMADeformer
+from continuousflex.protocols.utilities.volume_averaging import readAlignedVolumes, averageVolumes
+from continuousflex.protocols.utilities.metadata_utilities import joinColumn
 
 
 class FlexBatchProtNMAClusterVol(BatchProtocol):
@@ -75,53 +76,15 @@ class FlexBatchProtNMAClusterVol(BatchProtocol):
         # Add the NMA displacement to clusters XMD files
         md_file_nma = md.MetaData(self.inputNmaDimred.get().getParticlesMD())
         md_file_org = md.MetaData(volumesMd)
-        for objID in md_file_org:
-            # if image name is the same, we add the nma displacement from nma to org
-            id_org = md_file_org.getValue(md.MDL_ITEM_ID, objID)
-            for j in md_file_nma:
-                id_nma = md_file_nma.getValue(md.MDL_ITEM_ID, j)
-                if id_org == id_nma:
-                    displacements = md_file_nma.getValue(md.MDL_NMA, j)
-                    md_file_org.setValue(md.MDL_NMA, displacements, objID)
-                    break
+        joinColumn(md_file_org, md_file_nma, md.MDL_ITEM_ID, md.MDL_NMA)
         md_file_org.write(volumesMd)
 
 
 
     def averagingStep(self):
         volumesMd = self._getExtraPath('volumes.xmd')
-        mdVols = md.MetaData(volumesMd)
-
-        counter = 0
-        for objId in mdVols:
-            counter = counter + 1
-            imgPath = mdVols.getValue(md.MDL_IMAGE, objId)
-
-            rot = mdVols.getValue(md.MDL_ANGLE_ROT, objId)
-            tilt = mdVols.getValue(md.MDL_ANGLE_TILT, objId)
-            psi = mdVols.getValue(md.MDL_ANGLE_PSI, objId)
-            x_shift = mdVols.getValue(md.MDL_SHIFT_X, objId)
-            y_shift = mdVols.getValue(md.MDL_SHIFT_Y, objId)
-            z_shift = mdVols.getValue(md.MDL_SHIFT_Z, objId)
-
-            outputVol = self._getExtraPath('average.vol')
-            tempVol = self._getExtraPath('temp.vol')
-            extra = self._getExtraPath()
-
-            params = '-i %(imgPath)s -o %(tempVol)s --inverse --rotate_volume euler %(rot)s %(tilt)s %(psi)s' \
-                     ' --shift %(x_shift)s %(y_shift)s %(z_shift)s -v 0' % locals()
-            runProgram('xmipp_transform_geometry', params)
-
-            if counter == 1:
-                os.system("mv %(tempVol)s %(outputVol)s" % locals())
-
-            else:
-                params = '-i %(tempVol)s --plus %(outputVol)s -o %(outputVol)s ' % locals()
-                runProgram('xmipp_image_operate', params)
-
-        params = '-i %(outputVol)s --divide %(counter)s -o %(outputVol)s ' % locals()
-        runProgram('xmipp_image_operate', params)
-        os.system("rm -f %(tempVol)s" % locals())
+        outputVol = self._getExtraPath('average.vol')
+        averageVolumes(readAlignedVolumes(volumesMd, inverse=True), outputVol)
 
 
     def centroidPdbStep(self):
@@ -136,11 +99,7 @@ class FlexBatchProtNMAClusterVol(BatchProtocol):
         fnPDB, pseudo = self.getFnPDB()
         fnModeList = self.getFnModes()
         fnOutPDB = self._getExtraPath('centroid.pdb')
-        params = " --pdb " + fnPDB
-        params += " --nma " + fnModeList
-        params += " -o " + fnOutPDB
-        params += " --deformations " + ' '.join(str(i) for i in ampl)
-        runProgram('xmipp_pdb_nma_deform', params)
+        NMADeformer(fnPDB, fnModeList).writePDB(ampl, fnOutPDB)
 
 
     def createOutputStep(self, outputVol):
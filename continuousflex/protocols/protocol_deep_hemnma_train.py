@@ -77,6 +77,8 @@ class FlexProtDeepHEMNMATrain(ProtAnalysis3D):
         form.addParam('learning_rate', params.FloatParam, label = 'Learning rate', default = 0.0001)
         form.addParam('epochs', params.IntParam, expertLevel=params.LEVEL_ADVANCED,label = 'Number of epochs', default = 400)
         form.addParam('batch_size', params.IntParam ,expertLevel=params.LEVEL_ADVANCED, label = 'Batch size', default = 2)
+        form.addParam('num_workers', params.IntParam, expertLevel=params.LEVEL_ADVANCED, label = 'Data loading workers',
+                      default = 4, help='number of processes reading the batches of images during the training')
         form.addParallelSection(threads=0, mpi=0)
     
     
@@ -97,7 +99,9 @@ class FlexProtDeepHEMNMATrain(ProtAnalysis3D):
         device = self.device_option.get()
         imgsFn = self.inputNMA.get()._getExtraPath('images.xmd')
 
-        params = " %s %s %d %d %f %d %d" % (imgsFn, self._getExtraPath(), epochs, batch_size, lr, mode, device)
+        num_workers = self.num_workers.get()
+        params = " %s %s %d %d %f %d %d %d" % (imgsFn, self._getExtraPath(), epochs, batch_size, lr, mode, device,
+                                               num_workers)
         script_path = continuousflex.__path__[0]+'/protocols/utilities/deep_hemnma.py'
         command = "python " + script_path + params
         check_call(command, shell=True, stdout=sys.stdout, stderr=sys.stderr, env=None, cwd=None)
@@ -32,6 +32,7 @@ from pyworkflow.utils import getListFromRangeString
 
 from .utilities.genesis_utilities import *
 from .utilities.pdb_handler import ContinuousFlexPDBHandler
+from .utilities.nma_utilities import loadModeVectors
 from xmipp3 import Plugin
 import pyworkflow.utils as pwutils
 from pyworkflow.utils import runCommand, buildRunCommand
@@ -395,14 +396,15 @@ class ProtGenesis(EMProtocol):
             modeSelection = np.arange(7,self.inputModes.get().getSize()+1)
         else:
             modeSelection = getListFromRangeString(self.modeList.get())
+        selection = [i for i in range(self.inputModes.get().getSize()) if i+1 in modeSelection]
+        # read from the binary archive of the modes if the NMA protocol wrote one
+        vectors = loadModeVectors([self.inputModes.get()[i + 1].getModeFile() for i in selection])
         with open(nm_file, "w") as f:
-            for i in range(self.inputModes.get().getSize()):
-                if i+1 in modeSelection:
-                    f.write(" VECTOR    %i       VALUE  0.0\n" % (i + 1))
-                    f.write(" -----------------------------------\n")
-                    nm_vec = np.loadtxt(self.inputModes.get()[i + 1].getModeFile())
-                    for j in range(nm_vec.shape[0]):
-                        f.write(" %e   %e   %e\n" % (nm_vec[j, 0], nm_vec[j, 1], nm_vec[j, 2]))
+            for i, nm_vec in zip(selection, vectors):
+                f.write(" VECTOR    %i       VALUE  0.0\n" % (i + 1))
+                f.write(" -----------------------------------\n")
+                for j in range(nm_vec.shape[0]):
+                    f.write(" %e   %e   %e\n" % (nm_vec[j, 0], nm_vec[j, 1], nm_vec[j, 2]))
 
     # --------------------------- Convert Input EM data --------------------------------------------
 
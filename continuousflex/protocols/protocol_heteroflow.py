@@ -27,7 +27,9 @@ import pwem.emlib.metadata as md
 import pyworkflow.protocol.params as params
 from pyworkflow.utils.path import makePath, createLink
 from continuousflex.protocols.utilities.spider_files3 import save_volume
+from continuousflex.protocols.utilities.heteroflow_utilities import writeFlowStack, blockedGramMatrix
 import sys
+import os
 from pyworkflow.utils import getListFromRangeString
 from os.path import isfile
 from joblib import Parallel, delayed
@@ -242,14 +244,12 @@ class FlexProtHeteroFlow(ProtAnalysis3D):
         N = 0
         for objId in mdImgs:
             N += 1
-        metric_mat = np.zeros([N, N])
-        for i in range(1, N + 1):
-            print('finding the correlation matrix row ', i)
-            flowi = self.read_optical_flow_by_number(i)
-            for j in range(i, N + 1):
-                print('        column', j)
-                flowj = self.read_optical_flow_by_number(j)
-                metric_mat[i - 1, j - 1] = metric_mat[j - 1, i - 1] =  self.metric_opflow_vols(flowi, flowj)
+        # Each optical flow is read once into a memory mapped stack, then the matrix is computed by blocks
+        stack_file = self._getExtraPath('optical_flows_stack.npy')
+        stack = writeFlowStack(self.read_optical_flow_by_number, N, stack_file)
+        metric_mat = blockedGramMatrix(stack)
+        del stack
+        os.remove(stack_file)
 
         correlation_matrix = self._getExtraPath('data.csv')
         np.savetxt(correlation_matrix, metric_mat, delimiter=',')
@@ -34,6 +34,8 @@ import glob
 from sklearn import decomposition
 from joblib import dump
 import xmipp3
+from continuousflex.protocols.utilities.heteroflow_utilities import (writeFlowComponents, FLOW_COMPONENTS,
+                                                                     FLOW_FACTORS)
 
 DIMRED_PCA = 0
 DIMRED_LTSA = 1
@@ -122,6 +124,12 @@ class FlexProtDimredHeteroFlow(ProtAnalysis3D):
 
         form.addParam('reducedDim', IntParam, default=2,
                       label='Reduced dimension')
+        form.addParam('flowRank', IntParam, default=50,
+                      expertLevel=LEVEL_ADVANCED,
+                      label='Number of flow components',
+                      help='The optical flows of the animations are reconstructed from this number of principal '
+                           'components of the optical flows (the memory used grows with it). Use 0 to keep all of '
+                           'them, the reconstruction is then exact.')
         form.addParallelSection(threads=0, mpi=0)
 
         # --------------------------- INSERT steps functions --------------------------------------------
@@ -141,6 +149,7 @@ class FlexProtDimredHeteroFlow(ProtAnalysis3D):
         self._insertFunctionStep('performDimredStep',
                                  deformationsFile, method, extraParams,
                                  rows, reducedDim)
+        self._insertFunctionStep('computeFlowComponentsStep', self.flowRank.get())
         self._insertFunctionStep('createOutputStep')
 
     # --------------------------- STEPS functions --------------------------------------------
@@ -198,6 +207,16 @@ class FlexProtDimredHeteroFlow(ProtAnalysis3D):
                 self.mappingFile.set(mappingFile)
             self.runJob("xmipp_matrix_dimred", args % locals())
 
+    def computeFlowComponentsStep(self, rank):
+        """ Keep the first singular vectors of the optical flows, used by the viewer
+        to map the points of the reduced space back to optical flows.
+        """
+        opFlowProt = self.inputOpFlow.get()
+        G = np.loadtxt(opFlowProt._getExtraPath('data.csv'), delimiter=',', ndmin=2)
+        nComponents = writeFlowComponents(opFlowProt.read_optical_flow_by_number, G,
+                                          self.getFlowComponentsFile(), self.getFlowFactorsFile(), rank)
+        print('%d components of the optical flows saved' % nComponents)
+
     def createOutputStep(self):
         pass
 
@@ -238,6 +257,12 @@ class FlexProtDimredHeteroFlow(ProtAnalysis3D):
     def getDeformationFile(self):
         return self._getExtraPath('deformations.txt')
 
+    def getFlowComponentsFile(self):
+        return self._getExtraPath(FLOW_COMPONENTS)
+
+    def getFlowFactorsFile(self):
+        return self._getExtraPath(FLOW_FACTORS)
+
     def getProjectorFile(self):
         return self.mappingFile.get()
 
@@ -37,6 +37,7 @@ from pwem.convert import cifToPdb
 from xmipp3.convert import (writeSetOfParticles)
 from pyworkflow.utils.path import copyFile, createLink
 import numpy as np
+from continuousflex.protocols.utilities.nma_utilities import NMADeformer
 import glob
 from joblib import dump
 from math import cos, sin, pi
@@ -381,6 +382,8 @@ class FlexProtSynthesizeImages(ProtAnalysis3D):
 
         # iterate over the number of outputs (if mesh, this has to be calculated)
         numberOfVolumes = self.get_number_of_volumes()
+        # the modes are loaded once for all the deformed structures
+        deformer = NMADeformer(fnPDB, fnModeList, enabledOnly=False)
 
         for i in range(numberOfVolumes):
             deformations = np.zeros(numberOfModes)
@@ -427,7 +430,8 @@ class FlexProtSynthesizeImages(ProtAnalysis3D):
             # params+= " -o " + self._getExtraPath(str(i+1).zfill(5)+'_df.pdb')
             # params+= " --deformations " + ' '.join(str(i) for i in deformations)
             # runProgram('xmipp_pdb_nma_deform', params)
-            self.nma_deform_pdb(fnPDB,fnModeList,self._getExtraPath(str(i+1).zfill(5)+'_df.pdb'),deformations)
+            # the amplitudes start from the 7th mode
+            deformer.writePDB(np.concatenate((np.zeros(6), deformations)), self._getExtraPath(str(i+1).zfill(5)+'_df.pdb'))
 
             subtomogramMD.setValue(md.MDL_IMAGE, self._getExtraPath(str(i+1).zfill(5)+'_projected'+'.spi'), subtomogramMD.addObject())
             subtomogramMD.setValue(md.MDL_NMA, list(deformations), i+1)
@@ -587,60 +591,6 @@ class FlexProtSynthesizeImages(ProtAnalysis3D):
             params_j += " --ctf " + self._getExtraPath('ctf.param')
             runProgram('xmipp_ctf_phase_flip', params_j)
 
-    def nma_deform_pdb(self, fnPDB, fnModeList, fnOut, deformList):
-        def readPDB(fnIn):
-            with open(fnIn) as f:
-                lines = f.readlines()
-            newlines = []
-            for line in lines:
-                if line.startswith("ATOM "):
-                    try:
-                        x = float(line[30:38])
-                        y = float(line[38:46])
-                        z = float(line[46:54])
-                        newline = [x, y, z]
-                        newlines.append(newline)
-                    except:
-                        pass
-            return newlines
-
-        def readModes(fnIn):
-            modesMD = md.MetaData(fnIn)
-            vectors = []
-            for objId in modesMD:
-                vecFn = modesMD.getValue(md.MDL_NMA_MODEFILE, objId)
-                vec = np.loadtxt(vecFn)
-                vectors.append(vec)
-            return vectors
-
-        def savePDB(list, fn, fn_original):
-            with open(fn_original) as f:
-                lines = f.readlines()
-            newLines = []
-            i = 0
-            for line in lines:
-                if line.startswith("ATOM "):
-                    try:
-                        x = list[i][0]
-                        y = list[i][1]
-                        z = list[i][2]
-                        newLine = line[0:30] + "%8.3f%8.3f%8.3f" % (x, y, z) + line[54:]
-                        i += 1
-                    except:
-                        pass
-                else:
-                    newLine = line
-                newLines.append(newLine)
-            with open(fn, mode='w') as f:
-                f.writelines(newLines)
-            pass
-
-        pdb_array = np.array(readPDB(fnPDB))
-        modes = readModes(fnModeList)
-        for i in range(len(deformList)):
-            pdb_array += deformList[i] * modes[7-1+i]
-        savePDB(pdb_array, fnOut, fnPDB)
-
     def generate_links_to_volume(self):
         fn_volume = self._getExtraPath('reference')
         if(self.refAtomic.get()):
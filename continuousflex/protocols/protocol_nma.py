@@ -28,7 +28,7 @@
 # **************************************************************************
 
 import os
-import math
+import numpy as np
 from os.path import basename, exists, join
 
 from pwem.convert.atom_struct import cifToPdb
@@ -42,6 +42,7 @@ from pwem.objects import SetOfNormalModes
 from xmipp3.base import XmippMdRow
 from .protocol_nma_base import FlexProtNMABase, NMA_CUTOFF_REL
 from .convert import rowToMode, getNMAEnviron
+from .utilities.nma_utilities import writeModesArchive, MODES_ARCHIVE
 
 
 class FlexProtNMA(FlexProtNMABase):
@@ -222,21 +223,29 @@ class FlexProtNMA(FlexProtNMABase):
         Natoms = self._countAtoms("atoms.pdb")
         fhIn = open('diagrtb.eigenfacs')
         fhAni = open('vec_ani.txt','w')
+        vectors = []
         
         for n in range(numberOfModes):
             # Skip two lines
             fhIn.readline()
             fhIn.readline()
             fhOut=open('modes/vec.%d'%(n+1),'w')
+            lines = []
             for i in range(Natoms):
                 line=fhIn.readline()
                 fhOut.write(line)
                 fhAni.write(line.rstrip().lstrip()+" ")
+                lines.append(line)
             fhOut.close()
             if n!=(numberOfModes-1):
                 fhAni.write("\n")
+            if all(lines):
+                vectors.append(np.loadtxt(lines, ndmin=2))
         fhIn.close()
         fhAni.close()
+        # Binary copy of the modes, memory-mapped by the protocols and viewers instead of parsing vec.N
+        if len(vectors) > 0:
+            writeModesArchive(MODES_ARCHIVE, vectors)
         self.runJob("nma_prepare_for_animate.py","",env=getNMAEnviron())
         cleanPath("vec_ani.txt")
         moveFile('vec_ani.pkl', 'extra/vec_ani.pkl')
@@ -291,36 +300,27 @@ class FlexProtNMA(FlexProtNMABase):
     def computeAtomShiftsStep(self, numberOfModes):
         fnOutDir = self._getExtraPath("distanceProfiles")
         makePath(fnOutDir)
-        maxShift=[]
-        maxShiftMode=[]
-        
-        for n in range(7, numberOfModes+1):
-            fnVec = self._getPath("modes", "vec.%d" % n)
-            if exists(fnVec):
-                fhIn = open(fnVec)
-                md = MetaData()
-                atomCounter = 0
-                for line in fhIn:
-                    x, y, z = map(float, line.split())
-                    d = math.sqrt(x*x+y*y+z*z)
-                    if n==7:
-                        maxShift.append(d)
-                        maxShiftMode.append(7)
-                    else:
-                        if d>maxShift[atomCounter]:
-                            maxShift[atomCounter]=d
-                            maxShiftMode[atomCounter]=n
-                    atomCounter+=1
-                    md.setValue(MDL_NMA_ATOMSHIFT,d,md.addObject())
-                md.write(join(fnOutDir,"vec%d.xmd" % n))
-                fhIn.close()
+
+        modes = [n for n in range(7, numberOfModes+1) if exists(self._getPath("modes", "vec.%d" % n))]
         md = MetaData()
-        for i, _ in enumerate(maxShift):
-            fnVec = self._getPath("modes", "vec.%d" % (maxShiftMode[i]+1))
-            if exists(fnVec):
-                objId = md.addObject()
-                md.setValue(MDL_NMA_ATOMSHIFT, maxShift[i],objId)
-                md.setValue(MDL_NMA_MODEFILE, fnVec, objId)
+        if len(modes) > 0:
+            # Read as text (not from the float32 archive) to keep the same values in the output files
+            vectors = np.array([np.loadtxt(self._getPath("modes", "vec.%d" % n), ndmin=2) for n in modes])
+            x, y, z = vectors[:, :, 0], vectors[:, :, 1], vectors[:, :, 2]
+            shifts = np.sqrt(x*x+y*y+z*z)
+            for n, d in zip(modes, shifts):
+                mdVec = MetaData()
+                mdVec.setColumnValues(MDL_NMA_ATOMSHIFT, d.tolist())
+                mdVec.write(join(fnOutDir,"vec%d.xmd" % n))
+
+            # First mode of maximum shift for each atom
+            maxIdx = np.argmax(shifts, axis=0)
+            maxShift = shifts[maxIdx, np.arange(shifts.shape[1])]
+            fnVecs = np.array([self._getPath("modes", "vec.%d" % (n+1)) for n in modes])
+            keep = np.array([exists(fnVec) for fnVec in fnVecs])[maxIdx]
+            if np.any(keep):
+                md.setColumnValues(MDL_NMA_ATOMSHIFT, maxShift[keep].tolist())
+                md.setColumnValues(MDL_NMA_MODEFILE, fnVecs[maxIdx][keep].tolist())
         md.write(self._getExtraPath('maxAtomShifts.xmd'))
                                                       
     def createOutputStep(self):
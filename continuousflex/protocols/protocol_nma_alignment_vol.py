@@ -27,17 +27,17 @@ from os.path import basename
 import os
 from pyworkflow.utils import getListFromRangeString
 from pwem.protocols import ProtAnalysis3D
-from xmipp3.convert import (writeSetOfVolumes, xmippToLocation, createItemMatrix,
-                            setXmippAttributes, getImageLocation)
+from xmipp3.convert import (writeSetOfVolumes, createItemMatrix,
+                            setXmippAttributes)
 import pwem as em
 import pwem.emlib.metadata as md
 from xmipp3 import XmippMdRow
 from pyworkflow.utils.path import copyFile, cleanPath
 import pyworkflow.protocol.params as params
 from pyworkflow.protocol.params import NumericRangeParam
-from .convert import modeToRow, eulerAngles2matrix, matrix2eulerAngles
+from .convert import modeToRow, removeAngleY90
+from .utilities.metadata_utilities import updateInputLocations
 from pwem import Domain
-import numpy as np
 import multiprocessing
 
 WEDGE_MASK_NONE = 0
@@ -203,26 +203,7 @@ class FlexProtAlignmentNMAVol(ProtAnalysis3D):
         # project), and we need to set the item_id for each volume
         inputSet = self.inputVolumes.get()
         mdImgs = md.MetaData(self.imgsFn)
-        for objId in mdImgs:
-            imgPath = mdImgs.getValue(md.MDL_IMAGE, objId)
-            index, fn = xmippToLocation(imgPath)
-            if(index): # case the input is a stack
-                # Conside the index is the id in the input set
-                particle = inputSet[index]
-            else: # input is not a stack
-                # convert the inputSet to metadata:
-                mdtemp = md.MetaData(self.imgsFn_backup)
-                # Loop and find the index based on the basename:
-                bn_retrieved = basename(imgPath)
-                for searched_index in mdtemp:
-                    imgPath_temp = mdtemp.getValue(md.MDL_IMAGE,searched_index)
-                    bn_searched = basename(imgPath_temp)
-                    if bn_searched == bn_retrieved:
-                        index = searched_index
-                        particle = inputSet[index]
-                        break
-            mdImgs.setValue(md.MDL_IMAGE, getImageLocation(particle), objId)
-            mdImgs.setValue(md.MDL_ITEM_ID, int(particle.getObjId()), objId)
+        updateInputLocations(mdImgs, inputSet, self.imgsFn_backup)
         mdImgs.sort(md.MDL_ITEM_ID)
         mdImgs.write(self.imgsFn)
 
@@ -237,25 +218,7 @@ class FlexProtAlignmentNMAVol(ProtAnalysis3D):
 
         if flag == 90:
             mdImgs = md.MetaData(self.imgsFn)
-            for objId in mdImgs:
-                rot = mdImgs.getValue(md.MDL_ANGLE_ROT, objId)
-                tilt = mdImgs.getValue(md.MDL_ANGLE_TILT, objId)
-                psi = mdImgs.getValue(md.MDL_ANGLE_PSI, objId)
-                x = mdImgs.getValue(md.MDL_SHIFT_X, objId)
-                y = mdImgs.getValue(md.MDL_SHIFT_Y, objId)
-                z = mdImgs.getValue(md.MDL_SHIFT_Z, objId)
-                T = eulerAngles2matrix(rot, tilt, psi, x, y, z)
-                # Rotate 90 degrees (compensation for missing wedge)
-                T0 = eulerAngles2matrix(0, 90, 0, 0, 0, 0)
-                T = np.linalg.inv(np.matmul(T, T0))
-                rot, tilt, psi, x, y, z = matrix2eulerAngles(T)
-                mdImgs.setValue(md.MDL_ANGLE_ROT, rot, objId)
-                mdImgs.setValue(md.MDL_ANGLE_TILT, tilt, objId)
-                mdImgs.setValue(md.MDL_ANGLE_PSI, psi, objId)
-                mdImgs.setValue(md.MDL_SHIFT_X, x, objId)
-                mdImgs.setValue(md.MDL_SHIFT_Y, y, objId)
-                mdImgs.setValue(md.MDL_SHIFT_Z, z, objId)
-                mdImgs.setValue(md.MDL_ANGLE_Y, 0.0, objId)
+            removeAngleY90(mdImgs)
             mdImgs.write(self.imgsFn)
 
 
@@ -298,26 +261,7 @@ class FlexProtAlignmentNMAVol(ProtAnalysis3D):
         inputSet = self.inputVolumes.get()
         mdImgs = md.MetaData(self.imgsFn)
 
-        for objId in mdImgs:
-            imgPath = mdImgs.getValue(md.MDL_IMAGE, objId)
-            index, fn = xmippToLocation(imgPath)
-            if(index): # case the input is a stack
-                # Conside the index is the id in the input set
-                particle = inputSet[index]
-            else: # input is not a stack
-                # convert the inputSet to metadata:
-                mdtemp = md.MetaData(self.imgsFn_backup)
-                # Loop and find the index based on the basename:
-                bn_retrieved = basename(imgPath)
-                for searched_index in mdtemp:
-                    imgPath_temp = mdtemp.getValue(md.MDL_IMAGE,searched_index)
-                    bn_searched = basename(imgPath_temp)
-                    if bn_searched == bn_retrieved:
-                        index = searched_index
-                        particle = inputSet[index]
-                        break
-            mdImgs.setValue(md.MDL_IMAGE, getImageLocation(particle), objId)
-            mdImgs.setValue(md.MDL_ITEM_ID, int(particle.getObjId()), objId)
+        updateInputLocations(mdImgs, inputSet, self.imgsFn_backup)
         mdImgs.sort(md.MDL_ITEM_ID)
         mdImgs.write(self.imgsFn)
 
@@ -325,25 +269,7 @@ class FlexProtAlignmentNMAVol(ProtAnalysis3D):
         # ground truth (rotate 90 degrees) then set angle y to 0
         if self.WedgeMode == WEDGE_MASK_THRE:
             mdImgs = md.MetaData(self.imgsFn)
-            for objId in mdImgs:
-                rot = mdImgs.getValue(md.MDL_ANGLE_ROT, objId)
-                tilt = mdImgs.getValue(md.MDL_ANGLE_TILT, objId)
-                psi = mdImgs.getValue(md.MDL_ANGLE_PSI, objId)
-                x = mdImgs.getValue(md.MDL_SHIFT_X, objId)
-                y = mdImgs.getValue(md.MDL_SHIFT_Y, objId)
-                z = mdImgs.getValue(md.MDL_SHIFT_Z, objId)
-                T = eulerAngles2matrix(rot, tilt, psi, x, y, z)
-                # Rotate 90 degrees (compensation for missing wedge)
-                T0 = eulerAngles2matrix(0, 90, 0, 0, 0, 0)
-                T = np.linalg.inv(np.matmul(T, T0))
-                rot, tilt, psi, x, y, z = matrix2eulerAngles(T)
-                mdImgs.setValue(md.MDL_ANGLE_ROT, rot, objId)
-                mdImgs.setValue(md.MDL_ANGLE_TILT, tilt, objId)
-                mdImgs.setValue(md.MDL_ANGLE_PSI, psi, objId)
-                mdImgs.setValue(md.MDL_SHIFT_X, x, objId)
-                mdImgs.setValue(md.MDL_SHIFT_Y, y, objId)
-                mdImgs.setValue(md.MDL_SHIFT_Z, z, objId)
-                mdImgs.setValue(md.MDL_ANGLE_Y, 0.0, objId)
+            removeAngleY90(mdImgs)
             mdImgs.write(self.imgsFn)
 
         cleanPath(self._getExtraPath('copy.xmd'))
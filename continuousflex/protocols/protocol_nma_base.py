@@ -35,10 +35,12 @@ from pwem.protocols import EMProtocol
 from pyworkflow.protocol.params import IntParam, FloatParam, EnumParam
 from pyworkflow.utils import *
 from pyworkflow.utils.path import makePath, cleanPath, moveFile
+import numpy as np
 
 from xmipp3 import Plugin
 from xmipp3.constants import NMA_HOME
 from .convert import getNMAEnviron
+from .utilities.nma_utilities import writeModesArchive, writeModesInfo, MODES_ARCHIVE
 
 NMA_CUTOFF_ABS = 0
 NMA_CUTOFF_REL = 1
@@ -163,6 +165,10 @@ class FlexProtNMABase(EMProtocol):
         fnModesDir = "modes"
         makePath(fnModesDir)
         self.runJob("mv", "-f vec.* %s" % fnModesDir)
+        # Binary copy of the modes, memory-mapped by the protocols and viewers instead of parsing vec.N
+        fnVec = sorted(glob(fnModesDir + "/vec.*"), key=lambda f: int(f.split(".")[-1]))
+        if len(fnVec) > 0:
+            writeModesArchive(MODES_ARCHIVE, [np.loadtxt(f, ndmin=2) for f in fnVec])
         self.runJob("nma_prepare_for_animate.py", "", env=getNMAEnviron())
         self.runJob("rm", "-f vec_ani.txt fort.11 matrice.sdijf")
         moveFile('vec_ani.pkl', 'extra/vec_ani.pkl')
@@ -260,6 +266,8 @@ class FlexProtNMABase(EMProtocol):
             mdOut.setValue(MDL_NMA_SCORE, score_i, objId)
             i += 1
         mdOut.write("modes%s.xmd" % suffix)
+        writeModesInfo("modes%s_info.npz" % suffix, [eigvals[n] if n < len(eigvals) else np.nan for n in range(len(fnVec))],
+                       collectivityList, [mdOut.getValue(MDL_ENABLED, objId) for objId in mdOut])
         cleanPath("Chkmod.res")
 
         self._leaveWorkingDir()
@@ -34,7 +34,7 @@ from pwem.utils import runProgram
 from continuousflex.protocols import FlexProtAlignmentNMA
 
 import numpy as np
-import glob
+from continuousflex.protocols.utilities.nma_utilities import NMADeformer
 from sklearn import decomposition
 from joblib import dump
 
@@ -185,24 +185,15 @@ class FlexProtDimredNMA(ProtAnalysis3D):
                 f.write(' '.join(particle._xmipp_nmaDisplacements))
                 f.write('\n')
             f.close()
-            nma_ampl = np.loadtxt(nma_amplfn)
+            nma_ampl = np.loadtxt(nma_amplfn, ndmin=2)
             makePath(self._getExtraPath('generated_pdbs'))
             pdbs_folder = self._getExtraPath('generated_pdbs')
-            i = 1
-            for line in nma_ampl:
-                cmd = '-o ' + pdbs_folder + '/' + str(i).zfill(
-                    6) + '.pdb' + ' --pdb ' + pdbfn + ' --nma ' + selected_nma_modes + \
-                      ' --deformations ' + ' '.join(map(str, line))
-                #print(cmd)
-                runProgram('xmipp_pdb_nma_deform', cmd)
-                i += 1
-            pdbs_list = [f for f in glob.glob(pdbs_folder+'/*.pdb')]
-            pdbs_list.sort()
-            pdbs_matrix = []
-            for pdbfn in pdbs_list:
-                pdb_lines = self.readPDB(pdbfn)
-                pdb_coordinates = np.array(self.PDB2List(pdb_lines))
-                pdbs_matrix.append(np.reshape(pdb_coordinates, -1))
+            # The modes are loaded once and the structures deformed in memory, only the first one is written as it is
+            # used as a template by the viewer
+            deformer = NMADeformer(pdbfn, selected_nma_modes)
+            deformer.writePDB(nma_ampl[0], pdbs_folder + '/' + str(1).zfill(6) + '.pdb')
+            # Same precision as reading the coordinates from PDBs
+            pdbs_matrix = np.round(deformer.deform(nma_ampl), 3).reshape(len(nma_ampl), -1)
             np.savetxt(deformationFile, pdbs_matrix, fmt="%s")
             pass
 
@@ -24,10 +24,11 @@
 
 from continuousflex.protocols.protocol_genesis import *
 import pyworkflow.protocol.params as params
-from sklearn import decomposition
+from continuousflex.protocols.utilities.genesis_utilities import dcdPCA
 from xmipp3.convert import writeSetOfVolumes, writeSetOfParticles, readSetOfVolumes, readSetOfParticles
 from pwem.constants import ALIGN_PROJ
-from continuousflex.protocols.convert import matrix2eulerAngles
+from continuousflex.protocols.convert import matrices2eulerAngles, writeAlignment
+from continuousflex.protocols.utilities.pdb_handler import ALIGN_CHUNK_SIZE
 
 class ProtNMMDRefine(ProtGenesis):
     """ Protocol to perform NMMD refinement using GENESIS """
@@ -103,21 +104,17 @@ class ProtNMMDRefine(ProtGenesis):
 
 
     def pdb2dcdStep(self):
-        pdbs_matrix = []
         missing_pdbs = []
 
-        for i in range(self.getNumberOfSimulation()):
-            pdb_fname = self.getOutputPrefix(i) +".pdb"
-            if os.path.isfile(pdb_fname) and os.path.getsize(pdb_fname) != 0:
-                mol = ContinuousFlexPDBHandler(pdb_fname)
-                pdbs_matrix.append(mol.coords)
-            else:
-                missing_pdbs.append(i)
-
-        pdbs_arr = np.array(pdbs_matrix)
-
         # save as dcd file
-        numpyArr2dcd(pdbs_arr, self._getExtraPath("coords.dcd"))
+        with DCDWriter(self._getExtraPath("coords.dcd")) as dcd:
+            for i in range(self.getNumberOfSimulation()):
+                pdb_fname = self.getOutputPrefix(i) +".pdb"
+                if os.path.isfile(pdb_fname) and os.path.getsize(pdb_fname) != 0:
+                    mol = ContinuousFlexPDBHandler(pdb_fname)
+                    dcd.write(mol.coords)
+                else:
+                    missing_pdbs.append(i)
 
         # If some pdbs are missing (fitting failed), save indexes
         self._missing_pdbs = np.array(missing_pdbs).astype(int)
@@ -128,34 +125,26 @@ class ProtNMMDRefine(ProtGenesis):
 
         # open files
         refPDB =  ContinuousFlexPDBHandler(self.getInputPDBprefix()+".pdb")
-        arrDCD = dcd2numpyArr(self._getExtraPath("coords.dcd"))
-        nframe, natom,_ =arrDCD.shape
+        trajDCD = DCDTrajectory(self._getExtraPath("coords.dcd"))
         alignXMD = md.MetaData()
 
-        # loop over all pdbs
-        for i in range(nframe):
-            print("Aligning PDB %i ... " %i)
-
-            # rotate
-            coord = arrDCD[i]
-            rot_mat, tran = ContinuousFlexPDBHandler.alignCoords(refPDB.coords, coord)
-            arrDCD[i] = (np.dot(arrDCD[i], rot_mat) + tran).astype(np.float32)
-
-            # add to MD
-            trans_mat = np.zeros((4,4))
-            trans_mat[:3,:3] = rot_mat
-            trans_mat[:,3] = tran
-            rot, tilt, psi,shftx, shfty, shftz = matrix2eulerAngles(trans_mat)
-            index = alignXMD.addObject()
-            alignXMD.setValue(md.MDL_ANGLE_ROT, rot, index)
-            alignXMD.setValue(md.MDL_ANGLE_TILT, tilt, index)
-            alignXMD.setValue(md.MDL_ANGLE_PSI, psi, index)
-            alignXMD.setValue(md.MDL_SHIFT_X, shftx, index)
-            alignXMD.setValue(md.MDL_SHIFT_Y, shfty, index)
-            alignXMD.setValue(md.MDL_SHIFT_Z, shftz, index)
-            alignXMD.setValue(md.MDL_IMAGE, "", index)
-
-        numpyArr2dcd(arrDCD, self._getExtraPath("coords.dcd"))
+        # align all pdbs
+        rot_mats, trans, _ = ContinuousFlexPDBHandler.alignCoordsBatch(refPDB.coords, trajDCD.coords)
+
+        with DCDWriter(self._getExtraPath("coords_aligned.dcd")) as dcd:
+            for start in range(0, len(trajDCD), ALIGN_CHUNK_SIZE):
+                end = min(start + ALIGN_CHUNK_SIZE, len(trajDCD))
+                dcd.write(np.matmul(trajDCD[start:end], rot_mats[start:end]) + trans[start:end, None, :])
+
+        # add to MD
+        trans_mats = np.zeros((len(trajDCD), 4, 4))
+        trans_mats[:, :3, :3] = rot_mats
+        trans_mats[:, :3, 3] = trans
+        alignXMD.setColumnValues(md.MDL_IMAGE, [""] * len(trajDCD))
+        writeAlignment(alignXMD, matrices2eulerAngles(trans_mats))
+
+        trajDCD.close()
+        os.replace(self._getExtraPath("coords_aligned.dcd"), self._getExtraPath("coords.dcd"))
         alignXMD.write(self.getAlignementprefix())
 
     def updateAlignementStep(self):
@@ -226,17 +215,13 @@ class ProtNMMDRefine(ProtGenesis):
 
         numberOfPCA = self.numberOfPCA.get()
 
-        pdbs_arr = dcd2numpyArr(self._getExtraPath("coords.dcd"))
-        nframe, natom,_ = pdbs_arr.shape
-        pdbs_matrix = pdbs_arr.reshape(nframe, natom*3)
-
-        pca = decomposition.PCA(n_components=numberOfPCA)
-        Y = pca.fit_transform(pdbs_matrix)
+        # The PCA is fitted by blocks of frames of the trajectory
+        pca, Y = dcdPCA(self._getExtraPath("coords.dcd"), n_components=numberOfPCA)
 
         pdb = ContinuousFlexPDBHandler(self.getPDBRef())
-        pdb.coords = pca.mean_.reshape(pdbs_matrix.shape[1] // 3, 3)
+        pdb.coords = pca.mean_.reshape(-1, 3)
 
-        matrix = pca.components_.reshape(numberOfPCA,pdbs_matrix.shape[1]//3,3)
+        matrix = pca.components_.reshape(numberOfPCA, -1, 3)
 
         # SAVE NEW inputs
         pdb.write_pdb(self.getInputPDBprefix()+".pdb")
@@ -251,24 +236,28 @@ class ProtNMMDRefine(ProtGenesis):
     def prepareOutputStep(self):
         for i in range(self.getNumberOfSimulation()):
             outPref = self._getExtraPath("output_%s"% str(i+1).zfill(6))
-            cat = "cat "
+            logfiles = []
             for j in range(self.numberOfIter.get()):
                 logfile =  self.getOutputPrefix(i,j)+".log"
                 if os.path.isfile(logfile):
-                    cat += logfile + " "
-            runCommand("%s > %s.log"%(cat, outPref))
+                    logfiles.append(logfile)
+            runCommand("cat %s > %s.log"%(" ".join(logfiles), outPref))
+            # Cache the columns of the concatenated log from the logs of each iteration
+            GenesisLogReader.concatenate(outPref + ".log", logfiles)
 
             dcdfile = self.getOutputPrefix(i,0) + ".dcd"
             if os.path.isfile(dcdfile):
-                dcdarr= dcd2numpyArr(dcdfile)
-                for j in range(1,self.numberOfIter.get()):
-                    dcdfile = self.getOutputPrefix(i,j) + ".dcd"
-                    if os.path.isfile(dcdfile):
-                        try :
-                            dcdarr = np.concatenate((dcdarr, dcd2numpyArr(dcdfile)), axis=0)
-                        except ValueError:
-                            print("Incomplete DCD file")
-                numpyArr2dcd(dcdarr,outPref+ ".dcd")
+                with DCDWriter(outPref+ ".dcd") as dcd:
+                    for j in range(self.numberOfIter.get()):
+                        dcdfile = self.getOutputPrefix(i,j) + ".dcd"
+                        if os.path.isfile(dcdfile):
+                            traj = DCDTrajectory(dcdfile)
+                            try :
+                                for coords in traj:
+                                    dcd.write(coords)
+                            except RuntimeError:
+                                print("Incomplete DCD file")
+                            traj.close()
 
             pdbfile = self.getOutputPrefix(i)+".pdb"
             if os.path.isfile(pdbfile):
@@ -28,15 +28,13 @@ from pwem.emlib import MetaData, MDL_ENABLED, MDL_NMA_MODEFILE,MDL_ORDER
 from pwem.objects import SetOfNormalModes, AtomStruct
 from .convert import rowToMode
 from xmipp3.base import XmippMdRow
-from continuousflex.protocols.utilities.genesis_utilities import numpyArr2dcd, dcd2numpyArr
 from umap import UMAP
 
 import numpy as np
 import glob
-from sklearn import decomposition
 from joblib import dump
 
-from .utilities.genesis_utilities import dcd2numpyArr
+from .utilities.genesis_utilities import DCDTrajectory, DCDWriter, dcdPCA
 from .utilities.pdb_handler import ContinuousFlexPDBHandler
 import pwem.emlib.metadata as md
 
@@ -121,49 +119,42 @@ class FlexProtDimredPdb(ProtAnalysis3D):
     def readInputFiles(self):
         inputFiles = self.getInputFiles()
 
-        # Get pdbs coordinates
-        if self.pdbSource.get() == PDB_SOURCE_TRAJECT:
-            pdbs_arr = dcd2numpyArr(inputFiles[0])
-            for i in range(1,len(inputFiles)):
-                pdb_arr_i = dcd2numpyArr(inputFiles[i])
-                pdbs_arr = np.concatenate((pdbs_arr, pdb_arr_i), axis=0)
-
-        elif self.pdbSource.get() == PDB_SOURCE_ALIGNED:
-            pdbs_arr = dcd2numpyArr(inputFiles[0])
-        else:
-            pdbs_matrix = []
-            for pdbfn in inputFiles:
-                try:
-                    # Read PDBs
-                    mol = ContinuousFlexPDBHandler(pdbfn)
-                    pdbs_matrix.append(mol.coords)
-                except RuntimeError:
-                    print("Warning : Can not read PDB file %s " % pdbfn)
-            pdbs_arr = np.array(pdbs_matrix)
-
-        # save as dcd file
-        numpyArr2dcd(pdbs_arr, self._getExtraPath("coords.dcd"))
+        # Get pdbs coordinates and save as dcd file
+        with DCDWriter(self._getExtraPath("coords.dcd")) as dcd:
+            if self.pdbSource.get() == PDB_SOURCE_TRAJECT or self.pdbSource.get() == PDB_SOURCE_ALIGNED:
+                for dcdfn in inputFiles:
+                    traj = DCDTrajectory(dcdfn)
+                    for coords in traj:
+                        dcd.write(coords)
+                    traj.close()
+            else:
+                for pdbfn in inputFiles:
+                    try:
+                        # Read PDBs
+                        mol = ContinuousFlexPDBHandler(pdbfn)
+                        dcd.write(mol.coords)
+                    except RuntimeError:
+                        print("Warning : Can not read PDB file %s " % pdbfn)
 
     def performDimred(self):
 
-        pdbs_arr = dcd2numpyArr(self._getExtraPath("coords.dcd"))
-        nframe, natom,_ = pdbs_arr.shape
-        pdbs_matrix = pdbs_arr.reshape(nframe, natom*3)
-
         if self.method.get() == REDUCE_METHOD_PCA:
-            pca = decomposition.PCA(n_components=self.reducedDim.get())
-            Y = pca.fit_transform(pdbs_matrix)
+            # The PCA is fitted by blocks of frames of the trajectory
+            pca, Y = dcdPCA(self._getExtraPath("coords.dcd"), n_components=self.reducedDim.get())
             dump(pca, self._getExtraPath('pca_pickled.joblib'))
 
             pathPC = self._getPath("modes")
             pdb = ContinuousFlexPDBHandler(self.getPDBRef())
-            pdb.coords = pca.mean_.reshape(pdbs_matrix.shape[1] // 3, 3)
+            pdb.coords = pca.mean_.reshape(-1, 3)
             pdb.write_pdb(self._getPath("atoms.pdb"))
             makePath(pathPC)
-            matrix = pca.components_.reshape(self.reducedDim.get(),pdbs_matrix.shape[1]//3,3)
+            matrix = pca.components_.reshape(self.reducedDim.get(), -1, 3)
             self.writePrincipalComponents(prefix=pathPC, matrix = matrix)
 
         elif self.method.get() == REDUCE_METHOD_UMAP:
+            traj = DCDTrajectory(self._getExtraPath("coords.dcd"))
+            pdbs_matrix = traj.frames().reshape(traj.n_frames, traj.n_atoms*3)
+            traj.close()
             umap = UMAP(n_components=self.reducedDim.get(), n_neighbors=15, n_epochs=1000).fit(pdbs_matrix)
             Y = umap.transform(pdbs_matrix)
             dump(umap, self._getExtraPath('pca_pickled.joblib'))
@@ -25,14 +25,14 @@
 
 import os
 from pwem.protocols import ProtAnalysis3D
-from xmipp3.convert import writeSetOfVolumes, xmippToLocation
+from xmipp3.convert import writeSetOfVolumes
 from pwem.objects import Volume
 import pwem.emlib.metadata as md
 import pyworkflow.protocol.params as params
 from pwem.utils import runProgram
 from pwem import Domain
-from .convert import eulerAngles2matrix, matrix2eulerAngles
-import numpy as np
+from .convert import removeAngleY90
+from .utilities.metadata_utilities import joinColumn
 import multiprocessing
 
 WEDGE_MASK_NONE = 0
@@ -249,25 +249,7 @@ class FlexProtSubtomogramAveraging(ProtAnalysis3D):
             # However, if the alignemnt has missing wedge compensation, we shall update the metadata:
             if self.WedgeMode == WEDGE_MASK_THRE:
                 mdImgs = md.MetaData(md_itr)
-                for objId in mdImgs:
-                    rot = mdImgs.getValue(md.MDL_ANGLE_ROT, objId)
-                    tilt = mdImgs.getValue(md.MDL_ANGLE_TILT, objId)
-                    psi = mdImgs.getValue(md.MDL_ANGLE_PSI, objId)
-                    x = mdImgs.getValue(md.MDL_SHIFT_X, objId)
-                    y = mdImgs.getValue(md.MDL_SHIFT_Y, objId)
-                    z = mdImgs.getValue(md.MDL_SHIFT_Z, objId)
-                    T = eulerAngles2matrix(rot, tilt, psi, x, y, z)
-                    # Rotate 90 degrees (compensation for missing wedge)
-                    T0 = eulerAngles2matrix(0, 90, 0, 0, 0, 0)
-                    T = np.linalg.inv(np.matmul(T, T0))
-                    rot, tilt, psi, x, y, z = matrix2eulerAngles(T)
-                    mdImgs.setValue(md.MDL_ANGLE_ROT, rot, objId)
-                    mdImgs.setValue(md.MDL_ANGLE_TILT, tilt, objId)
-                    mdImgs.setValue(md.MDL_ANGLE_PSI, psi, objId)
-                    mdImgs.setValue(md.MDL_SHIFT_X, x, objId)
-                    mdImgs.setValue(md.MDL_SHIFT_Y, y, objId)
-                    mdImgs.setValue(md.MDL_SHIFT_Z, z, objId)
-                    mdImgs.setValue(md.MDL_ANGLE_Y, 0.0, objId)
+                removeAngleY90(mdImgs)
                 mdImgs.write(md_itr)
 
             mdImgs = md.MetaData(md_itr)
@@ -313,16 +295,7 @@ class FlexProtSubtomogramAveraging(ProtAnalysis3D):
         inputSet = md.MetaData(self.imgsFn)
         mdImgs = md.MetaData(self.outputMD)
         # setting item_id (lost due to mpi usually)
-        for objId in mdImgs:
-            imgPath = mdImgs.getValue(md.MDL_IMAGE, objId)
-            index, fn = xmippToLocation(imgPath)
-            # Conside the index is the id in the input set
-            for objId2 in inputSet:
-                NewImgPath = inputSet.getValue(md.MDL_IMAGE, objId2)
-                if (NewImgPath == imgPath):
-                    target_ID = inputSet.getValue(md.MDL_ITEM_ID, objId2)
-                    break
-            mdImgs.setValue(md.MDL_ITEM_ID, target_ID, objId)
+        joinColumn(mdImgs, inputSet, md.MDL_IMAGE, md.MDL_ITEM_ID)
         mdImgs.sort(md.MDL_ITEM_ID)
         mdImgs.write(self.outputMD)
 
@@ -436,25 +409,7 @@ class FlexProtSubtomogramAveraging(ProtAnalysis3D):
 
         if flag == 90:
             mdImgs = md.MetaData(self.imgsFn)
-            for objId in mdImgs:
-                rot = mdImgs.getValue(md.MDL_ANGLE_ROT, objId)
-                tilt = mdImgs.getValue(md.MDL_ANGLE_TILT, objId)
-                psi = mdImgs.getValue(md.MDL_ANGLE_PSI, objId)
-                x = mdImgs.getValue(md.MDL_SHIFT_X, objId)
-                y = mdImgs.getValue(md.MDL_SHIFT_Y, objId)
-                z = mdImgs.getValue(md.MDL_SHIFT_Z, objId)
-                T = eulerAngles2matrix(rot, tilt, psi, x, y, z)
-                # Rotate 90 degrees (compensation for missing wedge)
-                T0 = eulerAngles2matrix(0, 90, 0, 0, 0, 0)
-                T = np.linalg.inv(np.matmul(T, T0))
-                rot, tilt, psi, x, y, z = matrix2eulerAngles(T)
-                mdImgs.setValue(md.MDL_ANGLE_ROT, rot, objId)
-                mdImgs.setValue(md.MDL_ANGLE_TILT, tilt, objId)
-                mdImgs.setValue(md.MDL_ANGLE_PSI, psi, objId)
-                mdImgs.setValue(md.MDL_SHIFT_X, x, objId)
-                mdImgs.setValue(md.MDL_SHIFT_Y, y, objId)
-                mdImgs.setValue(md.MDL_SHIFT_Z, z, objId)
-                mdImgs.setValue(md.MDL_ANGLE_Y, 0.0, objId)
+            removeAngleY90(mdImgs)
 
         mdImgs.write(self._getExtraPath('final_md.xmd'))
         counter = 0
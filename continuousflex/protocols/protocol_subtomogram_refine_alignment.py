@@ -28,7 +28,6 @@ from pyworkflow.utils.path import makePath, copyFile, cleanPath
 from sh_alignment.tompy.transform import fft, ifft, fftshift, ifftshift
 from pyworkflow.utils import replaceBaseExt
 from .utilities.spider_files3 import *
-import os
 from os.path import basename, isfile
 from pwem.utils import runProgram
 from pwem import Domain
@@ -37,7 +36,9 @@ from joblib import Parallel, delayed
 import continuousflex
 from subprocess import check_call
 from pwem.emlib.image import ImageHandler
-from .convert import eulerAngles2matrix, matrix2eulerAngles
+from .convert import eulerAngles2matrices, matrices2eulerAngles, readAlignment, writeAlignment
+from .utilities.volume_averaging import readAlignedVolumes, averageVolumes
+from .utilities.metadata_utilities import updateInputLocations, joinColumn
 from pyworkflow.utils import getListFromRangeString
 import multiprocessing
 
@@ -254,26 +255,7 @@ class FlexProtRefineSubtomoAlign(ProtAnalysis3D):
         mdImgs = md.MetaData(imgFn)
         # in case of metadata from an external file, it has to be updated with the proper filenames from 'input.xmd'
         inputSet = self.inputVolumes.get()
-        for objId in mdImgs:
-            imgPath = mdImgs.getValue(md.MDL_IMAGE, objId)
-            index, fn = xmipp3.convert.xmippToLocation(imgPath)
-            if (index):  # case the input is a stack
-                # Conside the index is the id in the input set
-                particle = inputSet[index]
-            else:  # input is not a stack
-                # convert the inputSet to metadata:
-                mdtemp = md.MetaData(self._getExtraPath('input.xmd'))
-                # Loop and find the index based on the basename:
-                bn_retrieved = basename(imgPath)
-                for searched_index in mdtemp:
-                    imgPath_temp = mdtemp.getValue(md.MDL_IMAGE, searched_index)
-                    bn_searched = basename(imgPath_temp)
-                    if bn_searched == bn_retrieved:
-                        index = searched_index
-                        particle = inputSet[index]
-                        break
-            mdImgs.setValue(md.MDL_IMAGE, xmipp3.convert.getImageLocation(particle), objId)
-            mdImgs.setValue(md.MDL_ITEM_ID, int(particle.getObjId()), objId)
+        updateInputLocations(mdImgs, inputSet, self._getExtraPath('input.xmd'))
         # Sorting here To avoid future problems
         mdImgs.sort()
         mdImgs.write(self.imgsFn)
@@ -592,15 +574,7 @@ class FlexProtRefineSubtomoAlign(ProtAnalysis3D):
         mdImgs = md.MetaData(result)
         inputSet = md.MetaData(imgFn)
         # setting item_id (lost due to mpi) then sorting
-        for objId in mdImgs:
-            imgPath = mdImgs.getValue(md.MDL_IMAGE, objId)
-            # Conside the index is the id in the input set
-            for objId2 in inputSet:
-                NewImgPath = inputSet.getValue(md.MDL_IMAGE, objId2)
-                if (NewImgPath == imgPath):
-                    target_ID = inputSet.getValue(md.MDL_ITEM_ID, objId2)
-                    break
-            mdImgs.setValue(md.MDL_ITEM_ID, target_ID, objId)
+        joinColumn(mdImgs, inputSet, md.MDL_IMAGE, md.MDL_ITEM_ID)
         mdImgs.sort()
         mdImgs.write(result)
 
@@ -615,53 +589,26 @@ class FlexProtRefineSubtomoAlign(ProtAnalysis3D):
         MD_refined = md.MetaData(self._getExtraPath('refinement_'+str(num)+'.xmd'))
         # This metadata will be populated and saved
         MD_combined = md.MetaData()
-        # Iteratively:
         # 2- find the transformation matrices
-        for objId in MD_original:
-            rot_o = MD_original.getValue(md.MDL_ANGLE_ROT, objId)
-            tilt_o = MD_original.getValue(md.MDL_ANGLE_TILT, objId)
-            psi_o = MD_original.getValue(md.MDL_ANGLE_PSI, objId)
-            shiftx_o = MD_original.getValue(md.MDL_SHIFT_X, objId)
-            shifty_o = MD_original.getValue(md.MDL_SHIFT_Y, objId)
-            shiftz_o = MD_original.getValue(md.MDL_SHIFT_Z, objId)
-
-            rot_r = MD_refined.getValue(md.MDL_ANGLE_ROT, objId)
-            tilt_r = MD_refined.getValue(md.MDL_ANGLE_TILT, objId)
-            psi_r = MD_refined.getValue(md.MDL_ANGLE_PSI, objId)
-            shiftx_r = MD_refined.getValue(md.MDL_SHIFT_X, objId)
-            shifty_r = MD_refined.getValue(md.MDL_SHIFT_Y, objId)
-            shiftz_r = MD_refined.getValue(md.MDL_SHIFT_Z, objId)
-
-            T_o = eulerAngles2matrix(rot_o, tilt_o, psi_o, shiftx_o, shifty_o, shiftz_o)
-            T_r = eulerAngles2matrix(rot_r, tilt_r, psi_r, shiftx_r, shifty_r, shiftz_r)
-
-            # 3- multiply the matrices
-            if self.getAngleY() == 90:
-                # In this case the refinement matrix should be inverted (because the refined alignment does not have
-                # missing wedge correction)
-                T_r_inv = np.linalg.inv(T_r)
-                T = np.matmul(T_r_inv,T_o)
-            else:
-                # In this case the refinement matrix should be used as it is (as for both the previous and refined do not
-                # have missing wedge correction)
-                T = np.matmul(T_o, T_r)
-
-            rot_i, tilt_i, psi_i, x_i, y_i, z_i = matrix2eulerAngles(T)
+        T_o = eulerAngles2matrices(readAlignment(MD_original))
+        T_r = eulerAngles2matrices(readAlignment(MD_refined))
+
+        # 3- multiply the matrices
+        if self.getAngleY() == 90:
+            # In this case the refinement matrix should be inverted (because the refined alignment does not have
+            # missing wedge correction)
+            T = np.matmul(np.linalg.inv(T_r), T_o)
+        else:
+            # In this case the refinement matrix should be used as it is (as for both the previous and refined do not
+            # have missing wedge correction)
+            T = np.matmul(T_o, T_r)
 
-            # Populate the metadata
-            name_i = MD_original.getValue(md.MDL_IMAGE, objId)
+        # Populate the metadata
+        for name_i in MD_original.getColumnValues(md.MDL_IMAGE):
             MD_combined.setValue(md.MDL_IMAGE, name_i, MD_combined.addObject())
-            MD_combined.setValue(md.MDL_ANGLE_ROT, rot_i, objId)
-            MD_combined.setValue(md.MDL_ANGLE_TILT, tilt_i, objId)
-            MD_combined.setValue(md.MDL_ANGLE_PSI, psi_i, objId)
-            MD_combined.setValue(md.MDL_SHIFT_X, float(x_i), objId)
-            MD_combined.setValue(md.MDL_SHIFT_Y, float(y_i), objId)
-            MD_combined.setValue(md.MDL_SHIFT_Z, float(z_i), objId)
-            if self.getAngleY() == 90:
-                MD_combined.setValue(md.MDL_ANGLE_Y, 90.0, objId)
-            else:
-                MD_combined.setValue(md.MDL_ANGLE_Y, 0.0, objId)
-            MD_combined.setValue(md.MDL_ITEM_ID, objId, objId)
+        writeAlignment(MD_combined, matrices2eulerAngles(T))
+        MD_combined.setColumnValues(md.MDL_ANGLE_Y, [90.0 if self.getAngleY() == 90 else 0.0] * len(T))
+        MD_combined.setColumnValues(md.MDL_ITEM_ID, [int(objId) for objId in MD_original])
         # Save the metadata
         MD_combined.write(self._getExtraPath('combined_'+str(num)+'.xmd'))
 
@@ -671,47 +618,12 @@ class FlexProtRefineSubtomoAlign(ProtAnalysis3D):
         flag = self.getAngleY() == 90
 
         volumesMd = self._getExtraPath('combined_'+str(num)+'.xmd')
-        mdVols = md.MetaData(volumesMd)
-
-        counter = 0 # this is used to find the sum/number_of_volumes
-        first = True
-        for objId in mdVols:
-            counter = counter + 1
-            imgPath = mdVols.getValue(md.MDL_IMAGE, objId)
-            rot = mdVols.getValue(md.MDL_ANGLE_ROT, objId)
-            tilt = mdVols.getValue(md.MDL_ANGLE_TILT, objId)
-            psi = mdVols.getValue(md.MDL_ANGLE_PSI, objId)
-            x_shift = mdVols.getValue(md.MDL_SHIFT_X, objId)
-            y_shift = mdVols.getValue(md.MDL_SHIFT_Y, objId)
-            z_shift = mdVols.getValue(md.MDL_SHIFT_Z, objId)
-
-            # The new reference is for the next iteration
-            outputVol = self._getExtraPath('reference' + str(num+1) + '.spi')
-            tempVol = self._getExtraPath('temp.vol')
-            extra = self._getExtraPath()
-
-            if flag == 0 :
-                params = '-i %(imgPath)s -o %(tempVol)s --inverse --rotate_volume euler %(rot)s %(tilt)s %(psi)s' \
-                         ' --shift %(x_shift)s %(y_shift)s %(z_shift)s -v 0' % locals()
+        # The new reference is for the next iteration
+        outputVol = self._getExtraPath('reference' + str(num+1) + '.spi')
 
-            else:
-                # First got to rotate each volume 90 degrees about the y axis, align it, then sum it
-                params = '-i %(imgPath)s -o %(tempVol)s --rotate_volume euler 0 90 0' % locals()
-                runProgram('xmipp_transform_geometry', params)
-                params = '-i %(tempVol)s -o %(tempVol)s --rotate_volume euler %(rot)s %(tilt)s %(psi)s' \
-                         ' --shift %(x_shift)s %(y_shift)s %(z_shift)s ' % locals()
-
-            runProgram('xmipp_transform_geometry', params)
-
-            if counter == 1 :
-                os.system("mv %(tempVol)s %(outputVol)s" % locals())
-
-            else:
-                params = '-i %(tempVol)s --plus %(outputVol)s -o %(outputVol)s ' % locals()
-                runProgram('xmipp_image_operate', params)
-
-        params = '-i %(outputVol)s --divide %(counter)s -o %(outputVol)s ' % locals()
-        runProgram('xmipp_image_operate', params)
+        # if flag: first rotate each volume 90 degrees about the y axis, then align it (not inverted)
+        volumes = readAlignedVolumes(volumesMd, inverse=not flag, angleY90=flag)
+        averageVolumes(volumes, outputVol, self.numberOfMpi.get())
 
         # if there is a mask, then apply it:
         if (self.applyMask.get()):
@@ -719,8 +631,6 @@ class FlexProtRefineSubtomoAlign(ProtAnalysis3D):
             params = '-i ' + outputVol + ' -o ' + outputVol + ' --mult ' + maskfn
             runProgram('xmipp_image_operate', params)
 
-        os.system("rm -f %(tempVol)s" % locals())
-
 
     def createOutputStep(self, num =0):
         out_mdfn = self._getExtraPath('volumes_aligned_' + str(num + 1) + '.xmd')
@@ -29,11 +29,11 @@ from pyworkflow.protocol import params
 
 from .protocol_subtomogram_averaging import FlexProtSubtomogramAveraging
 from sklearn.cluster import AgglomerativeClustering, KMeans
-import time
 import os
-from sh_alignment.tompy.transform import fft, ifft, fftshift, ifftshift
+import multiprocessing
 import pwem.emlib.metadata as md
 from continuousflex.protocols.utilities.spider_files3 import save_volume, open_volume
+from continuousflex.protocols.utilities.subtomo_covariance import computeSpectra, wedgeCovarianceMatrix
 import xmipp3
 
 from pwem.objects import Volume
@@ -91,7 +91,7 @@ class FlexProtSubtomoClassify(ProtAnalysis3D):
                       label='Reduced dimension')
         form.addParam('numOfClasses', IntParam, default=2,
                       label='Number of classes')
-        # form.addParallelSection(threads=0, mpi=8)
+        form.addParallelSection(threads=max(multiprocessing.cpu_count()//2-1, 1), mpi=0)
 
         # --------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -200,42 +200,22 @@ class FlexProtSubtomoClassify(ProtAnalysis3D):
         # if the covariance matrix exists, we should not re-evaluate it (it takes long time)
         fn_covarmat = self._getExtraPath('covar_mat.pkl')
         if os.path.exists(fn_covarmat):
-            pass
+            return
         subtomogaligneMD= md.MetaData(self._getExtraPath('aligned_subtomograms.xmd'))
         mwalignedMD= md.MetaData(self._getExtraPath('aligned_masks.xmd'))
-        N = subtomogaligneMD.size()
-        X = np.zeros([N, N])
-        print(N)
-        A = time.time()
-        for i in subtomogaligneMD:
-            if i == 2:
-                B = time.time()-A
-                print('estimated time to finish is ', B*N/2)
-            name_i = subtomogaligneMD.getValue(md.MDL_IMAGE, i)
-            wedge_i = mwalignedMD.getValue(md.MDL_IMAGE, i)
-            Vi = open_volume(name_i)
-            Wi = open_volume(wedge_i)
-            print('line is', str(i),' out of ',str(N))
-            for j in range(i,N+1):
-                name_j = subtomogaligneMD.getValue(md.MDL_IMAGE, j)
-                wedge_j = mwalignedMD.getValue(md.MDL_IMAGE, j)
-                Vj = open_volume(name_j)
-                Wj = open_volume(wedge_j)
-                Omega = Wi * Wj
-                FVi = fft(Vi)
-                FVi = fftshift(FVi) * Omega
-                FVi = ifftshift(FVi)
-                Vi_p = ifft(FVi)
-                FVj = fft(Vj)
-                FVj = fftshift(FVj) * Omega
-                FVj = ifftshift(FVj)
-                Vj_p = ifft(FVj)
-                Vi_p = np.array(Vi_p, dtype=np.float32)
-                Vj_p = np.array(Vj_p, dtype=np.float32)
-                X[i-1, j-1] = self.cc(Vi_p, Vj_p)
-                X[j-1, i-1] = self.cc(Vj_p, Vi_p)
+        volumes = [subtomogaligneMD.getValue(md.MDL_IMAGE, i) for i in subtomogaligneMD]
+        wedges = [mwalignedMD.getValue(md.MDL_IMAGE, i) for i in mwalignedMD]
+        # the spectrum of each subtomogram is computed once, then the matrix is computed by blocks (checkpointed)
+        fn_spectra = self._getExtraPath('spectra.npy')
+        fn_wedges = self._getExtraPath('wedges_spectra.npy')
+        if not os.path.exists(fn_spectra):
+            computeSpectra(volumes, wedges, fn_spectra, fn_wedges, self.numberOfThreads.get())
+        X = wedgeCovarianceMatrix(fn_spectra, fn_wedges, self._getExtraPath('covar_mat_checkpoint.npz'),
+                                  self.numberOfThreads.get())
         # save the covariance matrix:
         dump(X, fn_covarmat)
+        os.remove(fn_spectra)
+        os.remove(fn_wedges)
 
     def performHierarchicalClustering(self):
         fn_covarmat = self._getExtraPath('covar_mat.pkl')
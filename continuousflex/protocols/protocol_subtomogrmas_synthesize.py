@@ -43,6 +43,7 @@ from pwem.objects import AtomStruct, Volume
 import xmipp3
 import os
 import numpy as np
+from continuousflex.protocols.utilities.nma_utilities import NMADeformer
 from pwem.utils import runProgram
 import time
 import glob
@@ -466,6 +467,8 @@ class FlexProtSynthesizeSubtomo(ProtAnalysis3D):
         #     numberOfVolumes = self.meshRowPoints.get()*self.meshRowPoints.get()
         # else:
         #     numberOfVolumes = self.numberOfVolumes.get()
+        # the modes are loaded once for all the deformed structures
+        deformer = NMADeformer(fnPDB, fnModeList)
         for i in range(numberOfVolumes):
             deformations = np.zeros(numberOfModes)
 
@@ -505,11 +508,7 @@ class FlexProtSynthesizeSubtomo(ProtAnalysis3D):
             # we won't keep the first 6 modes
             deformations = deformations[6:]
 
-            params = " --pdb " + fnPDB
-            params+= " --nma " + fnModeList
-            params+= " -o " + self._getExtraPath(str(i+1).zfill(5)+'_df.pdb')
-            params+= " --deformations " + ' '.join(str(i) for i in deformations)
-            runProgram('xmipp_pdb_nma_deform', params)
+            deformer.writePDB(deformations, self._getExtraPath(str(i+1).zfill(5)+'_df.pdb'))
 
             subtomogramMD.setValue(md.MDL_IMAGE, self._getExtraPath(str(i+1).zfill(5)+'_subtomogram'+'.vol'), subtomogramMD.addObject())
             subtomogramMD.setValue(md.MDL_NMA, list(deformations), i+1)
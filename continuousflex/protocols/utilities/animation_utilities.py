@@ -0,0 +1,76 @@
+"""
+Animations of a structure along a trajectory of the reduced space viewers.
+
+All the frames of the animation are computed in a single array (nframes, natoms, 3), and written in one pass to a
+multi-model PDB, or to a DCD trajectory with a PDB of the first frame as topology, instead of one PDB file per frame.
+"""
+
+import numpy as np
+
+from continuousflex.protocols.utilities.pdb_handler import ContinuousFlexPDBHandler
+from continuousflex.protocols.utilities.genesis_utilities import DCDWriter
+
+
+def animationLoop(n):
+    """
+    :param int n: number of frames
+    :return np.ndarray: frames going up and down through the trajectory 0 1 ... n-1 n-2 ... 1
+    """
+    return np.concatenate((np.arange(n), np.arange(n - 2, 0, -1)))
+
+
+class AnimationBuilder:
+    """
+    Frames of an animation of a structure
+    """
+
+    def __init__(self, pdb):
+        """
+        :param pdb: structure animated, ContinuousFlexPDBHandler or PDB file
+        """
+        self.pdb = pdb if isinstance(pdb, ContinuousFlexPDBHandler) else ContinuousFlexPDBHandler(pdb)
+        self.frames = np.zeros((0, self.pdb.n_atoms, 3))
+
+    def setFrames(self, coords):
+        """
+        :param np.ndarray coords: coordinates of the frames, (nframes, natoms, 3) or flattened (nframes, 3*natoms)
+        """
+        coords = np.asarray(coords, dtype=float)
+        if coords.size % (3 * self.pdb.n_atoms) != 0:
+            raise RuntimeError("The frames of the animation do not match the %i atoms of the structure"
+                               % self.pdb.n_atoms)
+        self.frames = coords.reshape(-1, self.pdb.n_atoms, 3)
+
+    def setDeformations(self, deformer, amplitudes):
+        """
+        :param NMADeformer deformer: normal modes of the structure
+        :param np.ndarray amplitudes: amplitudes of the modes for each frame (nframes, k)
+        """
+        self.setFrames(deformer.deform(np.atleast_2d(amplitudes)))
+
+    def getFrames(self, loop=False):
+        """
+        :param bool loop: go up and down through the frames, see animationLoop
+        :return np.ndarray: frames (nframes, natoms, 3)
+        """
+        return self.frames[animationLoop(len(self.frames))] if loop else self.frames
+
+    def writePDB(self, fnOut, loop=True):
+        """
+        :param str fnOut: output multi-model PDB, a model per frame
+        :param bool loop: go up and down through the frames
+        """
+        self.pdb.write_pdb_models(fnOut, self.getFrames(loop))
+
+    def writeDCD(self, fnOut, fnTopology=None, loop=False):
+        """
+        :param str fnOut: output DCD trajectory
+        :param str fnTopology: output PDB of the first frame (topology of the trajectory)
+        :param bool loop: go up and down through the frames
+        """
+        if fnTopology is not None:
+            mol = self.pdb.copy()
+            mol.coords = self.frames[0]
+            mol.write_pdb(fnTopology)
+        with DCDWriter(fnOut, natom=self.pdb.n_atoms) as dcd:
+            dcd.write(self.getFrames(loop))
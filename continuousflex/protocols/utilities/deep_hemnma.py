@@ -9,36 +9,22 @@ import torch
 from torch.utils.data.sampler import SubsetRandomSampler
 from torch.utils.tensorboard import SummaryWriter
 import sys
-def norm(imgs_path, output_path, FLAG, mode, batch_size):
-    dataset = cryodata(imgs_path, output_path, flag=FLAG, mode = mode, transform=transforms.ToTensor())
-    random_seed = 42
-    validation_split = .2
-    shuffle_dataset = True
-    dataset_size = len(dataset)
+def split_indices(dataset_size, validation_split, random_seed=42, shuffle_dataset=True):
     indices = list(range(dataset_size))
     split = int(np.floor((1-validation_split) * dataset_size))
-
     if shuffle_dataset:
         np.random.seed(random_seed)
         np.random.shuffle(indices)
-    train_indices, val_indices = indices[:split], indices[split:]
+    return indices[:split], indices[split:]
 
-    train_sampler = SubsetRandomSampler(train_indices)
-    valid_sampler = SubsetRandomSampler(val_indices)
-    print('the train set size is: {} images'.format(len(train_sampler)))
-    print('the validation set size is: {} images'.format(len(valid_sampler)))
-    train_loader = DataLoader(dataset, batch_size=batch_size, sampler=train_sampler)
-    validation_loader = DataLoader(dataset, batch_size=batch_size, sampler=valid_sampler)
-    sum_, squared_sum_, num_batches = 0, 0, 0
-    for img, nm_amplitudes in train_loader:
-        sum_ += torch.mean(img, dim=[0, 2, 3])
-        squared_sum_ += torch.mean(img**2, dim=[0, 2, 3])
-        num_batches += 1
-    mean = sum_/num_batches
-    std = (squared_sum_/num_batches - mean**2)**0.5
-    return mean, std
+def norm(dataset, stack_file):
+    # The images are decoded once in a stack, the mean and std of the training images are computed in the same pass
+    train_indices, val_indices = split_indices(len(dataset), .2)
+    print('decoding {} images, normalization on {} images'.format(len(dataset), len(train_indices)))
+    mean, std = dataset.cache_images(stack_file, train_indices)
+    return torch.tensor([mean], dtype=torch.float32), torch.tensor([std], dtype=torch.float32)
     
-def train(imgs_path, output_path, epochs=400, batch_size=2, lr=1e-4, flag=0, device=0, mode='train'):
+def train(imgs_path, output_path, epochs=400, batch_size=2, lr=1e-4, flag=0, device=0, mode='train', num_workers=0):
 
     num_epochs = epochs
     random_seed = 42
@@ -58,24 +44,19 @@ def train(imgs_path, output_path, epochs=400, batch_size=2, lr=1e-4, flag=0, dev
         DEVICE = 'cuda'
     else:
         DEVICE = 'cpu'
-    mean, std = norm(imgs_path, output_path, FLAG, mode, batch_size)
-    transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize((mean), (std))])
-    dataset = cryodata(imgs_path, output_path, flag=FLAG, mode = mode, transform=transform)
-    dataset_size = len(dataset)
-    indices = list(range(dataset_size))
-    split = int(np.floor((1-validation_split) * dataset_size))
-
-    if shuffle_dataset:
-        np.random.seed(random_seed)
-        np.random.shuffle(indices)
-    train_indices, val_indices = indices[:split], indices[split:]
+    dataset = cryodata(imgs_path, output_path, flag=FLAG, mode = mode)
+    mean, std = norm(dataset, output_path + '/images.npy')
+    dataset.transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize((mean), (std))])
+    train_indices, val_indices = split_indices(len(dataset), validation_split, random_seed, shuffle_dataset)
 
     train_sampler = SubsetRandomSampler(train_indices)
     valid_sampler = SubsetRandomSampler(val_indices)
     print('the train set size is: {} images'.format(len(train_sampler)))
     print('the validation set size is: {} images'.format(len(valid_sampler)))
-    train_loader = DataLoader(dataset, batch_size=batch_size, sampler=train_sampler)
-    validation_loader = DataLoader(dataset, batch_size=batch_size, sampler=valid_sampler)
+    train_loader = DataLoader(dataset, batch_size=batch_size, sampler=train_sampler, num_workers=num_workers,
+                              persistent_workers=num_workers > 0)
+    validation_loader = DataLoader(dataset, batch_size=batch_size, sampler=valid_sampler, num_workers=num_workers,
+                                   persistent_workers=num_workers > 0)
     
     im, p = next(iter(train_loader))
     if FLAG=='nma':
@@ -127,4 +108,5 @@ if __name__ == '__main__':
           int(sys.argv[4]),
           float(sys.argv[5]),
           int(sys.argv[6]),
-          int(sys.argv[7]))
\ No newline at end of file
+          int(sys.argv[7]),
+          num_workers=int(sys.argv[8]) if len(sys.argv) > 8 else 0)
\ No newline at end of file
@@ -1,10 +1,24 @@
 import numpy as np
+import os
 from pyworkflow.utils import runCommand
+from .pdb_handler import ContinuousFlexPDBHandler
 import pwem.emlib.metadata as md
 import re
+import json
+import hashlib
 import multiprocessing
+import itertools
+import warnings
 
 NUMBER_OF_CPU = int(np.min([multiprocessing.cpu_count(),4]))
+CACHE_KEY = "__cache_key__"
+LOG_CACHE_OFFSET = "__offset__"
+LOG_CACHE_HEAD = "__head__"
+LOG_CACHE_HEADER = "__header__"
+LOG_CACHE_HEAD_SIZE = 4096
+LOG_INFO_ROW = re.compile(rb"^INFO:[^\n]*", re.MULTILINE)
+# Number of frames read at once by the PCA of a trajectory
+PCA_CHUNK_SIZE = 1000
 
 EMFIT_NONE = 0
 EMFIT_VOLUMES = 1
@@ -60,47 +74,36 @@ PROJECTION_ANGLE_XMIPP=1
 PROJECTION_ANGLE_IMAGE=2
 
 def save_dcd(mol, coords_list, prefix):
+    """
+    Save a list of coordinates as a DCD trajectory
+    :param mol: ContinuousFlexPDBHandler of the structure
+    :param coords_list: list or array of (natom, 3) coordinates
+    :param str prefix: prefix of the output DCD file
+    :return None:
+    """
     print("> Saving DCD trajectory ...")
-    n_frames = len(coords_list)
-
-    # saving PDBs
-    mol = mol.copy()
-    for i in range(n_frames):
-        mol.coords = coords_list[i]
-        mol.write_pdb("%s_frame%i.pdb" % (prefix, i))
-
-    # VMD command
-    with open(prefix+"_cmd.tcl", "w") as f :
-        f.write("mol new %s_frame0.pdb\n" % prefix)
-        for i in range(1,n_frames):
-            f.write("mol addfile %s_frame%i.pdb\n" % (prefix, i))
-        f.write("animate write dcd %s.dcd\n" % prefix)
-        f.write('exit\n')
-
-    # Running VMD
-    runCommand("vmd -dispdev text -e %s_cmd.tcl" % prefix)
-
-    # Cleaning
-    for i in range(n_frames):
-        runCommand("rm -f %s_frame%i.pdb\n" % (prefix, i))
-    runCommand("rm -f %s_cmd.tcl" % prefix)
+    with DCDWriter(prefix + ".dcd", natom=mol.n_atoms) as dcd:
+        for coords in coords_list:
+            dcd.write(coords)
     print("\t Done \n")
 
 
 def lastPDBFromDCD(inputPDB,inputDCD,  outputPDB):
-
-    # EXTRACT PDB from dcd file
-    with open("%s_tmp_dcd2pdb.tcl" % outputPDB, "w") as f:
-        s = ""
-        s += "mol load pdb %s dcd %s\n" % (inputPDB, inputDCD)
-        s += "set nf [molinfo top get numframes]\n"
-        s += "[atomselect top all frame [expr $nf - 1]] writepdb %s\n" % outputPDB
-        s += "exit\n"
-        f.write(s)
-    runCommand("vmd -dispdev text -e %s_tmp_dcd2pdb.tcl" % outputPDB)
-
-    # CLEAN TMP FILES
-    runCommand("rm -f %s_tmp_dcd2pdb.tcl" % (outputPDB))
+    """
+    Extract the last frame of a DCD trajectory as a PDB file
+    :param str inputPDB: PDB file of the structure of the trajectory
+    :param str inputDCD: DCD trajectory file
+    :param str outputPDB: output PDB file
+    :return None:
+    """
+    traj = DCDTrajectory(inputDCD)
+    if len(traj) == 0:
+        print("Warning : No frame in DCD file %s" % inputDCD)
+        return
+    mol = ContinuousFlexPDBHandler(inputPDB)
+    mol.coords = np.array(traj[-1], dtype=float)
+    traj.close()
+    mol.write_pdb(outputPDB)
 
 def buildParallelScript(commands,numberOfThreads=1,  raiseError=True):
     """
@@ -279,163 +282,605 @@ def getAngularShiftDist(angle1MetaFile, angle2MetaData, angle2Idx, tmpPrefix, sy
     return angDist, shftDist
 
 
-def readLogFile(log_file):
-    with open(log_file,"r") as file:
-        header = None
-        dic = {}
-        for line in file:
-            if line.startswith("INFO:"):
-                if header is None:
-                    header = line.split()
-                    for i in range(1,len(header)):
-                        dic[header[i]] = []
-                else:
-                    splitline = line.split()
-                    if len(splitline) == len(header):
-                        for i in range(1,len(header)):
-                            try :
-                                dic[header[i]].append(float(splitline[i]))
-                            except ValueError:
-                                pass
+class GenesisLogReader:
+    """
+    Columnar reader of the "INFO:" rows of a GENESIS log file.
+    Each call to update() only parses the lines written since the previous call, so that a log
+    that is still growing can be tailed. The parsed columns can be cached as .npz next to the log.
+    """
 
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.cache_file = log_file + ".npz"
+        self.offset = 0
+        self.header = None
+        self._columns = {}
+
+    def update(self):
+        """
+        Parse the complete lines added to the log file since the last update
+        :return dict: time series of each column of the log
+        """
+        with open(self.log_file, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end > 0:
+            self._parseRows(LOG_INFO_ROW.findall(data, 0, end))
+            self.offset += end
+        return self.getColumns()
+
+    def getColumns(self):
+        return {k: np.concatenate(v) if len(v) > 0 else np.zeros(0) for k, v in self._columns.items()}
+
+    def _parseRows(self, lines):
+        if self.header is None:
+            if len(lines) == 0:
+                return
+            self.header = lines[0].decode().split()
+            self._columns = {k: [] for k in self.header[1:]}
+            lines = lines[1:]
+
+        n_values = len(self.header) - 1
+        counts = np.fromiter(map(len, map(bytes.split, lines)), dtype=int, count=len(lines))
+        rows = list(itertools.compress(lines, counts == len(self.header)))
+        if len(rows) == 0:
+            return
+        try:
+            with warnings.catch_warnings():
+                # Older numpy only warns and returns the values parsed before an unparseable one
+                warnings.simplefilter("ignore", DeprecationWarning)
+                values = np.fromstring(b" ".join([r[5:] for r in rows]), sep=" ")
+        except ValueError:
+            values = np.zeros(0)
+        if values.size == len(rows) * n_values:
+            columns = values.reshape(len(rows), n_values).T
+        else:
+            # Some values can not be parsed (e.g. repeated header, overflow), skip them per column
+            tokens = np.array([r.split()[1:] for r in rows])
+            columns = [_parseFloats(tokens[:, i]) for i in range(n_values)]
+        for i in range(n_values):
+            self._columns[self.header[i + 1]].append(columns[i])
+
+    def _headHash(self):
+        # The beginning of the log and the bytes just before the offset are hashed : a rerun
+        # rewrites the same GENESIS header, usually longer than LOG_CACHE_HEAD_SIZE
+        sha1 = hashlib.sha1()
+        with open(self.log_file, "rb") as f:
+            sha1.update(f.read(min(self.offset, LOG_CACHE_HEAD_SIZE)))
+            tail = max(self.offset - LOG_CACHE_HEAD_SIZE, 0)
+            f.seek(tail)
+            sha1.update(f.read(self.offset - tail))
+        return sha1.hexdigest()
+
+    def loadCache(self):
+        """
+        Restore the columns parsed from a previous version of the log file
+        :return bool: True if the cache matches the beginning of the log file
+        """
+        try:
+            with np.load(self.cache_file) as cache:
+                self.offset = int(cache[LOG_CACHE_OFFSET])
+                if os.path.getsize(self.log_file) < self.offset or self._headHash() != str(cache[LOG_CACHE_HEAD]):
+                    raise ValueError("Outdated cache")
+                header = [str(k) for k in cache[LOG_CACHE_HEADER]]
+                self.header = header if len(header) > 0 else None
+                self._columns = {k: [cache[k]] for k in header[1:]}
+            return True
+        except (OSError, ValueError, KeyError):
+            self.offset = 0
+            self.header = None
+            self._columns = {}
+            return False
+
+    def saveCache(self):
+        arrays = {LOG_CACHE_OFFSET: np.array(self.offset), LOG_CACHE_HEAD: np.array(self._headHash()),
+                  LOG_CACHE_HEADER: np.array(self.header if self.header is not None else [], dtype=str)}
+        arrays.update(self.getColumns())
+        try:
+            np.savez(self.cache_file, **arrays)
+        except OSError:
+            print("Warning : Can not write cache file %s" % self.cache_file)
+
+    @classmethod
+    def concatenate(cls, log_file, log_files):
+        """
+        Cache the columns of a log file made of the concatenation of other log files, from their own
+        cached columns. Nothing is done if the log files do not share the same header.
+        :param str log_file: concatenated log file
+        :param list log_files: log files that were concatenated
+        """
+        readers = []
+        for f in log_files:
+            reader = cls(f)
+            if not reader.loadCache():
+                reader.update()
+            if reader.offset != os.path.getsize(f) or (len(readers) > 0 and reader.header != readers[0].header):
+                return
+            readers.append(reader)
+        if len(readers) == 0 or readers[0].header is None:
+            return
+        reader = cls(log_file)
+        reader.header = readers[0].header
+        reader.offset = sum([r.offset for r in readers])
+        reader._columns = {k: sum([r._columns[k] for r in readers], []) for k in reader.header[1:]}
+        if reader.offset == os.path.getsize(log_file):
+            reader.saveCache()
+
+
+def _parseFloats(values):
+    try:
+        return values.astype(float)
+    except ValueError:
+        floats = []
+        for v in values:
+            try :
+                floats.append(float(v))
+            except ValueError:
+                pass
+        return np.array(floats)
+
+
+def readLogFile(log_file, cache=True):
+    """
+    Read the time series of a GENESIS log file
+    :param str log_file: GENESIS log file
+    :param bool cache: reuse/update the columns cached next to the log file
+    :return dict: time series of each column of the log
+    """
+    reader = GenesisLogReader(log_file)
+    cached = cache and reader.loadCache()
+    offset = reader.offset
+    dic = reader.update()
+    if cache and (not cached or reader.offset != offset):
+        reader.saveCache()
     return dic
 
-def dcd2numpyArr(filename):
-    print("> Reading dcd file %s"%filename)
+
+def readLogFiles(log_files, numberOfThreads=NUMBER_OF_CPU):
+    """
+    Read a set of GENESIS log files in parallel
+    :param list log_files: GENESIS log files
+    :param int numberOfThreads: number of processes
+    :return list: dict of time series for each log file
+    """
+    return _parallelMap(readLogFile, log_files, numberOfThreads)
+
+
+def rmsdTimeSeries(dcdFiles, inputPDBs, targetPDBs, idx_matching_atoms, align=False,
+                   numberOfThreads=NUMBER_OF_CPU):
+    """
+    RMSD time series of a set of trajectories to their target PDB, computed in parallel (one process per
+    trajectory). Each time series is cached next to its DCD file and reused as long as the DCD and PDB
+    files are not modified.
+    :param list dcdFiles: DCD trajectories
+    :param list inputPDBs: initial PDB of each trajectory
+    :param list targetPDBs: target PDB of each trajectory
+    :param idx_matching_atoms: index of matching atoms between the input PDBs and the target PDBs
+    :param bool align: rigid body align the frames on the target before computing the RMSD
+    :param int numberOfThreads: number of processes
+    :return list: RMSD of the initial PDB followed by the RMSD of each frame, for each trajectory
+    """
+    params = dict(align=bool(align), atoms=hashlib.sha1(np.ascontiguousarray(idx_matching_atoms)).hexdigest())
+    cacheFiles = [os.path.splitext(f)[0] + "_rmsd.npz" for f in dcdFiles]
+    sources = [[dcdFiles[i], inputPDBs[i], targetPDBs[i]] for i in range(len(dcdFiles))]
+    rmsd = []
+    for i in range(len(dcdFiles)):
+        cache = loadAnalysisCache(cacheFiles[i], sources=sources[i], params=params)
+        rmsd.append(None if cache is None else cache["rmsd"])
+    missing = [i for i in range(len(dcdFiles)) if rmsd[i] is None]
+
+    # Read each PDB only once
+    coords = {}
+    for i in missing:
+        for fn, col in [(inputPDBs[i], 0), (targetPDBs[i], 1)]:
+            if (fn, col) not in coords:
+                coords[(fn, col)] = ContinuousFlexPDBHandler(fn).coords[idx_matching_atoms[:, col]]
+
+    tasks = [(dcdFiles[i], coords[(inputPDBs[i], 0)], coords[(targetPDBs[i], 1)],
+              idx_matching_atoms[:, 0], align) for i in missing]
+    for i, rmsd_i in zip(missing, _parallelMap(_rmsdTimeSeriesWorker, tasks, numberOfThreads)):
+        saveAnalysisCache(cacheFiles[i], sources=sources[i], params=params, rmsd=rmsd_i)
+        rmsd[i] = rmsd_i
+    return rmsd
+
+
+def readPDBCoords(pdbFiles, atoms=None, numberOfThreads=NUMBER_OF_CPU):
+    """
+    Read the coordinates of a set of PDB files in parallel
+    :param list pdbFiles: PDB files
+    :param atoms: index of the atoms to keep (default all)
+    :param int numberOfThreads: number of processes
+    :return list: (natom, 3) coordinates of each PDB
+    """
+    return _parallelMap(_readPDBCoordsWorker, [(f, atoms) for f in pdbFiles], numberOfThreads)
+
+
+def _readPDBCoordsWorker(task):
+    pdbFile, atoms = task
+    coords = ContinuousFlexPDBHandler(pdbFile).coords
+    return coords if atoms is None else coords[atoms]
+
+
+def _rmsdTimeSeriesWorker(task):
+    dcdFile, inputCoords, targetCoords, atoms, align = task
+    traj = DCDTrajectory(dcdFile)
+    rmsd = np.concatenate((
+        ContinuousFlexPDBHandler.getRMSDBatch(targetCoords, inputCoords[None], align=align),
+        ContinuousFlexPDBHandler.getRMSDBatch(targetCoords, traj.coords, align=align, atoms=atoms)))
+    traj.close()
+    return rmsd
+
+
+def _parallelMap(func, tasks, numberOfThreads):
+    if numberOfThreads > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(numberOfThreads, len(tasks))) as pool:
+            return pool.map(func, tasks)
+    return [func(t) for t in tasks]
+
+
+def _analysisCacheKey(sources, params):
+    stats = [(f, os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in sources]
+    return json.dumps({"sources": stats, "params": params}, sort_keys=True)
+
+
+def loadAnalysisCache(cacheFile, sources, params=None):
+    """
+    Load arrays cached by saveAnalysisCache
+    :param str cacheFile: .npz cache file
+    :param list sources: files the cached arrays were computed from
+    :param dict params: parameters the cached arrays were computed with
+    :return dict: cached arrays, None if there is no cache or if the sources or parameters changed
+    """
+    if not os.path.isfile(cacheFile):
+        return None
+    try:
+        with np.load(cacheFile) as cache:
+            if str(cache[CACHE_KEY]) != _analysisCacheKey(sources, params):
+                return None
+            return {k: cache[k] for k in cache.files if k != CACHE_KEY}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def saveAnalysisCache(cacheFile, sources, params=None, **arrays):
+    """
+    Save arrays computed from a set of files, with the modification time of the files
+    :param str cacheFile: .npz cache file
+    :param list sources: files the arrays were computed from
+    :param dict params: parameters the arrays were computed with
+    :param arrays: arrays to save
+    """
+    try:
+        np.savez(cacheFile, **{CACHE_KEY: np.array(_analysisCacheKey(sources, params))}, **arrays)
+    except OSError:
+        print("Warning : Can not write cache file %s" % cacheFile)
+
+
+def readDCDHeader(f):
+    """
+    Read the header of a DCD file
+    :param f: DCD file object opened in binary mode, positioned at the beginning of the file
+    :return dict: header fields ; the file is left positioned after the header
+    """
     BYTESIZE = 4
-    with open(filename, 'rb') as f:
-
-        # Header
-        # ---------------- INIT
-
-        start_size = int.from_bytes((f.read(BYTESIZE)), "little")
-        crd_type = f.read(BYTESIZE).decode('ascii')
-        nframe = int.from_bytes((f.read(BYTESIZE)), "little")
-        start_frame = int.from_bytes((f.read(BYTESIZE)), "little")
-        len_frame = int.from_bytes((f.read(BYTESIZE)), "little")
-        len_total = int.from_bytes((f.read(BYTESIZE)), "little")
-        for i in range(5):
-            f.read(BYTESIZE)
-        time_step = np.frombuffer(f.read(BYTESIZE), dtype=np.float32)
-        for i in range(9):
-            f.read(BYTESIZE)
-        charmm_version = int.from_bytes((f.read(BYTESIZE)), "little")
-
-        end_size = int.from_bytes((f.read(BYTESIZE)), "little")
-
-        if end_size != start_size:
-            raise RuntimeError("Can not read dcd file")
-
-        # ---------------- TITLE
-        start_size = int.from_bytes((f.read(BYTESIZE)), "little")
-        ntitle = int.from_bytes((f.read(BYTESIZE)), "little")
-        tilte_rd = f.read(BYTESIZE*20 * ntitle)
-        try :
-            title = tilte_rd.encode("ascii")
-        except AttributeError:
-            title = str(tilte_rd)
-        end_size = int.from_bytes((f.read(BYTESIZE)), "little")
-
-        if end_size != start_size:
-            raise RuntimeError("Can not read dcd file")
-
-        # ---------------- NATOM
-        start_size = int.from_bytes((f.read(BYTESIZE)), "little")
-        natom = int.from_bytes((f.read(BYTESIZE)), "little")
-        end_size = int.from_bytes((f.read(BYTESIZE)), "little")
-
-        if end_size != start_size:
-            raise RuntimeError("Can not read dcd file")
-
-        # ----------------- DCD COORD
-        dcd_arr =  np.zeros((nframe, natom, 3), dtype=np.float32)
-        for i in range(nframe):
-            for j in range(3):
+    header = {}
+
+    # ---------------- INIT
+    start_size = int.from_bytes((f.read(BYTESIZE)), "little")
+    header["crd_type"] = f.read(BYTESIZE).decode('ascii')
+    header["nframe"] = int.from_bytes((f.read(BYTESIZE)), "little")
+    header["start_frame"] = int.from_bytes((f.read(BYTESIZE)), "little")
+    header["len_frame"] = int.from_bytes((f.read(BYTESIZE)), "little")
+    header["len_total"] = int.from_bytes((f.read(BYTESIZE)), "little")
+    for i in range(5):
+        f.read(BYTESIZE)
+    header["time_step"] = np.frombuffer(f.read(BYTESIZE), dtype=np.float32)
+    for i in range(9):
+        f.read(BYTESIZE)
+    header["charmm_version"] = int.from_bytes((f.read(BYTESIZE)), "little")
+
+    end_size = int.from_bytes((f.read(BYTESIZE)), "little")
+
+    if end_size != start_size:
+        raise RuntimeError("Can not read dcd file")
+
+    # ---------------- TITLE
+    start_size = int.from_bytes((f.read(BYTESIZE)), "little")
+    ntitle = int.from_bytes((f.read(BYTESIZE)), "little")
+    tilte_rd = f.read(BYTESIZE*20 * ntitle)
+    try :
+        header["title"] = tilte_rd.encode("ascii")
+    except AttributeError:
+        header["title"] = str(tilte_rd)
+    end_size = int.from_bytes((f.read(BYTESIZE)), "little")
+
+    if end_size != start_size:
+        raise RuntimeError("Can not read dcd file")
+
+    # ---------------- NATOM
+    start_size = int.from_bytes((f.read(BYTESIZE)), "little")
+    header["natom"] = int.from_bytes((f.read(BYTESIZE)), "little")
+    end_size = int.from_bytes((f.read(BYTESIZE)), "little")
+
+    if end_size != start_size:
+        raise RuntimeError("Can not read dcd file")
+
+    return header
+
+
+class DCDTrajectory:
+    """
+    Random-access reader of a DCD trajectory.
+    The frame layout is indexed once from the header and the first frame, then the coordinates
+    are exposed as a read-only (nframe, natom, 3) float32 view of a np.memmap of the file.
+    Frames are only read from disk when they are accessed :
+        traj[i]              -> frame i (natom, 3)
+        traj[a:b:step]       -> frames a, a+step, ... (view, no copy)
+        traj[a:b, atom_idx]  -> subset of atoms of a set of frames
+    """
 
-                start_size = int.from_bytes((f.read(BYTESIZE)), "little")
-                while (start_size != BYTESIZE * natom and start_size != 0):
-                    # print("\n-- UNKNOWN %s -- " % start_size)
-
-                    f.read(start_size)
-                    end_size = int.from_bytes((f.read(BYTESIZE)), "little")
-                    if end_size != start_size:
-                        raise RuntimeError("Can not read dcd file")
-                    start_size = int.from_bytes((f.read(BYTESIZE)), "little")
-
-                bin_arr = f.read(BYTESIZE * natom)
-                if len(bin_arr) == BYTESIZE * natom:
-                    dcd_arr[i, :, j] = np.frombuffer(bin_arr, dtype=np.float32)
-                else:
-                    break
+    BYTESIZE = 4
+
+    def __init__(self, filename):
+        print("> Reading dcd file %s"%filename)
+        self.filename = filename
+        BYTESIZE = self.BYTESIZE
+        with open(filename, 'rb') as f:
+            self.header = readDCDHeader(f)
+            self.n_atoms = self.header["natom"]
+            frame_start = f.tell()
+
+            # Skip optional blocks preceding the coordinates (e.g. unit cell)
+            start_size = int.from_bytes((f.read(BYTESIZE)), "little")
+            while (start_size != BYTESIZE * self.n_atoms and start_size != 0):
+                f.read(start_size)
                 end_size = int.from_bytes((f.read(BYTESIZE)), "little")
                 if end_size != start_size:
-                    if i>1:
-                        break
-                    else:
-                        # pass
-                        raise RuntimeError("Can not read dcd file %i %i " % (start_size, end_size))
+                    raise RuntimeError("Can not read dcd file")
+                start_size = int.from_bytes((f.read(BYTESIZE)), "little")
+            coord_start = f.tell()
+
+            # Each frame stores X, Y and Z as consecutive records
+            self._block_size = BYTESIZE * self.n_atoms + 2 * BYTESIZE
+            self._frame_size = coord_start - frame_start + 3 * self._block_size - BYTESIZE
+            f.seek(0, 2)
+            file_size = f.tell()
+
+        self.header_size = frame_start
+        n_available = max(file_size - frame_start, 0) // self._frame_size
+        self.n_frames = min(self.header["nframe"], n_available)
+        self.frame_offsets = frame_start + np.arange(self.n_frames, dtype=np.int64) * self._frame_size
+
+        if self.n_frames > 0:
+            self._mmap = np.memmap(filename, dtype=np.uint8, mode="r")
+            self.coords = np.ndarray(shape=(self.n_frames, self.n_atoms, 3), dtype="<f4", buffer=self._mmap,
+                                     offset=coord_start, strides=(self._frame_size, BYTESIZE, self._block_size))
+        else:
+            self._mmap = None
+            self.coords = np.zeros((0, self.n_atoms, 3), dtype=np.float32)
 
         print("\t -- Summary of DCD file -- ")
-        print("\t\t crd_type  : %s"%crd_type)
-        print("\t\t nframe  : %s"%nframe)
-        print("\t\t len_frame  : %s"%len_frame)
-        print("\t\t len_total  : %s"%len_total)
-        print("\t\t time_step  : %s"%time_step)
-        print("\t\t charmm_version  : %s"%charmm_version)
-        print("\t\t title  : %s"%title)
-        print("\t\t natom  : %s"%natom)
-    print("\t Done \n")
+        print("\t\t crd_type  : %s"%self.header["crd_type"])
+        print("\t\t nframe  : %s"%self.n_frames)
+        print("\t\t len_frame  : %s"%self.header["len_frame"])
+        print("\t\t len_total  : %s"%self.header["len_total"])
+        print("\t\t time_step  : %s"%self.header["time_step"])
+        print("\t\t charmm_version  : %s"%self.header["charmm_version"])
+        print("\t\t title  : %s"%self.header["title"])
+        print("\t\t natom  : %s"%self.n_atoms)
+        print("\t Done \n")
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, item):
+        return self.coords[item]
+
+    def __iter__(self):
+        for i in range(self.n_frames):
+            yield np.array(self.coords[i])
+
+    @property
+    def shape(self):
+        return self.coords.shape
+
+    def frames(self, frames=None, atoms=None):
+        """
+        Get a dense copy of a subset of the trajectory
+        :param frames: slice or list of frame indexes (default all)
+        :param atoms: list of atom indexes (default all)
+        :return np.ndarray: (nframe, natom, 3) float32 coordinates
+        """
+        coords = self.coords if frames is None else self.coords[frames]
+        if atoms is not None:
+            coords = coords[:, atoms]
+        return np.array(coords, dtype=np.float32)
 
-    return dcd_arr
+    def close(self):
+        self.coords = None
+        self._mmap = None
 
 
-def numpyArr2dcd(arr, filename, start_frame=1, len_frame=1, time_step=1.0, title=None):
-    print("> Wrinting dcd file %s"%filename)
+def dcd2numpyArr(filename):
+    return DCDTrajectory(filename).frames()
+
+
+def dcdPCA(filename, n_components, chunk_size=PCA_CHUNK_SIZE):
+    """
+    PCA of the frames of a DCD trajectory, fitted (incremental PCA) and applied by blocks of frames read from the
+    memory-mapped file, the trajectory is never loaded at once
+    :param filename: DCD file
+    :param n_components: number of principal components
+    :param chunk_size: number of frames read at once
+    :return: fitted IncrementalPCA, and (nframe, n_components) coordinates of the frames in the principal components
+    """
+    from sklearn.decomposition import IncrementalPCA
+    traj = DCDTrajectory(filename)
+    nframe = traj.n_frames
+    # Each block must have at least n_components frames, a shorter last block is merged with the previous one
+    bounds = list(range(0, nframe, max(chunk_size, n_components))) + [nframe]
+    if len(bounds) > 2 and bounds[-1] - bounds[-2] < n_components:
+        del bounds[-2]
+    blocks = list(zip(bounds[:-1], bounds[1:]))
+
+    pca = IncrementalPCA(n_components=n_components)
+    for start, end in blocks:
+        pca.partial_fit(traj.coords[start:end].reshape(end - start, traj.n_atoms * 3))
+    Y = np.zeros((nframe, n_components))
+    for start, end in blocks:
+        Y[start:end] = pca.transform(traj.coords[start:end].reshape(end - start, traj.n_atoms * 3))
+    traj.close()
+    return pca, Y
+
+
+def writeDCDHeader(f, nframe, natom, start_frame=1, len_frame=1, time_step=1.0, title=None):
+    """
+    Write the header of a DCD file
+    :param f: DCD file object opened in binary mode
+    :param nframe: number of frames
+    :param natom: number of atoms
+    :param start_frame: index of the first frame
+    :param len_frame: number of steps between frames
+    :param time_step: time step
+    :param title: title of the file
+    """
     BYTESIZE = 4
-    nframe, natom, _ = arr.shape
     len_total=nframe*len_frame
     charmm_version=24
     if title is None:
         title = "DCD file generated by Continuous Flex plugin"
     ntitle = (len(title)//(20*BYTESIZE)) + 1
-    with open(filename, 'wb') as f:
-        zeroByte = int.to_bytes(0, BYTESIZE, "little")
-
-        # Header
-        # ---------------- INIT
-        f.write(int.to_bytes(21*BYTESIZE ,BYTESIZE, "little"))
-        f.write(b'CORD')
-        f.write(int.to_bytes(nframe, BYTESIZE, "little"))
-        f.write(int.to_bytes(start_frame, BYTESIZE, "little"))
-        f.write(int.to_bytes(len_frame, BYTESIZE, "little"))
-        f.write(int.to_bytes(len_total, BYTESIZE, "little"))
-        for i in range(5):
-            f.write(zeroByte)
-        f.write(np.float32(time_step).tobytes())
-        for i in range(9):
-            f.write(zeroByte)
-        f.write(int.to_bytes(charmm_version, BYTESIZE, "little"))
-
-        f.write(int.to_bytes(21*BYTESIZE,BYTESIZE, "little"))
-
-        # ---------------- TITLE
-        f.write(int.to_bytes((ntitle*20+1)*BYTESIZE ,BYTESIZE, "little"))
-        f.write(int.to_bytes(ntitle ,BYTESIZE, "little"))
-        f.write(title.ljust(20*BYTESIZE).encode("ascii"))
-        f.write(int.to_bytes((ntitle*20+1)*BYTESIZE ,BYTESIZE, "little"))
-
-        # ---------------- NATOM
-        f.write(int.to_bytes(BYTESIZE ,BYTESIZE, "little"))
-        f.write(int.to_bytes(natom ,BYTESIZE, "little"))
-        f.write(int.to_bytes(BYTESIZE ,BYTESIZE, "little"))
-
-        # ----------------- DCD COORD
-        for i in range(nframe):
-            for j in range(3):
-                f.write(int.to_bytes(BYTESIZE*natom, BYTESIZE, "little"))
-                f.write(np.float32(arr[i, :, j]).tobytes())
-                f.write(int.to_bytes(BYTESIZE*natom, BYTESIZE, "little"))
-    print("\t Done \n")
+    zeroByte = int.to_bytes(0, BYTESIZE, "little")
+
+    # ---------------- INIT
+    f.write(int.to_bytes(21*BYTESIZE ,BYTESIZE, "little"))
+    f.write(b'CORD')
+    f.write(int.to_bytes(nframe, BYTESIZE, "little"))
+    f.write(int.to_bytes(start_frame, BYTESIZE, "little"))
+    f.write(int.to_bytes(len_frame, BYTESIZE, "little"))
+    f.write(int.to_bytes(len_total, BYTESIZE, "little"))
+    for i in range(5):
+        f.write(zeroByte)
+    f.write(np.float32(time_step).tobytes())
+    for i in range(9):
+        f.write(zeroByte)
+    f.write(int.to_bytes(charmm_version, BYTESIZE, "little"))
+
+    f.write(int.to_bytes(21*BYTESIZE,BYTESIZE, "little"))
+
+    # ---------------- TITLE
+    f.write(int.to_bytes((ntitle*20+1)*BYTESIZE ,BYTESIZE, "little"))
+    f.write(int.to_bytes(ntitle ,BYTESIZE, "little"))
+    f.write(title.ljust(20*BYTESIZE).encode("ascii"))
+    f.write(int.to_bytes((ntitle*20+1)*BYTESIZE ,BYTESIZE, "little"))
+
+    # ---------------- NATOM
+    f.write(int.to_bytes(BYTESIZE ,BYTESIZE, "little"))
+    f.write(int.to_bytes(natom ,BYTESIZE, "little"))
+    f.write(int.to_bytes(BYTESIZE ,BYTESIZE, "little"))
+
+
+class DCDWriter:
+    """
+    Incremental writer of a DCD trajectory, to be used as a context manager :
+        with DCDWriter(filename) as dcd:
+            for coords in ...:
+                dcd.write(coords)
+    Frames are written to disk as they come, one at a time (natom, 3) or in batches
+    (nframe, natom, 3), and the frame count of the header is patched after each write.
+    With append=True, frames are added at the end of an existing DCD file, after the complete
+    frames found in the file (the file may not have been closed, e.g. interrupted run).
+    """
+
+    BYTESIZE = 4
+    NFRAME_OFFSET = 8
+    LEN_TOTAL_OFFSET = 20
+
+    def __init__(self, filename, natom=None, append=False, start_frame=1, len_frame=1, time_step=1.0, title=None):
+        print("> Writing dcd file %s"%filename)
+        self.filename = filename
+        self.natom = natom
+        self.n_frames = 0
+        self.len_frame = len_frame
+        self._header_args = dict(start_frame=start_frame, len_frame=len_frame, time_step=time_step, title=title)
+
+        if append and os.path.isfile(filename) and os.path.getsize(filename) > 0:
+            traj = DCDTrajectory(filename)
+            if traj._frame_size != 3 * traj._block_size:
+                raise RuntimeError("Can not append to dcd file %s : unsupported frame layout" % filename)
+            if natom is not None and natom != traj.n_atoms:
+                raise RuntimeError("Can not append %i atoms to dcd file of %i atoms" % (natom, traj.n_atoms))
+            self.natom = traj.n_atoms
+            # The frame count of the header is not reliable if the file was not closed, count the frames on disk
+            self.n_frames = (os.path.getsize(filename) - traj.header_size) // traj._frame_size
+            self.len_frame = traj.header["len_frame"]
+            end = traj.header_size + self.n_frames * traj._frame_size
+            traj.close()
+            self._file = open(filename, 'r+b')
+            # Drop any incomplete frame at the end of the file
+            self._file.truncate(end)
+            self._writeFrameCount()
+            self._file.seek(end)
+        else:
+            self._file = open(filename, 'wb')
+            if self.natom is not None:
+                writeDCDHeader(self._file, 0, self.natom, **self._header_args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, coords):
+        """
+        Append frames to the trajectory
+        :param coords: (natom, 3) frame or (nframe, natom, 3) batch of frames
+        """
+        coords = np.asarray(coords)
+        if coords.ndim == 2:
+            coords = coords[None]
+        nframe, natom, _ = coords.shape
+        if self.natom is None:
+            self.natom = natom
+            writeDCDHeader(self._file, 0, self.natom, **self._header_args)
+        elif natom != self.natom:
+            raise RuntimeError("Can not write %i atoms in dcd file of %i atoms" % (natom, self.natom))
+
+        # One record per coordinate axis : [size] x1 ... xN [size]
+        records = np.empty((nframe, 3, natom + 2), dtype="<i4")
+        records[:, :, 0] = records[:, :, -1] = self.BYTESIZE * natom
+        records[:, :, 1:-1] = coords.transpose(0, 2, 1).astype("<f4").view("<i4")
+        self._file.write(records.tobytes())
+        self.n_frames += nframe
+        end = self._file.tell()
+        self._writeFrameCount()
+        self._file.seek(end)
+
+    def _writeFrameCount(self):
+        """ Patch the frame count of the header with the frames written so far """
+        self._file.seek(self.NFRAME_OFFSET)
+        self._file.write(int.to_bytes(self.n_frames, self.BYTESIZE, "little"))
+        self._file.seek(self.LEN_TOTAL_OFFSET)
+        self._file.write(int.to_bytes(self.n_frames * self.len_frame, self.BYTESIZE, "little"))
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.natom is None:
+            writeDCDHeader(self._file, 0, 0, **self._header_args)
+        self._writeFrameCount()
+        self._file.close()
+        self._file = None
+        print("\t Done \n")
+
+
+def numpyArr2dcd(arr, filename, start_frame=1, len_frame=1, time_step=1.0, title=None):
+    nframe, natom, _ = arr.shape
+    with DCDWriter(filename, natom, start_frame=start_frame, len_frame=len_frame,
+                   time_step=time_step, title=title) as dcd:
+        dcd.write(arr)
 
 def existsCommand(name):
     from shutil import which
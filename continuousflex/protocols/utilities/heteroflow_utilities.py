@@ -0,0 +1,172 @@
+"""
+Out-of-core analysis of a set of optical flows.
+
+The flows are stacked once in a memory-mapped float32 array (one flattened flow per row), then the matrix of inner
+products between flows (Gram matrix) is computed as a blocked matrix product X @ X.T, with tiles sized to the
+available memory.
+
+The flows of the animations are mapped back from vectors g of the space of the rows of the Gram matrix, as X^+ g. With
+the thin SVD X = U S V^T, where U and S^2 are the eigenvectors and eigenvalues of the Gram matrix, X^+ g = V S^-1 U^T g.
+Only the first components V^T = S^-1 U^T X (rank, 3*X*Y*Z) are kept, they are computed by reading the flows once, so
+that the memory scales with the rank and not with the number of flows.
+"""
+
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Fraction of the available memory used by the tiles of the Gram matrix
+GRAM_MEMORY_FRACTION = 0.25
+DEFAULT_AVAILABLE_MEMORY = 2 * 1024 ** 3
+# Eigenvalues of the Gram matrix below this fraction of the largest one are discarded
+FLOW_RANK_TOLERANCE = 1e-10
+FLOW_COMPONENTS = "flow_components.npy"
+FLOW_FACTORS = "flow_factors.npz"
+
+
+def availableMemory():
+    """
+    :return int: available physical memory in bytes (or a default value if it can not be found)
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return DEFAULT_AVAILABLE_MEMORY
+
+
+def writeFlowStack(read_flow, N, stack_file):
+    """
+    Stack the optical flows in a .npy file, each flow is read once
+    :param callable read_flow: function returning the flow (3, X, Y, Z) of a volume number (starting at 1)
+    :param int N: number of flows
+    :param str stack_file: output .npy file (N, 3*X*Y*Z)
+    :return np.memmap: the stack
+    """
+    flow = read_flow(1)
+    stack = open_memmap(stack_file, mode="w+", dtype=np.float32, shape=(N, flow.size))
+    for i in range(N):
+        print('reading optical flow ', i + 1)
+        if i > 0:
+            flow = read_flow(i + 1)
+        stack[i] = flow.reshape(-1)
+    stack.flush()
+    return stack
+
+
+def gramBlockSize(N, dim, memory=None):
+    """
+    :param int N: number of rows
+    :param int dim: length of the rows
+    :param int memory: memory for the tiles in bytes, a fraction of the available memory by default
+    :return int: number of rows of the tiles
+    """
+    if memory is None:
+        memory = availableMemory() * GRAM_MEMORY_FRACTION
+    # Two tiles of rows, in float32 and float64
+    return int(np.clip(memory // (2 * dim * 12), 1, N))
+
+
+def blockedGramMatrix(stack, block_size=None):
+    """
+    Compute the matrix of inner products X @ X.T of the rows of a (memory-mapped) stack, by tiles
+    :param np.ndarray stack: rows (N, dim)
+    :param int block_size: number of rows of the tiles, sized to the available memory by default
+    :return np.ndarray: Gram matrix (N, N)
+    """
+    N, dim = stack.shape
+    if block_size is None:
+        block_size = gramBlockSize(N, dim)
+    G = np.zeros((N, N))
+    for i0 in range(0, N, block_size):
+        i1 = min(i0 + block_size, N)
+        print('finding the correlation matrix rows ', i0 + 1, ' to ', i1)
+        # Accumulate in double precision, as the flows are long vectors
+        A = np.asarray(stack[i0:i1], dtype=np.float64)
+        G[i0:i1, i0:i1] = A @ A.T
+        for j0 in range(i1, N, block_size):
+            j1 = min(j0 + block_size, N)
+            tile = A @ np.asarray(stack[j0:j1], dtype=np.float64).T
+            G[i0:i1, j0:j1] = tile
+            G[j0:j1, i0:i1] = tile.T
+    return G
+
+
+def gramFactors(G, rank=0):
+    """
+    :param np.ndarray G: Gram matrix of the flows (N, N)
+    :param int rank: number of factors kept, 0 for all the non null ones
+    :return tuple: eigenvectors U (N, rank) and singular values s (rank,) of the flows, by decreasing value
+    """
+    eigenvalues, U = np.linalg.eigh((G + G.T) / 2.0)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues, U = eigenvalues[order], U[:, order]
+    keep = eigenvalues > FLOW_RANK_TOLERANCE * max(eigenvalues[0], 0.0)
+    if rank > 0:
+        keep[rank:] = False
+    return U[:, keep], np.sqrt(eigenvalues[keep])
+
+
+def writeFlowComponents(read_flow, G, components_file, factors_file, rank=0, block_size=None):
+    """
+    Compute the first right singular vectors of the flows V^T = S^-1 U^T X, each flow is read once
+    :param callable read_flow: function returning the flow (3, X, Y, Z) of a volume number (starting at 1)
+    :param np.ndarray G: Gram matrix of the flows (N, N)
+    :param str components_file: output .npy file of the components (rank, 3*X*Y*Z)
+    :param str factors_file: output .npz file with U, s and the shape of the flows
+    :param int rank: number of components, 0 for all
+    :param int block_size: number of flows read at once, sized to the available memory by default
+    :return int: number of components
+    """
+    U, s = gramFactors(G, rank)
+    N = len(U)
+    W = (U / s).astype(np.float32)
+    flow = np.asarray(read_flow(1), dtype=np.float32)
+    shape = flow.shape
+    if block_size is None:
+        block_size = gramBlockSize(N, flow.size)
+    components = open_memmap(components_file, mode="w+", dtype=np.float32, shape=(len(s), flow.size))
+    block = np.empty((min(block_size, N), flow.size), dtype=np.float32)
+    product = np.empty((len(s), flow.size), dtype=np.float32)
+    # The components are accumulated once per block of flows
+    for j0 in range(0, N, block_size):
+        j1 = min(j0 + block_size, N)
+        for j in range(j0, j1):
+            print('reading optical flow ', j + 1)
+            if j > 0:
+                flow = read_flow(j + 1)
+            block[j - j0] = np.ravel(flow)
+        np.matmul(W[j0:j1].T, block[:j1 - j0], out=product)
+        components += product
+    components.flush()
+    del components
+    np.savez(factors_file, U=U, s=s, shape=np.array(shape))
+    return len(s)
+
+
+class LowRankFlows:
+    """
+    Optical flows reconstructed from the components written by writeFlowComponents
+    """
+
+    def __init__(self, components_file, factors_file):
+        self.components = np.load(components_file, mmap_mode="r")
+        with np.load(factors_file) as factors:
+            self.U = factors["U"]
+            self.s = factors["s"]
+            self.shape = tuple(factors["shape"])
+
+    def coefficients(self, g):
+        """
+        :param np.ndarray g: vectors of the space of the rows of the Gram matrix (nframes, N)
+        :return np.ndarray: coefficients of the flows on the components (nframes, rank)
+        """
+        return (np.atleast_2d(g) @ self.U) / self.s
+
+    def reconstruct(self, g):
+        """
+        Flows X^+ g, one at a time
+        :param np.ndarray g: vectors of the space of the rows of the Gram matrix (nframes, N)
+        :return generator: flows (3, X, Y, Z)
+        """
+        for c in self.coefficients(g):
+            yield (c @ self.components).reshape(self.shape)
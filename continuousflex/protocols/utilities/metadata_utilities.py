@@ -0,0 +1,68 @@
+"""
+Joins between xmipp metadata.
+
+The rows of a metadata are matched to the rows of another one through a key column (image path, basename, item id),
+which is read once into a dictionary, instead of scanning the second metadata for each row of the first one.
+"""
+
+from os.path import basename
+import pwem.emlib.metadata as md
+from xmipp3.convert import xmippToLocation, getImageLocation
+
+
+def metadataIndex(mdIn, label=md.MDL_IMAGE, key=None):
+    """
+    :param md.MetaData mdIn: metadata
+    :param int label: column of the key
+    :param callable key: function applied to the values of the column (e.g. basename)
+    :return dict: key -> objId of its first row
+    """
+    index = {}
+    for objId, value in zip(mdIn, mdIn.getColumnValues(label)):
+        index.setdefault(value if key is None else key(value), objId)
+    return index
+
+
+def joinColumn(mdTarget, mdSource, keyLabel, valueLabel):
+    """
+    Copy the column valueLabel of mdSource into mdTarget, for the rows having the same keyLabel (first match), the rows
+    without a match are left unchanged
+    :param md.MetaData mdTarget: metadata to update
+    :param md.MetaData mdSource: metadata with the values
+    :param int keyLabel: column used to match the rows (e.g. MDL_IMAGE, MDL_ITEM_ID)
+    :param int valueLabel: column to copy
+    :return int: number of rows updated
+    """
+    values = {}
+    for key, value in zip(mdSource.getColumnValues(keyLabel), mdSource.getColumnValues(valueLabel)):
+        values.setdefault(key, value)
+    matched = 0
+    for objId, key in zip(list(mdTarget), mdTarget.getColumnValues(keyLabel)):
+        if key in values:
+            mdTarget.setValue(valueLabel, values[key], objId)
+            matched += 1
+    return matched
+
+
+def updateInputLocations(mdImgs, inputSet, inputMd):
+    """
+    Set the image location and item id of the rows of mdImgs to the particles of inputSet they refer to (for metadata
+    computed on another computer or imported from another project): the index of a stack location, or the row of
+    inputMd with the same basename
+    :param md.MetaData mdImgs: metadata to update
+    :param inputSet: input set of particles or volumes
+    :param str inputMd: metadata of the input set
+    """
+    basenames = None
+    for objId in mdImgs:
+        imgPath = mdImgs.getValue(md.MDL_IMAGE, objId)
+        index, fn = xmippToLocation(imgPath)
+        if not index:  # input is not a stack
+            if basenames is None:
+                basenames = metadataIndex(md.MetaData(inputMd), md.MDL_IMAGE, key=basename)
+            index = basenames.get(basename(imgPath))
+            if index is None:
+                raise RuntimeError("%s was not found in %s" % (imgPath, inputMd))
+        particle = inputSet[index]
+        mdImgs.setValue(md.MDL_IMAGE, getImageLocation(particle), objId)
+        mdImgs.setValue(md.MDL_ITEM_ID, int(particle.getObjId()), objId)
@@ -0,0 +1,174 @@
+"""
+Normal modes utilities: reading the modes of a NMA run and deforming a structure along them.
+
+Besides the text files modes/vec.N, the NMA protocols store the modes in a binary archive next to modes.xmd:
+modes.npy, a float32 array (nmodes, natoms, 3) that is memory-mapped when loaded, and modes_info.npz with the
+eigenvalues, collectivity and enabled flag of each mode. The text files are only parsed if there is no archive.
+
+The deformation of a structure by the amplitudes a_k of the modes is x = x0 + sum_k a_k * mode_k, as done by
+xmipp_pdb_nma_deform. Here the modes are loaded once in an array (nmodes, natoms, 3), and a whole matrix of amplitudes
+(nparticles, nmodes) is applied with a single matrix product. As xmipp_pdb_nma_deform, only the coordinates of the ATOM
+records are changed in the deformed PDB files, the other records (HETATM, REMARK, ...) are copied unchanged.
+"""
+
+import os
+import re
+import numpy as np
+from numpy.lib.format import open_memmap
+import pwem.emlib.metadata as md
+
+from continuousflex.protocols.utilities.pdb_handler import ContinuousFlexPDBHandler, PDBTemplate
+from continuousflex.protocols.utilities.genesis_utilities import DCDWriter
+
+DEFORM_CHUNK_SIZE = 256
+MODES_ARCHIVE = "modes.npy"
+MODES_INFO = "modes_info.npz"
+MODE_FILE_NUMBER = re.compile(r"vec\.(\d+)$")
+
+
+def getModeFiles(modesMd, enabledOnly=True):
+    """
+    :param str modesMd: metadata of the modes (modes.xmd)
+    :param bool enabledOnly: skip the disabled modes, as xmipp_pdb_nma_deform
+    :return list: files of the modes
+    """
+    mdModes = md.MetaData(modesMd)
+    hasEnabled = mdModes.containsLabel(md.MDL_ENABLED)
+    modeFiles = []
+    for objId in mdModes:
+        if enabledOnly and hasEnabled and mdModes.getValue(md.MDL_ENABLED, objId) == -1:
+            continue
+        modeFiles.append(mdModes.getValue(md.MDL_NMA_MODEFILE, objId))
+    return modeFiles
+
+
+def writeModesArchive(fnArchive, vectors):
+    """
+    :param str fnArchive: output archive (.npy)
+    :param list vectors: modes, each one (natoms, 3)
+    """
+    archive = open_memmap(fnArchive, mode="w+", dtype=np.float32, shape=(len(vectors),) + np.shape(vectors[0]))
+    for i, vec in enumerate(vectors):
+        archive[i] = vec
+    archive.flush()
+    del archive
+
+
+def writeModesInfo(fnInfo, eigenvalues, collectivity, enabled):
+    """
+    :param str fnInfo: output file (.npz)
+    :param list eigenvalues: eigenvalue of each mode (nan if unknown)
+    :param list collectivity: collectivity of each mode
+    :param list enabled: enabled flag (1 or -1) of each mode
+    """
+    np.savez(fnInfo, eigenvalues=np.array(eigenvalues, dtype=float), collectivity=np.array(collectivity, dtype=float),
+             enabled=np.array(enabled, dtype=int))
+
+
+def openModesArchive(fnArchive):
+    """
+    :param str fnArchive: archive written by writeModesArchive
+    :return np.memmap: modes (nmodes, natoms, 3), memory-mapped
+    """
+    return np.load(fnArchive, mmap_mode="r")
+
+
+def getModesArchive(modeFile):
+    """
+    Find the archive containing a mode file <protocol>/modes/vec.N
+    :param str modeFile: text file of the mode
+    :return tuple: archive file (None if there is none) and index of the mode in the archive
+    """
+    match = MODE_FILE_NUMBER.search(modeFile)
+    if match is None:
+        return None, None
+    fnArchive = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(modeFile))), MODES_ARCHIVE)
+    if not os.path.exists(fnArchive) or os.path.getmtime(fnArchive) < os.path.getmtime(modeFile):
+        return None, None
+    return fnArchive, int(match.group(1)) - 1
+
+
+def loadModeVectors(modeFiles):
+    """
+    :param list modeFiles: text files of the modes
+    :return np.ndarray: modes (nmodes, natoms, 3), read from the archives when they exist
+    """
+    archives = {}
+    vectors = []
+    for f in modeFiles:
+        fnArchive, idx = getModesArchive(f)
+        if fnArchive is not None:
+            if fnArchive not in archives:
+                archives[fnArchive] = openModesArchive(fnArchive)
+            if idx < archives[fnArchive].shape[0]:
+                vectors.append(archives[fnArchive][idx])
+                continue
+        vectors.append(np.loadtxt(f, ndmin=2))
+    return np.array(vectors, dtype=np.float32)
+
+
+def loadModes(modesMd, enabledOnly=True):
+    """
+    :param str modesMd: metadata of the modes (modes.xmd)
+    :param bool enabledOnly: skip the disabled modes, as xmipp_pdb_nma_deform
+    :return np.ndarray: modes (nmodes, natoms, 3)
+    """
+    return loadModeVectors(getModeFiles(modesMd, enabledOnly))
+
+
+class NMADeformer:
+    """
+    Deform a structure along its normal modes, in memory
+    """
+
+    def __init__(self, pdbFile, modesMd, enabledOnly=True):
+        """
+        :param str pdbFile: structure used for the NMA
+        :param str modesMd: metadata of the modes (modes.xmd)
+        :param bool enabledOnly: use only the enabled modes, as xmipp_pdb_nma_deform
+        """
+        self.pdb = ContinuousFlexPDBHandler(pdbFile)
+        self.template = PDBTemplate(pdbFile)
+        self.modes = loadModes(modesMd, enabledOnly)
+        if self.modes.shape[1] != self.pdb.n_atoms:
+            raise RuntimeError("The modes have %i atoms while the structure %s has %i atoms"
+                               % (self.modes.shape[1], pdbFile, self.pdb.n_atoms))
+
+    def deform(self, amplitudes):
+        """
+        :param np.ndarray amplitudes: amplitudes of the modes (nparticles, k) or (k,), applied to the k first modes
+                                      (the amplitudes beyond the number of modes are ignored, as xmipp_pdb_nma_deform)
+        :return np.ndarray: deformed coordinates (nparticles, natoms, 3) or (natoms, 3)
+        """
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        single = amplitudes.ndim == 1
+        amplitudes = np.atleast_2d(amplitudes)[:, :self.modes.shape[0]]
+        k = amplitudes.shape[1]
+        coords = self.pdb.coords[None] + (amplitudes @ self.modes[:k].reshape(k, -1)).reshape(len(amplitudes), -1, 3)
+        return coords[0] if single else coords
+
+    def writePDB(self, amplitudes, fnOut):
+        """
+        :param np.ndarray amplitudes: amplitudes of the modes (k,)
+        :param str fnOut: output PDB, the input PDB with the deformed coordinates
+        """
+        self.template.write(fnOut, self.deform(amplitudes))
+
+    def writePDBs(self, amplitudes, fnOuts):
+        """
+        :param np.ndarray amplitudes: amplitudes of the modes (nparticles, k)
+        :param list fnOuts: output PDB for each particle, the input PDB with the deformed coordinates
+        """
+        for i in range(0, len(fnOuts), DEFORM_CHUNK_SIZE):
+            coords = self.deform(np.atleast_2d(amplitudes[i:i + DEFORM_CHUNK_SIZE]))
+            for c, fnOut in zip(coords, fnOuts[i:i + DEFORM_CHUNK_SIZE]):
+                self.template.write(fnOut, c)
+
+    def writeDCD(self, amplitudes, fnOut):
+        """
+        :param np.ndarray amplitudes: amplitudes of the modes (nparticles, k)
+        :param str fnOut: output DCD trajectory, a frame per particle
+        """
+        with DCDWriter(fnOut, natom=self.pdb.n_atoms) as dcd:
+            for i in range(0, len(amplitudes), DEFORM_CHUNK_SIZE):
+                dcd.write(self.deform(np.atleast_2d(amplitudes[i:i + DEFORM_CHUNK_SIZE])))
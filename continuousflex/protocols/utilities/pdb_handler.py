@@ -1,9 +1,111 @@
 import numpy as np
 import copy
+import hashlib
+import re
 from Bio.SVDSuperimposer import SVDSuperimposer
 
+MATCH_CACHE_SIZE = 32
+ALIGN_CHUNK_SIZE = 256
+PDB_LINE_WIDTH = 80
+# ATOM records, i.e. lines whose first whitespace-separated token is "ATOM"
+PDB_ATOM_RECORD = re.compile(rb"^[ \t\x0b\x0c]*ATOM(?:[ \t\x0b\x0c][^\n]*)?$", re.MULTILINE)
+# First character of the coordinates in the atom records
+PDB_COORDS_COLUMN = 30
+PDB_COLUMNS_DTYPE = np.dtype({
+    "names":   ["atom", "atomNum", "atomName", "resAlter", "resName", "chainName", "resNum",
+                "x", "y", "z", "occ", "temp", "chainID", "elemName"],
+    "formats": ["S6", "S5", "S4", "S1", "S4", "S1", "S4", "S8", "S8", "S8", "S6", "S6", "S4", "S2"],
+    "offsets": [0, 6, 12, 16, 17, 21, 22, 30, 38, 46, 54, 60, 72, 76],
+    "itemsize": PDB_LINE_WIDTH,
+})
+
+_SPACE = ord(" ")
+_ZERO = ord("0")
+
+
+def _format_str_column(values, width, right=False):
+    """
+    Justify an array of strings into a fixed-width byte column
+    :param values: array of str
+    :param width: column width
+    :param right: right-justify instead of left-justify
+    :return: (N, width) uint8 characters, mask of the rows that fit in the column
+    """
+    values = np.ascontiguousarray(values, dtype=str)
+    n = len(values)
+    size = max(width, values.dtype.itemsize // 4)
+    raw = np.zeros((n, size), dtype=np.uint32)
+    raw[:, :values.dtype.itemsize // 4] = values.view(np.uint32).reshape(n, -1)
+    length = np.count_nonzero(raw, axis=1)
+    isAscii = (raw < 128).all(axis=1)
+    chars = raw.astype(np.uint8)
+    chars[raw == 0] = _SPACE
+    if right:
+        pos = np.arange(size)[None, :] - (width - length)[:, None]
+        chars = np.where(pos >= 0, np.take_along_axis(chars, np.clip(pos, 0, size - 1), axis=1), _SPACE)
+    return chars[:, :width].astype(np.uint8), (length <= width) & isAscii
+
+
+def _blank_column(n, width, char=" "):
+    return np.full((n, width), ord(char), dtype=np.uint8), np.ones(n, dtype=bool)
+
+
+def _format_int_column(values, width):
+    """
+    Right-justify integers into a fixed-width byte column ("%{width}d")
+    :param values: array of int
+    :param width: column width
+    :return: (N, width) uint8 characters, mask of the rows that fit in the column
+    """
+    values = np.asarray(values).astype(np.int64)
+    return _format_digits(np.abs(values), values < 0, width)
+
+
+def _format_float_column(values, width, decimals):
+    """
+    Right-justify floats into a fixed-width byte column ("%{width}.{decimals}f")
+    Values that are exactly halfway between two decimals are flagged as not fitting
+    so that the caller formats them with Python, which rounds them half-to-even.
+    :param values: array of float
+    :param width: column width
+    :param decimals: number of decimals
+    :return: (N, width) uint8 characters, mask of the rows that fit in the column
+    """
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    scaled = np.abs(np.where(finite, values, 0.0)) * 10 ** decimals
+    scaled = np.minimum(scaled, 10.0 ** (width + 1))
+    rounded = np.rint(scaled).astype(np.int64)
+    exact = (scaled - np.floor(scaled)) != 0.5
+    intPart, valid = _format_digits(rounded // 10 ** decimals, np.signbit(values), width - decimals - 1)
+    fracPart = rounded % 10 ** decimals
+    frac = np.empty((len(values), decimals), dtype=np.uint8)
+    for i in range(decimals):
+        frac[:, decimals - 1 - i] = _ZERO + (fracPart // 10 ** i) % 10
+    point = np.full((len(values), 1), ord("."), dtype=np.uint8)
+    return np.concatenate((intPart, point, frac), axis=1), valid & finite & exact
+
+
+def _format_digits(values, negative, width):
+    n = len(values)
+    ndigits = np.ones(n, dtype=np.int64)
+    for i in range(1, width + 1):
+        ndigits[values >= 10 ** i] = i + 1
+    chars = np.full((n, width), _SPACE, dtype=np.uint8)
+    for i in range(width):
+        col = width - 1 - i
+        chars[:, col] = np.where(i < ndigits, _ZERO + (values // 10 ** i) % 10, _SPACE)
+    sign = width - 1 - ndigits
+    rows = np.nonzero(negative & (sign >= 0))[0]
+    chars[rows, sign[rows]] = ord("-")
+    return chars, ndigits + negative <= width
+
+
 class ContinuousFlexPDBHandler:
-    
+
+    # Atom matching indexes, keyed by the topology of the matched molecules
+    _match_cache = {}
+
     @classmethod
     def read_coords(cls, pdb_file):
         print("> Reading pdb file %s ..." % pdb_file)
@@ -16,11 +118,65 @@ class ContinuousFlexPDBHandler:
                         ])
         return np.array(coords).astype(float)
 
-    def __init__(self, pdb_file):
+    def __init__(self, pdb_file, vectorized=True):
         """
         Contructor
         :param pdb_file: PDB file
+        :param vectorized: if True, parse the file in bulk into fixed-width columns,
+            otherwise use the per-line reference parser
+        """
+        print("> Reading pdb file %s ..." % pdb_file)
+        if vectorized:
+            self._read_pdb_columns(pdb_file)
+        else:
+            self._read_pdb_lines(pdb_file)
+
+        if self.n_atoms == 0 :
+            raise RuntimeError("Could not read PDB file : PDB file is empty")
+
+        print("\t Done \n")
+
+    @classmethod
+    def read_columns(cls, pdb_file):
+        """
+        Read all ATOM records of a PDB file in one pass
+        :param pdb_file: PDB file
+        :return: structured array of fixed-width byte fields (one row per atom)
         """
+        with open(pdb_file, "rb") as f:
+            data = f.read().replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        lines = PDB_ATOM_RECORD.findall(data)
+        return np.array(lines, dtype="S%i" % PDB_LINE_WIDTH).view(PDB_COLUMNS_DTYPE)
+
+    def _read_pdb_columns(self, pdb_file):
+        cols = self.read_columns(pdb_file)
+
+        def strip(name):
+            return np.char.strip(cols[name])
+
+        def strip_str(name):
+            field = np.ascontiguousarray(strip(name))
+            n = field.dtype.itemsize
+            return field.view(np.uint8).astype(np.uint32).view("<U%i" % n).reshape(len(field))
+
+        atomNum = strip("atomNum")
+        atomNum[atomNum == b"*****"] = b"-1"
+
+        self.atom = strip_str("atom").astype('<U6')
+        self.n_atoms = len(self.atom)
+        self.atomNum = atomNum.astype(int)
+        self.atomName = strip_str("atomName").astype('<U4')
+        self.resName = strip_str("resName").astype('<U4')
+        self.resAlter = strip_str("resAlter").astype('<U1')
+        self.chainName = strip_str("chainName").astype('<U1')
+        self.resNum = strip("resNum").astype(int)
+        self.coords = np.stack([strip("x"), strip("y"), strip("z")], axis=1).astype(float)
+        self.occ = strip("occ").astype(float)
+        self.temp = strip("temp").astype(float)
+        self.chainID = strip_str("chainID").astype('<U4')
+        self.elemName = strip_str("elemName").astype('<U2')
+
+    def _read_pdb_lines(self, pdb_file):
         atom = []
         atomNum = []
         atomName = []
@@ -33,7 +189,6 @@ class ContinuousFlexPDBHandler:
         temp = []
         chainID = []
         elemName = []
-        print("> Reading pdb file %s ..." % pdb_file)
         with open(pdb_file, "r") as f:
             for line in f:
                 spl = line.split()
@@ -73,17 +228,70 @@ class ContinuousFlexPDBHandler:
         self.chainID = np.array(chainID, dtype='<U4')
         self.elemName = np.array(elemName, dtype='<U2')
 
-        if self.n_atoms == 0 :
-            raise RuntimeError("Could not read PDB file : PDB file is empty")
-
+    def write_pdb(self, file, vectorized=True):
+        """
+        Write to PDB Format
+        :param file: pdb file path
+        :param vectorized: if True, format all atoms at once as a fixed-width byte array,
+            otherwise use the per-line reference writer
+        """
+        print("> Writing pdb file %s ..." % file)
+        if vectorized:
+            self._write_pdb_columns(file)
+        else:
+            self._write_pdb_lines(file)
         print("\t Done \n")
 
-    def write_pdb(self, file):
+    def write_pdb_models(self, file, frames):
         """
-        Write to PDB Format
+        Write a multi-model PDB (MODEL/ENDMDL records), one model per frame, the atom records are formatted once and
+        only their coordinates are updated for each model
         :param file: pdb file path
+        :param frames: coordinates of the models (nframe, n_atoms, 3)
         """
         print("> Writing pdb file %s ..." % file)
+        chars, valid = self._pdb_columns()
+        with open(file, "wb") as f:
+            for n, coords in enumerate(frames):
+                coords = np.asarray(coords, dtype=float)
+                if coords.shape != (self.n_atoms, 3):
+                    raise RuntimeError("Can not write %s coordinates for %i atoms" % (str(coords.shape), self.n_atoms))
+                frameValid = valid.copy()
+                for k in range(3):
+                    column, fits = _format_float_column(coords[:, k], 8, 3)
+                    chars[:, PDB_COORDS_COLUMN + 8 * k:PDB_COORDS_COLUMN + 8 * (k + 1)] = column
+                    frameValid &= fits
+                f.write(b"MODEL     %4i\n" % (n + 1))
+                self._write_pdb_rows(f, chars, frameValid, coords)
+                f.write(b"ENDMDL\n")
+            f.write(b"END\n")
+        print("\t Done \n")
+
+    def _format_atom_line(self, i, coords=None):
+        if coords is None:
+            coords = self.coords
+        atom = self.atom[i].ljust(6)  # atom#6s
+        if self.atomNum[i] == -1 or self.atomNum[i] >= 100000:
+            atomNum = "99999"  # aomnum#5d
+        else:
+            atomNum = str(self.atomNum[i]).rjust(5)  # aomnum#5d
+        atomName = self.atomName[i].ljust(4)  # atomname$#4s
+        resAlter = self.resAlter[i].ljust(1)  # resAlter#1
+        resName = self.resName[i].ljust(4)  # resname#1s
+        chainName = self.chainName[i].rjust(1)  # Astring
+        resNum = str(self.resNum[i]).rjust(4)  # resnum
+        coordx = str('%8.3f' % (float(coords[i][0]))).rjust(8)  # x
+        coordy = str('%8.3f' % (float(coords[i][1]))).rjust(8)  # y
+        coordz = str('%8.3f' % (float(coords[i][2]))).rjust(8)  # z\
+        occ = str('%6.2f' % self.occ[i]).rjust(6)  # occ
+        temp = str('%6.2f' % self.temp[i]).rjust(6)  # temp
+        chainID = str(self.chainID[i]).ljust(4)  # elname
+        elemName = str(self.elemName[i]).rjust(2)  # elname
+        return "%s%s %s%s%s%s%s    %s%s%s%s%s      %s%s\n" % (
+            atom, atomNum, atomName, resAlter, resName, chainName, resNum,
+            coordx, coordy, coordz, occ, temp, chainID, elemName)
+
+    def _write_pdb_lines(self, file):
         with open(file, "w") as file:
             past_chainName = self.chainName[0]
             past_chainID = self.chainID[0]
@@ -92,49 +300,92 @@ class ContinuousFlexPDBHandler:
                     past_chainName = self.chainName[i]
                     past_chainID = self.chainID[i]
                     file.write("TER\n")
-
-                atom = self.atom[i].ljust(6)  # atom#6s
-                if self.atomNum[i] == -1 or self.atomNum[i] >= 100000:
-                    atomNum = "99999"  # aomnum#5d
-                else:
-                    atomNum = str(self.atomNum[i]).rjust(5)  # aomnum#5d
-                atomName = self.atomName[i].ljust(4)  # atomname$#4s
-                resAlter = self.resAlter[i].ljust(1)  # resAlter#1
-                resName = self.resName[i].ljust(4)  # resname#1s
-                chainName = self.chainName[i].rjust(1)  # Astring
-                resNum = str(self.resNum[i]).rjust(4)  # resnum
-                coordx = str('%8.3f' % (float(self.coords[i][0]))).rjust(8)  # x
-                coordy = str('%8.3f' % (float(self.coords[i][1]))).rjust(8)  # y
-                coordz = str('%8.3f' % (float(self.coords[i][2]))).rjust(8)  # z\
-                occ = str('%6.2f' % self.occ[i]).rjust(6)  # occ
-                temp = str('%6.2f' % self.temp[i]).rjust(6)  # temp
-                chainID = str(self.chainID[i]).ljust(4)  # elname
-                elemName = str(self.elemName[i]).rjust(2)  # elname
-                file.write("%s%s %s%s%s%s%s    %s%s%s%s%s      %s%s\n" % (
-                atom, atomNum, atomName, resAlter, resName, chainName, resNum,
-                coordx, coordy, coordz, occ, temp, chainID, elemName))
+                file.write(self._format_atom_line(i))
             file.write("END\n")
-        print("\t Done \n")
+
+    def _pdb_columns(self):
+        """
+        :return: (n_atoms, 81) characters of the atom records, mask of the rows that fit in the columns
+        """
+        atomNum = np.where((self.atomNum == -1) | (self.atomNum >= 100000), 99999, self.atomNum)
+        fields = [
+            _format_str_column(self.atom, 6),
+            _format_int_column(atomNum, 5),
+            _blank_column(self.n_atoms, 1),
+            _format_str_column(self.atomName, 4),
+            _format_str_column(self.resAlter, 1),
+            _format_str_column(self.resName, 4),
+            _format_str_column(self.chainName, 1, right=True),
+            _format_int_column(self.resNum, 4),
+            _blank_column(self.n_atoms, 4),
+            _format_float_column(self.coords[:, 0], 8, 3),
+            _format_float_column(self.coords[:, 1], 8, 3),
+            _format_float_column(self.coords[:, 2], 8, 3),
+            _format_float_column(self.occ, 6, 2),
+            _format_float_column(self.temp, 6, 2),
+            _blank_column(self.n_atoms, 6),
+            _format_str_column(self.chainID, 4),
+            _format_str_column(self.elemName, 2, right=True),
+            _blank_column(self.n_atoms, 1, "\n"),
+        ]
+        chars = np.concatenate([c for c, _ in fields], axis=1)
+        valid = np.logical_and.reduce([v for _, v in fields])
+        return chars, valid
+
+    def _write_pdb_rows(self, f, chars, valid, coords=None):
+        # Rows are written in contiguous blocks, broken where a TER record is needed
+        # and around atoms whose values overflow their column (formatted one by one)
+        ter = np.zeros(self.n_atoms, dtype=bool)
+        ter[1:] = (self.chainName[1:] != self.chainName[:-1]) | (self.chainID[1:] != self.chainID[:-1])
+        breaks = np.union1d(np.nonzero(ter)[0], np.nonzero(~valid)[0])
+        breaks = np.union1d(breaks, np.nonzero(~valid)[0] + 1)
+        bounds = np.concatenate(([0], breaks[(breaks > 0) & (breaks < self.n_atoms)], [self.n_atoms]))
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if ter[start]:
+                f.write(b"TER\n")
+            if valid[start]:
+                f.write(chars[start:end].tobytes())
+            else:
+                f.write(self._format_atom_line(start, coords).encode())
+
+    def _write_pdb_columns(self, file):
+        chars, valid = self._pdb_columns()
+        with open(file, "wb") as f:
+            self._write_pdb_rows(f, chars, valid)
+            f.write(b"END\n")
 
     def matchPDBatoms(self, reference_pdb, ca_only=False, matchingType=None):
         """
         match atoms between the pdb and a reference pdb
-        :param reference_pdb: ContinuousflexPDBHandler
+        :param reference_pdb: ContinuousflexPDBHandler or list of ContinuousflexPDBHandler
         :param ca_only: True if carbon alph only
         :param matchingType: 0= chain first, 1= segment ID first
-        :return: index of matching atoms
+        :return: index of matching atoms, one column per molecule (self first)
         """
         print("> Matching PDBs atoms ...")
-        n_mols = 2
+        references = list(reference_pdb) if isinstance(reference_pdb, (list, tuple)) else [reference_pdb]
+        mols = [self] + references
+        n_mols = len(mols)
+
+        cache_key = (tuple(m._topology_hash() for m in mols), ca_only, matchingType)
+        if cache_key in ContinuousFlexPDBHandler._match_cache:
+            idx = ContinuousFlexPDBHandler._match_cache[cache_key]
+            print("\t %i matching atoms (cached)" % len(idx))
+            print("\t Done")
+            return idx.copy()
 
         if matchingType == None:
+            n_matching_chain_names = 0
+            n_matching_chain_ids = 0
             chain_name_list1 = self.get_chain_list(chainType=0)
-            chain_name_list2 = reference_pdb.get_chain_list(chainType=0)
-            n_matching_chain_names = sum([i in chain_name_list2 for i in chain_name_list1])
-
             chain_id_list1 = self.get_chain_list(chainType=1)
-            chain_id_list2 = reference_pdb.get_chain_list(chainType=1)
-            n_matching_chain_ids = sum([i in chain_id_list2 for i in chain_id_list1])
+            for ref in references:
+                chain_name_list2 = ref.get_chain_list(chainType=0)
+                n_matching_chain_names += sum([i in chain_name_list2 for i in chain_name_list1])
+
+                chain_id_list2 = ref.get_chain_list(chainType=1)
+                n_matching_chain_ids += sum([i in chain_id_list2 for i in chain_id_list1])
 
             if n_matching_chain_ids >n_matching_chain_names:
                 matchingType = 1
@@ -145,40 +396,62 @@ class ContinuousFlexPDBHandler:
             else:
                 raise RuntimeError("No matching chains")
 
-
         ids = []
         ids_idx = []
-        for m in [self, reference_pdb]:
-            id_tmp = []
-            id_idx_tmp = []
-            for i in range(m.n_atoms):
-                if (not ca_only) or m.atomName[i] == "CA" or m.atomName[i] == "P":
-                    id_tmp.append("%s_%i_%s_%s" % (m.chainName[i] if matchingType == 0 else m.chainID[i],
-                                                   m.resNum[i], m.resName[i], m.atomName[i]))
-                    id_idx_tmp.append(i)
-            ids.append(np.array(id_tmp))
-            ids_idx.append(np.array(id_idx_tmp))
-
-        idx = []
-        for i in range(len(ids[0])):
-            idx_line = [ids_idx[0][i]]
-            for m in range(1, n_mols):
-                idx_tmp = np.where(ids[0][i] == ids[m])[0]
-                if len(idx_tmp) == 1:
-                    idx_line.append(ids_idx[m][idx_tmp[0]])
-                elif len(idx_tmp) > 1:
-                    print("\t Warning : One atom in mol#0 is matching several atoms in mol#%i : " % m)
-
-            if len(idx_line) == n_mols:
-                idx.append(idx_line)
+        for m in mols:
+            if ca_only:
+                id_idx_tmp = np.nonzero((m.atomName == "CA") | (m.atomName == "P"))[0]
+            else:
+                id_idx_tmp = np.arange(m.n_atoms)
+            ids.append(m._atom_keys(matchingType)[id_idx_tmp])
+            ids_idx.append(id_idx_tmp)
+
+        # Sorted-key join of the atoms of mol#0 against each other molecule
+        idx = [ids_idx[0]]
+        matched = np.ones(len(ids[0]), dtype=bool)
+        for m in range(1, n_mols):
+            order = np.argsort(ids[m], kind="stable")
+            sorted_ids = ids[m][order]
+            first = np.searchsorted(sorted_ids, ids[0], side="left")
+            n_found = np.searchsorted(sorted_ids, ids[0], side="right") - first
+            n_multiple = np.count_nonzero(n_found > 1)
+            if n_multiple > 0:
+                print("\t Warning : %i atoms in mol#0 are matching several atoms in mol#%i : " % (n_multiple, m))
+            matched &= n_found == 1
+            idx.append(ids_idx[m][order[np.minimum(first, len(order) - 1)]] if len(order) > 0
+                       else np.zeros(len(ids[0]), dtype=int))
+        idx = np.array(idx).T[matched] if matched.any() else np.array([])
 
         if len(idx) == 0:
             print("\t Warning : No matching coordinates")
 
-        print("\t %i matching atoms " % len(np.array(idx)))
+        print("\t %i matching atoms " % len(idx))
         print("\t Done")
 
-        return np.array(idx)
+        if len(ContinuousFlexPDBHandler._match_cache) >= MATCH_CACHE_SIZE:
+            ContinuousFlexPDBHandler._match_cache.clear()
+        ContinuousFlexPDBHandler._match_cache[cache_key] = idx
+        return idx.copy()
+
+    def _atom_keys(self, matchingType):
+        """
+        Atom identifiers used for matching : chain (or segment) _ resNum _ resName _ atomName
+        """
+        chain = self.chainName if matchingType == 0 else self.chainID
+        keys = chain.astype(str)
+        for field in [self.resNum.astype(str), self.resName, self.atomName]:
+            keys = np.char.add(np.char.add(keys, "_"), field)
+        return keys
+
+    def _topology_hash(self):
+        """
+        Fingerprint of the atoms identifiers, used to cache the atom matching
+        """
+        h = hashlib.sha1()
+        for field in [self.chainName, self.chainID, self.resNum, self.resName, self.atomName]:
+            h.update(np.ascontiguousarray(field).tobytes())
+            h.update(str(field.dtype).encode())
+        return h.hexdigest()
 
     def alignMol(self, reference_pdb, idx_matching_atoms=None):
         print("> Aligning PDB ...")
@@ -210,18 +483,84 @@ class ContinuousFlexPDBHandler:
             tran = np.zeros(3)
         return rot, tran
 
-    def getRMSD(self, reference_pdb, align=False, idx_matching_atoms=None):
+    @classmethod
+    def alignCoordsBatch(cls, coord_ref, coords, atoms=None, weights=None, chunk_size=ALIGN_CHUNK_SIZE):
+        """
+        Rigid body alignment (Kabsch) of a set of frames onto a reference
+        :param coord_ref: (N, 3) reference coordinates
+        :param coords: (F, M, 3) frames, e.g. DCDTrajectory.coords, read chunk_size frames at a time
+        :param atoms: index of the N atoms of the frames matching the reference (default all, M = N)
+        :param weights: (N,) weights of the atoms (e.g. masses), default uniform
+        :param chunk_size: number of frames aligned at once
+        :return: rotations (F, 3, 3), translations (F, 3) such that frame @ rot + tran fits the reference,
+            and RMSD (F,) of the aligned frames
+        """
+        coord_ref = np.asarray(coord_ref, dtype=float)
+        w = np.ones(len(coord_ref)) if weights is None else np.asarray(weights, dtype=float)
+        w = w / w.sum()
+        ref_center = np.dot(w, coord_ref)
+        ref = coord_ref - ref_center
+
+        nframe = len(coords)
+        rot = np.zeros((nframe, 3, 3))
+        tran = np.zeros((nframe, 3))
+        rmsd = np.zeros(nframe)
+        for start in range(0, nframe, chunk_size):
+            chunk = np.asarray(coords[start:start + chunk_size], dtype=float)
+            if atoms is not None:
+                chunk = chunk[:, atoms]
+            center = np.einsum("n,fni->fi", w, chunk)
+            centered = chunk - center[:, None, :]
+            cov = np.einsum("fni,n,nj->fij", centered, w, ref)
+            try:
+                u, _, vt = np.linalg.svd(cov)
+                r = np.matmul(u, vt)
+                reflect = np.linalg.det(r) < 0
+                vt[reflect, 2] *= -1
+                r[reflect] = np.matmul(u[reflect], vt[reflect])
+            except np.linalg.LinAlgError:
+                r = np.array([cls.alignCoords(coord_ref, c)[0] for c in chunk])
+            end = start + len(chunk)
+            rot[start:end] = r
+            tran[start:end] = ref_center - np.matmul(center[:, None, :], r)[:, 0]
+            diff = np.matmul(centered, r) - ref
+            rmsd[start:end] = np.sqrt(np.einsum("n,fni,fni->f", w, diff, diff))
+        return rot, tran, rmsd
+
+    @classmethod
+    def getRMSDBatch(cls, coord_ref, coords, align=False, atoms=None, weights=None, chunk_size=ALIGN_CHUNK_SIZE):
+        """
+        RMSD of a set of frames to a reference
+        :param coord_ref: (N, 3) reference coordinates
+        :param coords: (F, M, 3) frames, e.g. DCDTrajectory.coords, read chunk_size frames at a time
+        :param align: rigid body align the frames onto the reference before computing the RMSD
+        :param atoms: index of the N atoms of the frames matching the reference (default all, M = N)
+        :param weights: (N,) weights of the atoms (e.g. masses), default uniform
+        :param chunk_size: number of frames processed at once
+        :return: (F,) RMSD
+        """
         if align:
-            aligned = self.alignMol(reference_pdb=reference_pdb, idx_matching_atoms=idx_matching_atoms)
-        else:
-            aligned=self
+            return cls.alignCoordsBatch(coord_ref, coords, atoms=atoms, weights=weights, chunk_size=chunk_size)[2]
+        coord_ref = np.asarray(coord_ref, dtype=float)
+        w = np.ones(len(coord_ref)) if weights is None else np.asarray(weights, dtype=float)
+        w = w / w.sum()
+        rmsd = np.zeros(len(coords))
+        for start in range(0, len(coords), chunk_size):
+            chunk = np.asarray(coords[start:start + chunk_size], dtype=float)
+            if atoms is not None:
+                chunk = chunk[:, atoms]
+            diff = chunk - coord_ref
+            rmsd[start:start + len(chunk)] = np.sqrt(np.einsum("n,fni,fni->f", w, diff, diff))
+        return rmsd
+
+    def getRMSD(self, reference_pdb, align=False, idx_matching_atoms=None):
         if idx_matching_atoms is not None:
             coord1 = reference_pdb.coords[idx_matching_atoms[:, 1]]
-            coord2 = aligned.coords[idx_matching_atoms[:, 0]]
+            coord2 = self.coords[idx_matching_atoms[:, 0]]
         else:
             coord1 = reference_pdb.coords
-            coord2 = aligned.coords
-        return np.sqrt(np.mean(np.square(np.linalg.norm(coord1 - coord2, axis=1))))
+            coord2 = self.coords
+        return self.getRMSDBatch(coord1, coord2[None], align=align)[0]
 
     def select_atoms(self, idx):
         self.coords = self.coords[idx]
@@ -379,3 +718,64 @@ class ContinuousFlexPDBHandler:
     def center(self):
         self.coords -= np.mean(self.coords, axis=0)
 
+
+
+class PDBTemplate:
+    """
+    Write new coordinates in the ATOM records of a PDB file, the other records (HETATM, REMARK, ...) and the other
+    columns of the ATOM records are kept unchanged, as xmipp_pdb_nma_deform
+    """
+
+    COORDS_WIDTH = 24
+
+    def __init__(self, pdb_file):
+        """
+        :param pdb_file: PDB file, its ATOM records are the atoms of a ContinuousFlexPDBHandler of the same file
+        """
+        with open(pdb_file, "rb") as f:
+            data = f.read().replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        # The ATOM records are padded to hold the coordinates, their first character is stored for each atom
+        end = PDB_COORDS_COLUMN + self.COORDS_WIDTH
+        pieces = []
+        starts = []
+        size = 0
+        last = 0
+        for m in PDB_ATOM_RECORD.finditer(data):
+            pieces.append(data[last:m.start()])
+            size += m.start() - last
+            starts.append(size + PDB_COORDS_COLUMN)
+            line = m.group().ljust(end)
+            pieces.append(line)
+            size += len(line)
+            last = m.end()
+        pieces.append(data[last:])
+        self._template = np.frombuffer(b"".join(pieces), dtype=np.uint8)
+        self._starts = np.array(starts, dtype=np.int64)
+        self.n_atoms = len(starts)
+
+    def write(self, file, coords):
+        """
+        :param file: output PDB file
+        :param coords: (n_atoms, 3) coordinates
+        """
+        coords = np.asarray(coords, dtype=float)
+        if coords.shape != (self.n_atoms, 3):
+            raise RuntimeError("Can not write %s coordinates for %i atoms" % (str(coords.shape), self.n_atoms))
+        columns = []
+        valid = np.ones(self.n_atoms, dtype=bool)
+        for k in range(3):
+            column, fits = _format_float_column(coords[:, k], 8, 3)
+            columns.append(column)
+            valid &= fits
+        chars = self._template.copy()
+        index = self._starts[valid, None] + np.arange(self.COORDS_WIDTH)
+        chars[index] = np.concatenate(columns, axis=1)[valid]
+
+        # The coordinates that do not fit their columns are formatted one by one
+        with open(file, "wb") as f:
+            last = 0
+            for i in np.flatnonzero(~valid):
+                f.write(chars[last:self._starts[i]].tobytes())
+                f.write(("%8.3f%8.3f%8.3f" % tuple(coords[i])).encode())
+                last = self._starts[i] + self.COORDS_WIDTH
+            f.write(chars[last:].tobytes())
@@ -2,9 +2,36 @@ import glob
 
 import numpy as np
 from torch.utils.data import Dataset
-from continuousflex.protocols.utilities.processing_dh.utils import spi2array, eul2quat, min_max
+from continuousflex.protocols.utilities.processing_dh.utils import spi2array, eul2quat_batch, min_max
 import torch
 import pwem.emlib.metadata as md
+from numpy.lib.format import open_memmap
+
+
+class RunningStats:
+    """
+    Streaming mean and variance of the pixels of a set of images (Welford, merging the statistics image by image)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, img):
+        n = img.size
+        mean = np.mean(img, dtype=np.float64)
+        m2 = np.sum((img - mean) ** 2, dtype=np.float64)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    def std(self):
+        return (self.m2 / self.count) ** 0.5
+
+
 class cryodata(Dataset):
 
     def __init__(self, path, output_path, flag='nma', mode = 'train', transform=None):
@@ -12,6 +39,8 @@ class cryodata(Dataset):
         self.flag = flag
         self.mode = mode
         self.transform = transform
+        self.stack_file = None
+        self._stack = None
         mdImgs = md.MetaData(self.path)
         if mode == 'train':
             rot = []
@@ -37,9 +66,7 @@ class cryodata(Dataset):
             shifty = torch.tensor(shift_y)
 
             self.angles = torch.column_stack((rot_, tilt_, psi_))
-            self.quaternions = torch.zeros((self.angles.shape[0], 4), dtype=torch.float32)
-            for i in range(len(self.angles)):
-                self.quaternions[i, :] = torch.tensor(eul2quat(self.angles, i))
+            self.quaternions = torch.tensor(eul2quat_batch(self.angles.numpy()), dtype=torch.float32)
             self.shifts, min_shf, max_shf = min_max(torch.column_stack((shiftx, shifty)))
             self.amplitudes, min_nma, max_nma = min_max(torch.tensor(nma, dtype=torch.float32))
 
@@ -57,6 +84,38 @@ class cryodata(Dataset):
 
 
 
+    def cache_images(self, stack_file, stats_indices=None):
+        # Decode all the images once in a memory-mapped float32 stack, that is then read by __getitem__
+        # stats_indices: images used for the mean and std (all by default), computed in the same pass
+        stats_indices = set(range(len(self)) if stats_indices is None else stats_indices)
+        stats = RunningStats()
+        img = spi2array(self.images_Path[0])
+        stack = open_memmap(stack_file, mode='w+', dtype=np.float32, shape=(len(self),) + img.shape)
+        for i in range(len(self)):
+            if i > 0:
+                img = spi2array(self.images_Path[i])
+            stack[i] = img
+            if i in stats_indices:
+                stats.update(stack[i])
+        stack.flush()
+        del stack
+        self.stack_file = stack_file
+        self._stack = None
+        return stats.mean, stats.std()
+
+    def read_image(self, item):
+        if self.stack_file is None:
+            return spi2array(self.images_Path[item])
+        # Opened in each DataLoader worker, the memory map is not sent to the workers
+        if self._stack is None:
+            self._stack = np.load(self.stack_file, mmap_mode='r')
+        return np.array(self._stack[item])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_stack'] = None
+        return state
+
     def __len__(self):
         return len(self.images_Path)
 
@@ -65,7 +124,7 @@ class cryodata(Dataset):
             if self.flag == 'nma':
                 amplitudes = self.amplitudes[item]
                 image_name = self.images_Path[item]
-                spi_array = spi2array(image_name)
+                spi_array = self.read_image(item)
                 if self.transform:
                     spi_array = self.transform(spi_array)
                     amplitudes = torch.tensor(amplitudes)
@@ -73,7 +132,7 @@ class cryodata(Dataset):
             elif self.flag == 'ang':
                 angles = self.quaternions[item]
                 image_name = self.images_Path[item]
-                spi_array = spi2array(image_name)
+                spi_array = self.read_image(item)
                 if self.transform:
                     spi_array = self.transform(spi_array)
                     angles = torch.tensor(angles) 
@@ -81,7 +140,7 @@ class cryodata(Dataset):
             elif self.flag == 'shf':
                 shifts = self.shifts[item]    
                 image_name = self.images_Path[item]
-                spi_array = spi2array(image_name)
+                spi_array = self.read_image(item)
                 if self.transform:
                     spi_array = self.transform(spi_array)
                     shifts = torch.tensor(shifts)
@@ -91,7 +150,7 @@ class cryodata(Dataset):
                 angles = self.quaternions[item]
                 shifts = self.shifts[item]
                 image_name = self.images_Path[item]
-                spi_array = spi2array(image_name)
+                spi_array = self.read_image(item)
                 if self.transform:
                     spi_array = self.transform(spi_array)
                     amplitudes = torch.tensor(amplitudes)
@@ -101,7 +160,7 @@ class cryodata(Dataset):
                 return spi_array, params
         elif self.mode == 'inference':
             image_name = self.images_Path[item]
-            spi_array = spi2array(image_name)
+            spi_array = self.read_image(item)
             if self.transform:
                 spi_array = self.transform(spi_array)
             return spi_array, image_name
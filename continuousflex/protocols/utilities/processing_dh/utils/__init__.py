@@ -1,8 +1,10 @@
-from .metadata import read_file
+from .metadata import read_file, ImagesMetadataWriter
 from .metadata import min_max, standardization, reverse_min_max, reverse_standardization
 from .spi_reader import spi2array, normalize, torch_normalize
 from .spi_reader import read_from_list, read_from_directory
 from .pdb_reader import read_pdb, parse_pdb
-from .euler2quaternion import eul2quat, quater2euler
+from .euler2quaternion import eul2quat, quater2euler, eul2quat_batch, quater2euler_batch
 from .projection import projectPDB2Image
 from .projection import projectPDB_NP
+from .projection import projectPDB2ImageSplat
+from .projection import PDB2VolumeSplat
@@ -35,6 +35,29 @@ def quater2euler(arr):
     return euler
 
 
+def eul2quat_batch(angles):
+    # Same as eul2quat for an array of Euler angles (N, 3) in degrees, returns the quaternions (N, 4)
+    half = np.radians(np.asarray(angles, dtype=np.float64)) / 2
+    c = np.cos(half)
+    s = np.sin(half)
+    c_rot, c_tilt, c_psi = c[..., 0], c[..., 1], c[..., 2]
+    s_rot, s_tilt, s_psi = s[..., 0], s[..., 1], s[..., 2]
+    return np.stack([(c_rot*c_tilt*c_psi)-(s_rot*c_tilt*s_psi),
+                     (c_rot*s_tilt*s_psi)-(s_rot*s_tilt*c_psi),
+                     (c_rot*s_tilt*c_psi)+(s_rot*s_tilt*s_psi),
+                     (c_rot*c_tilt*s_psi)+(s_rot*c_tilt*c_psi)], axis=-1)
+
+
+def quater2euler_batch(quaternions):
+    # Same as quater2euler for an array of quaternions (N, 4), returns the Euler angles (N, 3) in degrees
+    q = np.asarray(quaternions, dtype=np.float64)
+    qw, qx, qy, qz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    tilt = np.clip((qw**2)-(qx**2)-(qy**2)+(qz**2), -1.0, 1.0)
+    return np.degrees(np.stack([np.arctan2(2*((qy*qz)-(qw*qx)), 2*((qx*qz)+(qw*qy))),
+                                np.arccos(tilt),
+                                np.arctan2(2*((qy*qz)+(qw*qx)), -2*((qx*qz)-(qw*qy)))], axis=-1))
+
+
 def quat2rotm(arr):
 
     q0 = arr[0] 
@@ -7,7 +7,7 @@ contains only the normal modes amplitudes
 import re
 import numpy as np
 from math import cos, sin, radians
-from .euler2quaternion import eul2quat
+from .euler2quaternion import eul2quat_batch
 import torch
 
 def header(path):
@@ -58,9 +58,7 @@ def create_array(path, flag='nma'):
     angles = data_array[:, [rot_index, tilt_index, psi_index]].astype('float32')
     shifts = data_array[:, [shiftx_index, shifty_index]].astype('float32')
     shifts, shf_min, shf_max = min_max(shifts)
-    quaternions = np.zeros((angles.shape[0], 4), dtype='float32')
-    for i in range(len(angles)):
-        quaternions[i,:] = eul2quat(angles, i)
+    quaternions = eul2quat_batch(angles).astype('float32')
     if flag=='nma':
         print("Number of Normal Modes detected is: ",num_modes)
         return nm_amplitudes, nma_min, nma_max, img_names
@@ -143,3 +141,58 @@ def rotation_matrix(euler_angles):
                         [-cos(psi)*sin(tilt), sin(psi)*sin(tilt),cos(tilt)]])
 
     return rot_mat
+
+
+class ImagesMetadataWriter:
+    """
+    Write the predicted parameters of the images in an xmipp metadata (images.xmd), batch by batch
+    Only the columns of the given parameters are written, with any number of normal modes
+    """
+
+    def __init__(self, path, angles=True, shifts=True, num_modes=0, cost=0.55):
+        self.angles = angles
+        self.shifts = shifts
+        self.num_modes = num_modes
+        self.cost = cost
+        self.item_id = 1
+        labels = ['image', 'enabled']
+        row_format = '%s                    1'
+        if angles:
+            labels += ['angleRot', 'angleTilt', 'anglePsi']
+            row_format += ' %12.6g %12.6g %12.6g'
+        if shifts:
+            labels += ['shiftX', 'shiftY']
+            row_format += ' %12.6g %12.6g'
+        if num_modes > 0:
+            labels += ['nmaDisplacements']
+            row_format += " '" + ' '.join(['%12.6g'] * num_modes) + "'"
+        labels += ['cost', 'itemId']
+        self.row_format = row_format + '   %g  %d\n'
+        self.f = open(path, 'w')
+        self.f.write('# XMIPP_STAR_1 * \n # \ndata_noname\nloop_\n' + ''.join([' _%s\n' % l for l in labels]))
+
+    def write(self, img_paths, angles=None, shifts=None, nma=None):
+        # img_paths: (B,) image names, angles: (B, 3) Euler angles, shifts: (B, 2), nma: (B, num_modes)
+        n = len(img_paths)
+        columns = [np.asarray(img_paths, dtype=object).reshape(n, 1)]
+        if self.angles:
+            columns.append(np.asarray(angles, dtype=np.float64).reshape(n, 3))
+        if self.shifts:
+            columns.append(np.asarray(shifts, dtype=np.float64).reshape(n, 2))
+        if self.num_modes > 0:
+            columns.append(np.asarray(nma, dtype=np.float64).reshape(n, self.num_modes))
+        columns.append(np.full((n, 1), self.cost))
+        columns.append(np.arange(self.item_id, self.item_id + n).reshape(n, 1))
+        # A single formatting of the whole batch
+        values = np.concatenate([np.asarray(c, dtype=object) for c in columns], axis=1)
+        self.f.write((self.row_format * n) % tuple(values.ravel().tolist()))
+        self.item_id += n
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
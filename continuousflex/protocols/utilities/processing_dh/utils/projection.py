@@ -59,7 +59,7 @@ def projectPDBPixel(pdb_coordinates, s, t, sigma):
     
     exp_arg = -((s_v-sl_v)**2 + (t_v-tl_v)**2)/(2*sigma**2)
     exp_vec = torch.exp(exp_arg)
-    return torch.sum(exp_vec, dim = 2)
+    return torch.sum(exp_vec, dim = -1)
 def projectPDB_NP(PDB, size, sampling_rate =1, sigma=1, rot=0, tilt=0, psi=0, shift_x=0, shift_y=0, shift_z=0):
     #T = torch.linalg.inv(euler_matrix(torch.tensor(rot, dtype=torch.float), torch.tensor(tilt, dtype=torch.float), torch.tensor(psi, dtype=torch.float)))
     #PDB = torch.matmul(PDB, T)/sampling_rate
@@ -160,6 +160,103 @@ def PDB2Volume(PDB, volume_size, sigma, sampling_rate):
     return values
 
 
+# Truncated-kernel splatting: each atom only contributes to the voxels (or pixels) closer than SPLAT_CUTOFF sigmas along
+# each axis. As the Gaussian is separable, the contribution of an atom is the outer product of a 1D kernel per axis,
+# and all the contributions of a batch of structures are accumulated at once with np.bincount.
+SPLAT_CUTOFF = 4.0
+# Number of (atom, voxel) contributions computed at once
+SPLAT_CHUNK_SIZE = 2 ** 22
+
+
+def _to_numpy(a):
+    if isinstance(a, torch.Tensor):
+        a = a.detach().cpu().numpy()
+    return np.asarray(a, dtype=np.float64)
+
+
+def euler_matrices_np(rot, tilt, psi):
+    # Batched NumPy version of euler_matrix, rot, tilt and psi are arrays of angles in degrees
+    t1 = -np.deg2rad(np.asarray(psi, dtype=np.float64))
+    t2 = -np.deg2rad(np.asarray(tilt, dtype=np.float64))
+    t3 = -np.deg2rad(np.asarray(rot, dtype=np.float64))
+    c1, s1, c2, s2, c3, s3 = np.cos(t1), np.sin(t1), np.cos(t2), np.sin(t2), np.cos(t3), np.sin(t3)
+    T = np.empty(np.broadcast(t1, t2, t3).shape + (3, 3))
+    T[..., 0, 0] = c1 * c2 * c3 - s1 * s3
+    T[..., 0, 1] = -c3 * s1 - c1 * c2 * s3
+    T[..., 0, 2] = c1 * s2
+    T[..., 1, 0] = c1 * s3 + c2 * c3 * s1
+    T[..., 1, 1] = c1 * c3 - c2 * s1 * s3
+    T[..., 1, 2] = s1 * s2
+    T[..., 2, 0] = -c3 * s2
+    T[..., 2, 1] = s2 * s3
+    T[..., 2, 2] = c2
+    return T
+
+
+def splatGaussians(centers, size, sigma, cutoff=SPLAT_CUTOFF):
+    # centers: (B, N, D) coordinates of the Gaussians in pixels, relative to the center of the grid (index size//2)
+    # returns (B, size, ..., size), the grid index i along the axis d is for the coordinate centers[..., d]
+    centers = np.asarray(centers, dtype=np.float64)
+    B, N, D = centers.shape
+    limit = int(size / 2)
+    radius = max(int(np.ceil(cutoff * sigma)), 1)
+    window = np.arange(-radius, radius + 1)
+    W = len(window)
+
+    # 1D kernels (B, N, D, W), outside the grid the weight is 0 and the index is clipped
+    idx = np.rint(centers).astype(np.int64)[..., None] + window + limit
+    weights = np.exp(-(idx - limit - centers[..., None]) ** 2 / (2 * sigma ** 2))
+    weights[(idx < 0) | (idx >= size)] = 0.0
+    np.clip(idx, 0, size - 1, out=idx)
+
+    strides = size ** np.arange(D - 1, -1, -1)
+    grid = np.zeros((B, size ** D))
+    chunk = max(SPLAT_CHUNK_SIZE // W ** D, 1)
+    for b in range(B):
+        for a0 in range(0, N, chunk):
+            a1 = min(a0 + chunk, N)
+            flat = 0
+            w = 1.0
+            for d in range(D):
+                shape = (-1,) + (1,) * d + (W,) + (1,) * (D - d - 1)
+                flat = flat + (idx[b, a0:a1, d] * strides[d]).reshape(shape)
+                w = w * weights[b, a0:a1, d].reshape(shape)
+            grid[b] += np.bincount(flat.ravel(), weights=w.ravel(), minlength=size ** D)
+    return grid.reshape((B,) + (size,) * D)
+
+
+def PDB2VolumeSplat(PDB, volume_size, sigma, sampling_rate, cutoff=SPLAT_CUTOFF):
+    # Same as PDB2Volume, with the Gaussians truncated at cutoff*sigma
+    # PDB: array of atomic coordinates (N, 3), or a batch of structures (B, N, 3)
+    # returns the volume (volume_size, volume_size, volume_size) indexed [z, y, x], or a batch of volumes
+    PDB = _to_numpy(PDB)
+    single = PDB.ndim == 2
+    PDB = PDB.reshape((-1,) + PDB.shape[-2:]) / sampling_rate
+    # volume indexed [z, y, x]
+    volumes = splatGaussians(PDB[..., ::-1], volume_size, sigma, cutoff)
+    return volumes[0] if single else volumes
+
+
+def projectPDB2ImageSplat(PDB, size, sampling_rate=1, sigma=1, rot=0, tilt=0, psi=0, shift_x=0, shift_y=0, shift_z=0,
+                          cutoff=SPLAT_CUTOFF):
+    # Same as projectPDB2Image, with the Gaussians truncated at cutoff*sigma
+    # PDB: array of atomic coordinates (N, 3), or a batch of structures (B, N, 3)
+    # rot, tilt, psi, shift_x, shift_y, shift_z: a view, or arrays (B,) of views (a single structure is then projected
+    # in every view)
+    # returns the projection (size, size), or a batch of projections (B, size, size)
+    PDB = _to_numpy(PDB)
+    views = np.broadcast_arrays(*[_to_numpy(v) for v in (rot, tilt, psi, shift_x, shift_y, shift_z)])
+    single = PDB.ndim == 2 and views[0].ndim == 0
+    PDB = PDB.reshape((-1,) + PDB.shape[-2:])
+    views = [np.reshape(v, -1) for v in views]
+    # The inverse of a rotation matrix is its transpose
+    T = np.swapaxes(euler_matrices_np(views[0], views[1], views[2]), -1, -2)
+    shifts = np.stack(views[3:], axis=-1)
+    PDB = np.matmul(PDB, T) / sampling_rate + shifts[:, None, :]
+    projections = torch.tensor(splatGaussians(PDB[..., :2], size, sigma, cutoff), dtype=torch.float)
+    return projections[0] if single else projections
+
+
 def save_volume(vol, filename):
     vol = np.float32(vol)
     # From the spider format:
@@ -7,6 +7,7 @@ Reading spider format volumes into numpy arrays, and saving 3D numpy arrays into
 # The spider format that was used to build the functions
 # http://spider.wadsworth.org/spider_doc/spider/docs/image_doc.html
 
+import os
 import sys
 from struct import pack, unpack
 import numpy as np
@@ -60,28 +61,93 @@ labels = {i - 1: v for i, v in [
 locations = {v: k for k, v in labels.items()}
 
 
+# Headers already parsed, by file: (mtime, size, SpiderHeader)
+_header_cache = {}
+HEADER_CACHE_SIZE = 1024
+
+
+class SpiderHeader:
+    """Geometry of a spider file (volume, image or stack), parsed from its header."""
+
+    def __init__(self, filename, endianness='ieee-le'):
+        e = {'ieee-le': '<', 'ieee-be': '>'}[endianness]
+        with open(filename, 'rb') as f:
+            raw = f.read(4 * 256)
+        fields = np.frombuffer(raw[:len(raw) // 4 * 4], dtype='%sf4' % e)
+        if len(fields) < 13:
+            raise RuntimeError('%s is not a spider file' % filename)
+        self.dtype = np.dtype('%sf4' % e)
+        nz, ny, nx, labrec = [int(fields[i]) for i in [0, 1, 11, 12]]
+        self.shape = (nx, ny, nz)
+        self.header_bytes = 4 * nx * labrec
+        self.istack = int(fields[locations['ISTACK/MAXINDX']]) if len(fields) > 25 else 0
+        # Number of images of a stack, each one preceded by its own header
+        self.maxim = int(fields[locations['MAXIM']]) if self.istack > 0 else 0
+
+    @property
+    def voxels(self):
+        nx, ny, nz = self.shape
+        return nx * ny * nz
+
+
+def read_header(filename, endianness='ieee-le'):
+    """Return the header of a spider file, parsed once and cached until the file changes."""
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), endianness)
+    cached = _header_cache.get(key)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    header = SpiderHeader(filename, endianness)
+    if len(_header_cache) >= HEADER_CACHE_SIZE:
+        _header_cache.pop(next(iter(_header_cache)))
+    _header_cache[key] = (stat.st_mtime_ns, stat.st_size, header)
+    return header
+
+
+def mmap_volume(filename, endianness='ieee-le', mode='r'):
+    """Return a memory map (nx, ny, nz) of the volume of a spider file, without reading it."""
+    header = read_header(filename, endianness)
+    return np.memmap(filename, dtype=header.dtype, mode=mode, offset=header.header_bytes, shape=header.shape)
+
+
+def mmap_stack(filename, endianness='ieee-le', mode='r'):
+    """Return a memory map (n, nx, ny, nz) of all the images of a spider file (a volume or image is a stack of 1)."""
+    header = read_header(filename, endianness)
+    if header.istack <= 0:
+        return mmap_volume(filename, endianness, mode)[None]
+    # Each image is preceded by its header, skipped by a structured view
+    record = np.dtype([('header', 'u1', header.header_bytes), ('data', header.dtype, (header.voxels,))])
+    records = np.memmap(filename, dtype=record, mode=mode, offset=header.header_bytes, shape=(header.maxim,))
+    return records['data'].reshape((header.maxim,) + header.shape)
+
+
+def mmap_image(filename, n=0, endianness='ieee-le', mode='r'):
+    """Return a memory map of the image n of a spider file, (nx, ny) for 2D images, (nx, ny, nz) otherwise."""
+    image = mmap_stack(filename, endianness, mode)[n]
+    return image[:, :, 0] if image.shape[2] == 1 else image
+
+
+def read_stack(filename, indices=None, endianness='ieee-le'):
+    """Read the images of indices (all by default) of a spider file in an array (len(indices), nx, ny[, nz])."""
+    stack = mmap_stack(filename, endianness)
+    if indices is None:
+        indices = np.arange(len(stack))
+    # Sorted reads, in the order of the file
+    indices = np.asarray(indices, dtype=int)
+    order = np.argsort(indices, kind='stable')
+    images = np.empty((len(indices),) + stack.shape[1:], dtype=np.float32)
+    images[order] = stack[indices[order]]
+    return images[:, :, :, 0] if images.shape[3] == 1 else images
+
+
 def open_volume(filename, endianness='ieee-le'):
     """Read a volume in spider format and return a numpy array."""
-    f = open(filename, encoding="latin-1")
-    e = {'ieee-le': '<', 'ieee-be': '>'}[endianness]
-    fields = unpack('%s13f' % e, bytes(f.read(4 * 13), encoding="latin-1"))
-    nz, ny, nx, labrec = [int(fields[i]) for i in [0, 1, 11, 12]]
-    f.seek(4 * nx * labrec)  # go to end of header
-    # print(np.fromfile(f, dtype='%sf4' % e).size)
-    return np.fromfile(f, dtype='%sf4' % e).reshape((nx, ny, nz))
+    return np.array(mmap_volume(filename, endianness))
 
 
 def open_image(filename, n=0, endianness='ieee-le'):
     """Read an image from a file in spider format and return a numpy array."""
-    f = open(filename, encoding="latin-1")
-    e = {'ieee-le': '<', 'ieee-be': '>'}[endianness]
-    fields = unpack('%s256f' % e, bytes(f.read(4 * 256), encoding="latin-1"))
-    nz, ny, nx, labrec = [int(fields[i]) for i in [0, 1, 11, 12]]
-    size = nx * labrec
-    if size != 256:
-        f.seek(4 * size)
-    f.seek(4 * n * (size + nx * ny * nz), 1)
-    return np.fromfile(f, dtype='%sf4' % e, count=nx * ny).reshape((nx, ny))
+    return np.array(mmap_image(filename, n, endianness))
 
 
 def save_volume(vol, filename):
@@ -0,0 +1,192 @@
+"""
+Pairwise missing-wedge compensated cross-correlation of aligned subtomograms.
+
+The correlation of two subtomograms i and j is computed on the Fourier coefficients that are sampled in both of them
+(product of their aligned missing wedge masks). Instead of filtering and transforming back each pair of volumes, the
+normalized cross correlation is evaluated in Fourier space (Parseval): the spectrum of each subtomogram is computed
+once and stored in a stack on disk, then the matrix is filled by blocks of rows and columns distributed over a pool of
+processes. Each process keeps a bounded LRU cache of the blocks of spectra it has read. Finished blocks are saved in a
+checkpoint, so that an interrupted computation resumes where it stopped.
+"""
+
+import os
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from continuousflex.protocols.utilities.spider_files3 import open_volume, read_header
+
+COVARIANCE_BLOCK_SIZE = 16
+SPECTRA_CACHE_BLOCKS = 4
+CHECKPOINT_INTERVAL = 16
+
+
+class SpectraCache:
+    """
+    Bounded LRU cache of blocks of spectra and missing wedge masks read from the stacks written by computeSpectra
+    """
+
+    def __init__(self, spectra_file, wedges_file, block_size=COVARIANCE_BLOCK_SIZE, max_blocks=SPECTRA_CACHE_BLOCKS):
+        self.spectra = np.load(spectra_file, mmap_mode="r")
+        self.wedges = np.load(wedges_file, mmap_mode="r")
+        self.shape = self.wedges.shape[1:]
+        self.block_size = block_size
+        self.max_blocks = max(max_blocks, 2)
+        self._blocks = OrderedDict()
+
+    def __len__(self):
+        return self.spectra.shape[0]
+
+    def getBlock(self, b):
+        """
+        :param int b: index of the block
+        :return tuple: spectra (B, n), wedge masks (B, n) and wedge masks at opposite frequencies (B, n)
+        """
+        if b in self._blocks:
+            self._blocks.move_to_end(b)
+            return self._blocks[b]
+        rows = slice(b * self.block_size, min((b + 1) * self.block_size, len(self)))
+        spectra = np.array(self.spectra[rows])
+        wedges = np.array(self.wedges[rows])
+        # value of the masks at -k (modulo the size of the volume)
+        flipped = np.roll(wedges[:, ::-1, ::-1, ::-1], 1, axis=(1, 2, 3))
+        block = (spectra.reshape(len(spectra), -1), wedges.reshape(len(wedges), -1),
+                 flipped.reshape(len(flipped), -1))
+        self._blocks[b] = block
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+
+def computeSpectra(volumes, wedges, spectra_file, wedges_file, numberOfThreads=1):
+    """
+    Compute once the spectrum of each subtomogram and store them with the missing wedge masks
+    :param list volumes: aligned subtomograms files
+    :param list wedges: aligned missing wedge masks files (centered frequencies, as fftshift)
+    :param str spectra_file: output .npy stack of the spectra (complex64)
+    :param str wedges_file: output .npy stack of the masks with the zero frequency first (float32)
+    :param int numberOfThreads: number of processes
+    """
+    shape = read_header(wedges[0]).shape
+    # The stacks are renamed once complete, their existence means that they can be reused
+    spectra = open_memmap(spectra_file + ".tmp.npy", mode="w+", dtype=np.complex64, shape=(len(volumes),) + shape)
+    masks = open_memmap(wedges_file + ".tmp.npy", mode="w+", dtype=np.float32, shape=(len(volumes),) + shape)
+    tasks = list(zip(volumes, wedges))
+    with multiprocessing.Pool(max(min(numberOfThreads, len(tasks)), 1)) as pool:
+        for i, (spectrum, mask) in enumerate(pool.imap(_spectrumWorker, tasks, chunksize=4)):
+            spectra[i] = spectrum
+            masks[i] = mask
+    spectra.flush()
+    masks.flush()
+    del spectra, masks
+    os.replace(wedges_file + ".tmp.npy", wedges_file)
+    os.replace(spectra_file + ".tmp.npy", spectra_file)
+
+
+def _spectrumWorker(task):
+    volume, wedge = task
+    spectrum = np.fft.fftn(open_volume(volume))
+    # The mean of the volumes is removed by the normalization of the cross correlation
+    spectrum[0, 0, 0] = 0.0
+    return spectrum.astype(np.complex64), np.fft.ifftshift(open_volume(wedge)).astype(np.float32)
+
+
+def wedgeCorrelationBlock(cache, bi, bj):
+    """
+    Normalized cross correlation between the subtomograms of the row block bi and the column block bj, each pair being
+    filtered by the product of their missing wedge masks
+    :param SpectraCache cache: spectra
+    :param int bi: row block
+    :param int bj: column block
+    :return np.ndarray: correlation block
+    """
+    Fi, Mi, Mi_r = cache.getBlock(bi)
+    Fj, Mj, Mj_r = cache.getBlock(bj)
+    block = np.zeros((len(Fi), len(Fj)))
+    power_j = Fj.real ** 2 + Fj.imag ** 2
+    for i in range(len(Fi)):
+        # Real part of the filtered volume <=> filter symmetrized over k and -k
+        W = (Mi[i] * Mj + Mi_r[i] * Mj_r) / 2.0
+        W *= W
+        cross = Fi[i].real * Fj.real + Fi[i].imag * Fj.imag
+        power_i = Fi[i].real ** 2 + Fi[i].imag ** 2
+        num = np.sum(W * cross, axis=1, dtype=np.float64)
+        den = np.sqrt(np.sum(W * power_i, axis=1, dtype=np.float64) * np.sum(W * power_j, axis=1, dtype=np.float64))
+        block[i] = num / den
+    return block
+
+
+_worker_cache = None
+
+
+def _initWorker(spectra_file, wedges_file, block_size, max_blocks):
+    global _worker_cache
+    _worker_cache = SpectraCache(spectra_file, wedges_file, block_size, max_blocks)
+
+
+def _blockWorker(task):
+    bi, bj = task
+    return bi, bj, wedgeCorrelationBlock(_worker_cache, bi, bj)
+
+
+def wedgeCovarianceMatrix(spectra_file, wedges_file, checkpoint_file, numberOfThreads=1,
+                          block_size=COVARIANCE_BLOCK_SIZE, max_blocks=SPECTRA_CACHE_BLOCKS):
+    """
+    Compute the symmetric matrix of missing-wedge compensated cross correlations of the subtomograms
+    :param str spectra_file: stack of spectra written by computeSpectra
+    :param str wedges_file: stack of wedge masks written by computeSpectra
+    :param str checkpoint_file: .npz file where the matrix and the finished blocks are saved
+    :param int numberOfThreads: number of processes
+    :param int block_size: number of rows/columns of a block
+    :param int max_blocks: number of blocks of spectra cached by each process
+    :return np.ndarray: correlation matrix
+    """
+    N = np.load(spectra_file, mmap_mode="r").shape[0]
+    nblocks = (N + block_size - 1) // block_size
+    X, done = loadCheckpoint(checkpoint_file, N, nblocks)
+
+    # Row major order, so that the row block stays in the cache of the process
+    tasks = [(bi, bj) for bi in range(nblocks) for bj in range(bi, nblocks) if not done[bi, bj]]
+    print("> Computing %i blocks of the correlation matrix (%i already done)" % (len(tasks), np.sum(done)))
+    if len(tasks) == 0:
+        return X
+    with multiprocessing.Pool(max(min(numberOfThreads, len(tasks)), 1), initializer=_initWorker,
+                              initargs=(spectra_file, wedges_file, block_size, max_blocks)) as pool:
+        chunksize = max(1, min(nblocks // 2, len(tasks) // (4 * max(numberOfThreads, 1))))
+        for n, (bi, bj, block) in enumerate(pool.imap_unordered(_blockWorker, tasks, chunksize=chunksize)):
+            rows = slice(bi * block_size, bi * block_size + block.shape[0])
+            cols = slice(bj * block_size, bj * block_size + block.shape[1])
+            X[rows, cols] = block
+            X[cols, rows] = block.T
+            done[bi, bj] = True
+            if (n + 1) % CHECKPOINT_INTERVAL == 0:
+                saveCheckpoint(checkpoint_file, X, done)
+                print("\t %i / %i blocks" % (n + 1, len(tasks)))
+    saveCheckpoint(checkpoint_file, X, done)
+    return X
+
+
+def loadCheckpoint(checkpoint_file, N, nblocks):
+    """
+    :return tuple: partial matrix and mask of the finished blocks, restored from the checkpoint if it matches
+    """
+    if os.path.exists(checkpoint_file):
+        try:
+            with np.load(checkpoint_file) as checkpoint:
+                X = checkpoint["X"]
+                done = checkpoint["done"]
+            if X.shape == (N, N) and done.shape == (nblocks, nblocks):
+                return X, done
+        except (OSError, ValueError, KeyError):
+            pass
+        print("Warning : Can not resume from checkpoint %s" % checkpoint_file)
+    return np.zeros((N, N)), np.zeros((nblocks, nblocks), dtype=bool)
+
+
+def saveCheckpoint(checkpoint_file, X, done):
+    # Write to a temporary file first, an interruption while saving must not corrupt the checkpoint
+    tmp_file = checkpoint_file + ".tmp.npz"
+    np.savez(tmp_file, X=X, done=done)
+    os.replace(tmp_file, checkpoint_file)
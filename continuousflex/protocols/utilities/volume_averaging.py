@@ -0,0 +1,105 @@
+"""
+Averaging of aligned volumes in memory.
+
+Each volume is rotated and shifted following the xmipp_transform_geometry conventions (Euler angles of xmipp, origin
+at the center of the volume, cubic B-spline interpolation, wrapping), the volumes are distributed over a pool of
+processes that each sum their share, and only the final average is written.
+"""
+
+import multiprocessing
+import numpy as np
+from scipy.ndimage import affine_transform
+import pwem.emlib.metadata as md
+from pwem.emlib.image import ImageHandler
+
+from continuousflex.protocols.convert import eulerAngles2matrix
+from continuousflex.protocols.utilities.spider_files3 import save_volume
+
+AVERAGING_THREADS = max(multiprocessing.cpu_count() // 2, 1)
+SPLINE_ORDER = 3
+
+
+def geometryMatrix(rot, tilt, psi, shiftx=0.0, shifty=0.0, shiftz=0.0, inverse=False, angleY90=False):
+    """
+    Transformation applied by xmipp_transform_geometry --rotate_volume euler rot tilt psi --shift x y z [--inverse]
+    :param bool inverse: apply the inverse transformation
+    :param bool angleY90: the volume is first rotated by 90 degrees about Y (euler 0 90 0), as for the alignments
+                          where MDL_ANGLE_Y is 90, then by the (non inverted) transformation
+    :return np.ndarray: 4x4 matrix acting on (x, y, z, 1)
+    """
+    A = eulerAngles2matrix(rot, tilt, psi, shiftx, shifty, shiftz)
+    if inverse:
+        A = np.linalg.inv(A)
+    if angleY90:
+        A = A @ eulerAngles2matrix(0, 90, 0, 0, 0, 0)
+    return A
+
+
+def applyGeometry(vol, A, order=SPLINE_ORDER):
+    """
+    Transform a volume: the value at r in the output is the value at A^-1 r in the input (r relative to the center)
+    :param np.ndarray vol: volume (Z, Y, X)
+    :param np.ndarray A: 4x4 matrix acting on (x, y, z, 1)
+    :return np.ndarray: transformed volume
+    """
+    Ainv = np.linalg.inv(A)
+    # numpy index order is (z, y, x)
+    matrix = Ainv[2::-1, 2::-1]
+    center = np.array(vol.shape) // 2
+    offset = center - matrix @ center + Ainv[2::-1, 3]
+    return affine_transform(vol, matrix, offset=offset, order=order, mode='grid-wrap')
+
+
+def readAlignedVolumes(mdFile, inverse=True, angleY90=False, align=True):
+    """
+    :param str mdFile: metadata of the volumes and their alignment
+    :param bool inverse: apply the inverse of the alignment
+    :param bool angleY90: rotate first the volumes by 90 degrees about Y (MDL_ANGLE_Y == 90)
+    :param bool align: if False the volumes are averaged without transformation
+    :return list: (image path, 4x4 matrix or None) for each volume
+    """
+    mdVols = md.MetaData(mdFile)
+    volumes = []
+    for objId in mdVols:
+        imgPath = mdVols.getValue(md.MDL_IMAGE, objId)
+        if align:
+            A = geometryMatrix(mdVols.getValue(md.MDL_ANGLE_ROT, objId), mdVols.getValue(md.MDL_ANGLE_TILT, objId),
+                               mdVols.getValue(md.MDL_ANGLE_PSI, objId), mdVols.getValue(md.MDL_SHIFT_X, objId),
+                               mdVols.getValue(md.MDL_SHIFT_Y, objId), mdVols.getValue(md.MDL_SHIFT_Z, objId),
+                               inverse=inverse, angleY90=angleY90)
+        else:
+            A = None
+        volumes.append((imgPath, A))
+    return volumes
+
+
+def _sumWorker(volumes):
+    total = None
+    for imgPath, A in volumes:
+        vol = ImageHandler().read(imgPath).getData()
+        if A is not None:
+            vol = applyGeometry(np.float64(vol), A)
+        total = np.array(vol, dtype=np.float64) if total is None else total + vol
+    return total
+
+
+def averageVolumes(volumes, outputVol, numberOfThreads=AVERAGING_THREADS):
+    """
+    Average volumes after applying their transformation, only the average is written
+    :param list volumes: (image path, 4x4 matrix or None) for each volume, see readAlignedVolumes
+    :param str outputVol: output average (spider)
+    :param int numberOfThreads: number of processes, each one returns the sum of its share of the volumes
+    :return np.ndarray: average
+    """
+    if len(volumes) == 0:
+        raise RuntimeError("No volumes to average")
+    numberOfThreads = max(min(numberOfThreads, len(volumes)), 1)
+    chunks = [volumes[i::numberOfThreads] for i in range(numberOfThreads)]
+    if numberOfThreads == 1:
+        sums = [_sumWorker(chunks[0])]
+    else:
+        with multiprocessing.Pool(numberOfThreads) as pool:
+            sums = pool.map(_sumWorker, chunks)
+    average = np.sum(sums, axis=0) / len(volumes)
+    save_volume(np.float32(average), outputVol)
+    return average
@@ -0,0 +1,84 @@
+# **************************************************************************
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# **************************************************************************
+"""
+Benchmark of the columnar PDB reader/writer against the per-line reference path.
+
+    python -m continuousflex.tests.benchmark_pdb_handler [n_atoms]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from continuousflex.protocols.utilities.pdb_handler import ContinuousFlexPDBHandler
+
+ATOM_NAMES = ["N", "CA", "C", "O", "CB", "CG", "OD1", "ND2"]
+
+
+def write_synthetic_pdb(fname, n_atoms, seed=0):
+    rng = np.random.default_rng(seed)
+    coords = np.clip(rng.normal(0.0, 100.0, (n_atoms, 3)), -999.0, 9999.0)
+    temp = rng.uniform(0.0, 200.0, n_atoms)
+    with open(fname, "w") as f:
+        f.write("REMARK synthetic structure for benchmarking\n")
+        for i in range(n_atoms):
+            f.write("ATOM  %5s %-4s %-4s%1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f      %-4s%2s\n" % (
+                i + 1 if i < 99999 else "*****", ATOM_NAMES[i % len(ATOM_NAMES)], "ASN",
+                "AB"[(i // 50000) % 2], (i // len(ATOM_NAMES)) % 9999 + 1,
+                coords[i, 0], coords[i, 1], coords[i, 2], 1.0, temp[i], "P%03d" % (i // 70000),
+                ATOM_NAMES[i % len(ATOM_NAMES)][0]))
+        f.write("END\n")
+
+
+def timeit(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.time()
+        out = func(*args, **kwargs)
+    return out, time.time() - start
+
+
+def run(n_atoms=500000):
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "input.pdb")
+        write_synthetic_pdb(fname, n_atoms)
+
+        ref, t_read_ref = timeit(ContinuousFlexPDBHandler, fname, vectorized=False)
+        mol, t_read = timeit(ContinuousFlexPDBHandler, fname)
+        for attr, val in vars(ref).items():
+            if isinstance(val, np.ndarray):
+                assert val.dtype == getattr(mol, attr).dtype and np.array_equal(val, getattr(mol, attr)), attr
+
+        _, t_write_ref = timeit(ref.write_pdb, os.path.join(tmp, "ref.pdb"), vectorized=False)
+        _, t_write = timeit(mol.write_pdb, os.path.join(tmp, "out.pdb"))
+        with open(os.path.join(tmp, "ref.pdb"), "rb") as f1, open(os.path.join(tmp, "out.pdb"), "rb") as f2:
+            assert f1.read() == f2.read(), "Written PDB files differ"
+
+    print("%i atoms" % n_atoms)
+    print("\t read  : per-line %.3f s, columnar %.3f s (x%.1f)" % (t_read_ref, t_read, t_read_ref / t_read))
+    print("\t write : per-line %.3f s, columnar %.3f s (x%.1f)" % (t_write_ref, t_write, t_write_ref / t_write))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
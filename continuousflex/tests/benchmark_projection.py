@@ -0,0 +1,71 @@
+# **************************************************************************
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# **************************************************************************
+"""
+Benchmark of the truncated-kernel splatting against the per-voxel/per-pixel reference Gaussian rendering.
+
+    python -m continuousflex.tests.benchmark_projection [n_atoms] [size]
+"""
+import sys
+import time
+
+import numpy as np
+import torch
+
+from continuousflex.protocols.utilities.processing_dh.utils.projection import PDB2Volume, PDB2VolumeSplat, \
+    projectPDB2Image, projectPDB2ImageSplat
+
+SAMPLING_RATE = 2.0
+SIGMA = 1.5
+N_VIEWS = 16
+
+
+def timeit(func, *args, **kwargs):
+    start = time.time()
+    out = func(*args, **kwargs)
+    return out, time.time() - start
+
+
+def run(n_atoms=1000, size=32):
+    rng = np.random.default_rng(0)
+    coords = rng.normal(0.0, size * SAMPLING_RATE / 8, (n_atoms, 3))
+    angles = rng.uniform(0.0, 180.0, (N_VIEWS, 3))
+
+    ref, t_vol_ref = timeit(PDB2Volume, coords, size, SIGMA, SAMPLING_RATE)
+    vol, t_vol = timeit(PDB2VolumeSplat, coords, size, SIGMA, SAMPLING_RATE)
+    err_vol = np.abs(ref - vol).max() / np.abs(ref).max()
+
+    pdb = torch.tensor(coords, dtype=torch.float)
+    start = time.time()
+    refs = [projectPDB2Image(pdb, size, SAMPLING_RATE, SIGMA, *a) for a in angles]
+    t_proj_ref = time.time() - start
+    projs, t_proj = timeit(projectPDB2ImageSplat, pdb, size, SAMPLING_RATE, SIGMA, angles[:, 0], angles[:, 1],
+                           angles[:, 2])
+    err_proj = max(float(torch.max(torch.abs(r - p)) / torch.max(torch.abs(r))) for r, p in zip(refs, projs))
+
+    print("%i atoms, size %i" % (n_atoms, size))
+    print("\t volume      : reference %.3f s, splatting %.3f s (x%.1f), relative error %.1e"
+          % (t_vol_ref, t_vol, t_vol_ref / t_vol, err_vol))
+    print("\t %i views    : reference %.3f s, splatting %.3f s (x%.1f), relative error %.1e"
+          % (N_VIEWS, t_proj_ref, t_proj, t_proj_ref / t_proj, err_proj))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 32)
@@ -0,0 +1,67 @@
+# **************************************************************************
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# **************************************************************************
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from pyworkflow.tests import BaseTest
+
+from continuousflex.protocols.utilities.genesis_utilities import DCDWriter, DCDTrajectory
+
+
+class TestDCDWriter(BaseTest):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.fnDCD = os.path.join(self.tmpDir, "traj.dcd")
+        self.coords = np.random.default_rng(0).normal(0.0, 10.0, (12, 50, 3)).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def readFrames(self):
+        traj = DCDTrajectory(self.fnDCD)
+        frames = np.array(traj.coords)
+        traj.close()
+        return frames
+
+    def testAppend(self):
+        """ Append frames to a closed DCD file """
+        with DCDWriter(self.fnDCD) as dcd:
+            dcd.write(self.coords[:10])
+        with DCDWriter(self.fnDCD, append=True) as dcd:
+            dcd.write(self.coords[10:])
+        np.testing.assert_allclose(self.readFrames(), self.coords)
+
+    def testAppendUnclosed(self):
+        """ Append frames to a DCD file that was not closed (interrupted run) """
+        dcd = DCDWriter(self.fnDCD)
+        dcd.write(self.coords[:10])
+        dcd._file.close()
+        # Interrupted before the frame count of the header was patched, with an incomplete last frame
+        with open(self.fnDCD, "r+b") as f:
+            f.seek(DCDWriter.NFRAME_OFFSET)
+            f.write(int.to_bytes(0, DCDWriter.BYTESIZE, "little"))
+            f.seek(0, 2)
+            f.write(b"\0" * 100)
+        with DCDWriter(self.fnDCD, append=True) as dcd:
+            dcd.write(self.coords[10:])
+        np.testing.assert_allclose(self.readFrames(), self.coords)
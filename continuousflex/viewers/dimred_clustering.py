@@ -0,0 +1,98 @@
+# **************************************************************************
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Clustering of the points of the reduced space viewers.
+
+The matrix of the selected axes of the points (not discarded) is built once and kept until the axes or the discarded
+points change. The K-means clustering is a mini-batch K-means, started from the centers of the previous clustering
+when the number of clusters and the axes are the same, and the points are assigned to their nearest center (or
+trajectory point) with a single KD-tree query.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sklearn.cluster import MiniBatchKMeans
+
+KMEANS_BATCH_SIZE = 4096
+KMEANS_N_INIT = 3
+
+
+class ClusteringBackend:
+    """ Cache of the features of a Data and clustering of its points. """
+    def __init__(self, data, batch_size=KMEANS_BATCH_SIZE, random_state=0):
+        """
+        :param Data data: points
+        :param int batch_size: size of the mini-batches of the K-means
+        """
+        self.data = data
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self._columns = None
+        self._visible = None
+        self._features = None
+        self._centers = None
+        self._centersColumns = None
+
+    def getFeatures(self, columns):
+        """
+        :param list columns: selected axes
+        :return tuple: mask of the points used (not discarded), and their features (n, len(columns))
+        """
+        columns = tuple(int(c) for c in columns)
+        visible = self.data.getVisibleMask()
+        if self._features is None or columns != self._columns or not np.array_equal(visible, self._visible):
+            self._columns = columns
+            self._visible = visible.copy()
+            self._features = np.ascontiguousarray(self.data.getCoords()[visible][:, columns], dtype=np.float32)
+        return self._visible, self._features
+
+    def kmeans(self, n_clusters, columns):
+        """
+        Cluster the points with a mini-batch K-means, warm started from the previous centers if possible
+        :param int n_clusters: number of clusters
+        :param list columns: selected axes
+        :return tuple: mask of the points clustered and their cluster (starting at 1)
+        """
+        visible, features = self.getFeatures(columns)
+        if n_clusters > len(features):
+            raise ValueError("Can not find %d clusters with %d points" % (n_clusters, len(features)))
+        # Warm start only from centers found in the same axes
+        if self._centers is not None and self._centersColumns == self._columns and len(self._centers) == n_clusters:
+            init, n_init = self._centers, 1
+        else:
+            init, n_init = 'k-means++', KMEANS_N_INIT
+        k_means = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_init, batch_size=self.batch_size,
+                                  random_state=self.random_state)
+        k_means.fit(features)
+        self._centers = k_means.cluster_centers_
+        self._centersColumns = self._columns
+        return visible, self.nearest(self._centers, columns)[1] + 1
+
+    def nearest(self, centers, columns):
+        """
+        :param np.ndarray centers: (k, len(columns)) coordinates of the centers
+        :param list columns: selected axes
+        :return tuple: mask of the points used and the index of the nearest center of each point
+        """
+        visible, features = self.getFeatures(columns)
+        _, indices = cKDTree(np.asarray(centers, dtype=np.float64)).query(features, workers=-1)
+        return visible, indices
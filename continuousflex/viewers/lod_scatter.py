@@ -0,0 +1,160 @@
+# **************************************************************************
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Level of detail scatter plots for large sets of points.
+
+Up to LOD_MAX_POINTS points, the points are drawn as usual with ax.scatter. Beyond, the plot depends on the current view
+(it is computed again when the view is zoomed or moved): if there are few enough points in the view they are drawn as
+markers, otherwise they are binned in a raster of the size of the axes, colored by the mean weight of the points of
+each bin, with an opacity growing with the number of points of the bin (density).
+"""
+
+import numpy as np
+from matplotlib.image import AxesImage
+
+# Maximum number of markers drawn in a plot
+LOD_MAX_POINTS = 100000
+# Size of the bins of the raster in pixels
+LOD_BIN_PIXELS = 2
+LOD_DENSITY = 'density'
+LOD_SUBSAMPLE = 'subsample'
+
+
+def subsampleIndices(mask, maxPoints=LOD_MAX_POINTS, seed=0):
+    """
+    :param np.ndarray mask: boolean mask of the points (or their indexes)
+    :param int maxPoints: maximum number of points
+    :param int seed: the same points are drawn for the same mask
+    :return np.ndarray: sorted indexes of at most maxPoints points of the mask, drawn uniformly
+    """
+    indices = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else np.asarray(mask)
+    if len(indices) <= maxPoints:
+        return indices
+    choice = np.random.default_rng(seed).choice(len(indices), maxPoints, replace=False)
+    return indices[np.sort(choice)]
+
+
+class _LODImage(AxesImage):
+    """ Raster of the points, the level of detail is updated before each draw. """
+    def __init__(self, ax, lod, **kwargs):
+        AxesImage.__init__(self, ax, origin='lower', interpolation='nearest', **kwargs)
+        self._lod = lod
+
+    def draw(self, renderer, *args, **kwargs):
+        self._lod.refresh()
+        if self.get_visible():
+            AxesImage.draw(self, renderer, *args, **kwargs)
+
+
+class LODScatter:
+    """ Scatter plot of a large number of points, with a level of detail depending on the view. """
+    def __init__(self, ax, xdata, ydata, c, vmin=None, vmax=None, s=None, alpha=None,
+                 maxPoints=LOD_MAX_POINTS, mode=LOD_DENSITY):
+        """
+        :param ax: matplotlib axes
+        :param xdata, ydata: coordinates of the points
+        :param c: weights of the points, mapped to colors
+        :param int maxPoints: maximum number of markers drawn
+        :param str mode: LOD_DENSITY, the points are drawn as a raster when there are more than maxPoints points in
+                         the view, or LOD_SUBSAMPLE, a fixed random subset of maxPoints points of the view is drawn
+        """
+        self.ax = ax
+        self.x = np.asarray(xdata, dtype=float)
+        self.y = np.asarray(ydata, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+        self.alpha = 1.0 if alpha is None else alpha
+        self.maxPoints = maxPoints
+        self.mode = mode
+        # Order in which the points are kept by the subsampling, so that the subset is stable while zooming
+        self._order = np.random.default_rng(0).permutation(len(self.x))
+        # The scatter is created with all points to set the limits and the colors scale, the markers are only
+        # drawn for the points of the view (see refresh)
+        self.scatter = ax.scatter(self.x, self.y, c=self.c, vmin=vmin, vmax=vmax, s=s, alpha=alpha)
+        ax.autoscale_view()
+        # The raster must not change the view
+        ax.set_autoscale_on(False)
+        self.image = _LODImage(ax, self, zorder=self.scatter.get_zorder() - 0.5)
+        self.image.set_data(np.zeros((1, 1, 4)))
+        ax.add_image(self.image)
+        self._key = None
+
+    def getMappable(self):
+        """ Artist to use for the colorbar. """
+        return self.scatter
+
+    def refresh(self):
+        """ Choose the points or the raster drawn for the current view. """
+        xlim = sorted(self.ax.get_xlim())
+        ylim = sorted(self.ax.get_ylim())
+        nx = max(int(self.ax.bbox.width / LOD_BIN_PIXELS), 1)
+        ny = max(int(self.ax.bbox.height / LOD_BIN_PIXELS), 1)
+        key = (tuple(xlim), tuple(ylim), nx, ny)
+        if key == self._key:
+            return
+        self._key = key
+
+        visible = (self.x >= xlim[0]) & (self.x <= xlim[1]) & (self.y >= ylim[0]) & (self.y <= ylim[1])
+        nVisible = np.count_nonzero(visible)
+        if nVisible <= self.maxPoints or self.mode == LOD_SUBSAMPLE:
+            if nVisible <= self.maxPoints:
+                indices = np.flatnonzero(visible)
+            else:
+                indices = np.sort(self._order[visible[self._order]][:self.maxPoints])
+            self.scatter.set_offsets(np.column_stack((self.x[indices], self.y[indices])))
+            self.scatter.set_array(self.c[indices])
+            self.image.set_visible(False)
+            return
+
+        self.scatter.set_offsets(np.zeros((0, 2)))
+        self.scatter.set_array(np.zeros(0))
+        self.image.set_data(self.raster(visible, xlim, ylim, nx, ny))
+        self.image.set_extent((xlim[0], xlim[1], ylim[0], ylim[1]))
+        self.image.set_visible(True)
+
+    def raster(self, visible, xlim, ylim, nx, ny):
+        """
+        :return np.ndarray: RGBA raster (ny, nx, 4) of the visible points
+        """
+        x = self.x[visible]
+        y = self.y[visible]
+        ix = np.minimum(((x - xlim[0]) * (nx / max(xlim[1] - xlim[0], 1e-300))).astype(np.intp), nx - 1)
+        iy = np.minimum(((y - ylim[0]) * (ny / max(ylim[1] - ylim[0], 1e-300))).astype(np.intp), ny - 1)
+        bins = iy * nx + ix
+        counts = np.bincount(bins, minlength=nx * ny)
+        sums = np.bincount(bins, weights=self.c[visible], minlength=nx * ny)
+        filled = counts > 0
+        mean = np.zeros(nx * ny)
+        mean[filled] = sums[filled] / counts[filled]
+
+        rgba = self.scatter.cmap(self.scatter.norm(mean))
+        density = np.log1p(counts) / np.log1p(counts.max())
+        rgba[:, 3] = np.where(filled, self.alpha * (0.25 + 0.75 * density), 0.0)
+        return rgba.reshape(ny, nx, 4)
+
+
+def lodScatter(ax, xdata, ydata, c, vmin=None, vmax=None, s=None, alpha=None, maxPoints=LOD_MAX_POINTS):
+    """ Scatter plot of the points, with a level of detail if there are more than maxPoints points.
+    :return: the artist to use for the colorbar
+    """
+    if len(xdata) <= maxPoints:
+        return ax.scatter(xdata, ydata, c=c, vmin=vmin, vmax=vmax, s=s, alpha=alpha)
+    return LODScatter(ax, xdata, ydata, c, vmin=vmin, vmax=vmax, s=s, alpha=alpha, maxPoints=maxPoints).getMappable()
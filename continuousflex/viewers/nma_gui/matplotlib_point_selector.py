@@ -25,6 +25,7 @@
 # **************************************************************************
 
 from continuousflex.viewers.nma_plotter import plotArray2D_xy
+from continuousflex.viewers.lod_scatter import subsampleIndices
 from math import sqrt
 
 class PointSelector():
@@ -42,6 +43,7 @@ class PointSelector():
         self.s = s.get()
         self.createPlots(ax)
         self.press = None
+        self.background = None
         self.callback = callback
         # connect to all the events we need 
         self.cidpress = self.rectangle_selection.figure.canvas.mpl_connect(
@@ -60,12 +62,13 @@ class PointSelector():
         self.createSelectionPlot(ax)
     
     def getSelectedData(self):
-        xs, ys = [], []
-        for point in self.data:
-            if point.getState() == 1: # point selected
-                xs.append(point.getX())
-                ys.append(point.getY())
-        return xs, ys
+        return self.getXYData(self.data.getSelectedMask())
+
+    def getXYData(self, mask):
+        # Only a representative subset of the selected points is drawn for large data sets
+        indices = subsampleIndices(mask)
+        coords = self.data.getCoords()
+        return coords[indices, self.data.XIND], coords[indices, self.data.YIND]
         
     def createSelectionPlot(self, ax):
         xs, ys = self.getSelectedData()
@@ -87,6 +90,13 @@ class PointSelector():
         self.press = True
         self.originX = event.xdata
         self.originY = event.ydata
+        # During the drag, only the selection is drawn again over a copy of the plot
+        canvas = self.ax.figure.canvas
+        if getattr(canvas, 'supports_blit', False):
+            self.plot_selected.set_animated(True)
+            self.rectangle_selection.set_animated(True)
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.ax.bbox)
         
     def onMotion(self, event):
         if self.press is None: return
@@ -94,6 +104,10 @@ class PointSelector():
         
     def onRelease(self, event):
         self.press = None
+        if self.background is not None:
+            self.background = None
+            self.plot_selected.set_animated(False)
+            self.rectangle_selection.set_animated(False)
         self.update(event, addSelected=True)
         
     def inside(self, x, y, xmin, xmax, ymin, ymax):
@@ -110,7 +124,6 @@ class PointSelector():
             return
         ox, oy = self.originX, self.originY
         ex, ey = event.xdata, event.ydata
-        xs1, ys1 = self.getSelectedData()
         
         x1 = min(ox, ex)
         x2 = max(ox, ex)
@@ -123,17 +136,20 @@ class PointSelector():
             xs = [x1, x2, x2, x1, x1]
             ys = [y1, y1, y2, y2, y1]
             
-        for point in self.data:
-            x, y = point.getX(), point.getY()
-            if self.inside(x, y, x1, x2, y1, y2):
-                xs1.append(x)
-                ys1.append(y)
-                if addSelected:
-                    point.setSelected()
+        # Points inside the rectangle, they are selected only when the mouse is released
+        inside = self.data.selectRectangle(x1, x2, y1, y2, select=addSelected)
+        xs1, ys1 = self.getXYData(self.data.getSelectedMask() | inside)
         
         if self.callback: # Notify changes on selection
             self.callback()
         self.plot_selected.set_data(xs1, ys1)        
         self.rectangle_selection.set_data(xs, ys)
         
-        self.ax.figure.canvas.draw()
+        if self.background is not None:
+            canvas = self.ax.figure.canvas
+            canvas.restore_region(self.background)
+            self.ax.draw_artist(self.plot_selected)
+            self.ax.draw_artist(self.rectangle_selection)
+            canvas.blit(self.ax.bbox)
+        else:
+            self.ax.figure.canvas.draw()
@@ -159,8 +159,7 @@ class ClusteringWindow(gui.Window):
     def _onResetClick(self, e=None):
         """ Clean the expression and the current selection. """
         self.expressionVar.set('')
-        for point in self.data:
-            point.setState(Point.NORMAL)
+        self.data.setStates(self.data.getVisibleMask(), Point.NORMAL)
         self._onUpdateClick()
 
     def _onCreateClick(self, e=None):
@@ -173,9 +172,7 @@ class ClusteringWindow(gui.Window):
         """
         value = self.expressionVar.get().strip()
         if value:
-            for point in self.data:
-                if point.eval(value):
-                    point.setState(Point.SELECTED)
+            self.data.setStates(self.data.evalExpression(value), Point.SELECTED)
 
     def _onUpdateClick(self, e=None):
         components = self.listbox.curselection()
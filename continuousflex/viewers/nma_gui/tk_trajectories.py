@@ -166,8 +166,7 @@ class TrajectoriesWindow(gui.Window):
         """ Clean the expression and the current selection. """
         self.expressionVar.set('')
         self.pathData.clear()
-        for point in self.data.iterAll():
-            point.setState(Point.NORMAL)
+        self.data.setStates(slice(None), Point.NORMAL)
         self._onUpdateClick()
         self.generateBtn.config(state=tk.DISABLED)
 
@@ -188,9 +187,7 @@ class TrajectoriesWindow(gui.Window):
         """
         value = self.expressionVar.get().strip()
         if value:
-            for point in self.data:
-                if point.eval(value):
-                    point.setState(Point.DISCARDED)
+            self.data.setStates(self.data.evalExpression(value), Point.DISCARDED)
 
     def setDataIndex(self, indexName, value):
         """ Set which point data index will be used as X, Y or Z. """
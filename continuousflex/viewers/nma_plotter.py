@@ -26,6 +26,7 @@
 
 import numpy as np
 from .plotter import FlexPlotter
+from .lod_scatter import lodScatter, subsampleIndices
 
 class FlexNmaPlotter(FlexPlotter):
     """ Add some extra plot utilities to XmippPlotter class, mainly for
@@ -128,6 +129,9 @@ class FlexNmaPlotter(FlexPlotter):
         ydata = self._data.getYData()
         zdata = self._data.getZData()
         weights = self._data.getWeights()
+        # Representative subset of the points of large data sets
+        subset = subsampleIndices(np.ones(len(weights), dtype=bool))
+        xdata, ydata, zdata, weights = xdata[subset], ydata[subset], zdata[subset], weights[subset]
 
         lowx = lowy = lowz = None
         try:
@@ -168,12 +172,10 @@ class FlexNmaPlotter(FlexPlotter):
             cax = ax.scatter3D(xdata, ydata, zdata, c= weights, vmin=color_low,
                                vmax=color_high, alpha=alpha, s=s)
 
-        x2, y2, z2 = [], [], []
-        for point in self._data:
-            if point.getState() == 1:
-                x2.append(point.getX())
-                y2.append(point.getY())
-                z2.append(point.getZ())
+        coords = self._data.getCoords()
+        selected = subsampleIndices(self._data.getSelectedMask())
+        x2, y2, z2 = (coords[selected, self._data.XIND], coords[selected, self._data.YIND],
+                      coords[selected, self._data.ZIND])
         ax.scatter(x2, y2, z2, color='yellow', alpha=0.4, s=8)
         cb = ax.figure.colorbar(cax)
         cb.set_label('Error')
@@ -192,6 +194,9 @@ class FlexNmaPlotter(FlexPlotter):
         ydata = self._data.getYData()
         zdata = self._data.getZData()
         weights = self._data.getWeights()
+        # Representative subset of the points of large data sets
+        subset = subsampleIndices(np.ones(len(weights), dtype=bool))
+        xdata, ydata, zdata, weights = xdata[subset], ydata[subset], zdata[subset], weights[subset]
 
         lowx = lowy = lowz = None
         try:
@@ -224,13 +229,6 @@ class FlexNmaPlotter(FlexPlotter):
         else:
             cax = ax.scatter3D(xdata, ydata, zdata, c= np.ones(len(weights))-weights, vmin=self._limitlow.get(),
                                vmax=self._limitup.get(), alpha=alpha, s=s)
-        x2, y2, z2 = [], [], []
-        for point in self._data:
-            if point.getState() == 1:
-                x2.append(point.getX())
-                y2.append(point.getY())
-                z2.append(point.getZ())
-        # ax.scatter(x2, y2, z2, color='yellow', alpha=0.4, s=8)
         # cb = ax.figure.colorbar(cax)
         # cb.set_label('1- Cross Correlation')
         # Disable tight_layout that is not available for 3D
@@ -244,10 +242,10 @@ def plotArray2D(ax, data, vvmin=None, vvmax=None, s = None, alpha = None, cbar_l
     ydata = data.getYData()
     weights = data.getWeights()
     if vvmin:
-        cax = ax.scatter(xdata, ydata, c=weights, vmin=vvmin.get(), vmax=vvmax.get(), s=s, alpha=alpha)
+        cax = lodScatter(ax, xdata, ydata, weights, vmin=vvmin.get(), vmax=vvmax.get(), s=s, alpha=alpha)
     else:
         # cax = ax.scatter(xdata, ydata, weights)
-        cax = ax.scatter(xdata, ydata, c=weights, s=s, alpha=alpha)
+        cax = lodScatter(ax, xdata, ydata, weights, s=s, alpha=alpha)
     cb = ax.figure.colorbar(cax)
     cb.set_label(cbar_label)
 
@@ -256,6 +254,6 @@ def plotArray2D_xy(ax, data, vvmin=None, vvmax=None, s = None, alpha = None):
     ydata = data.getYData()
     weights = data.getWeights()
     if vvmin:
-        cax = ax.scatter(xdata, ydata, c=weights, vmin=vvmin.get(), vmax=vvmax.get(), s=s, alpha=alpha)
+        cax = lodScatter(ax, xdata, ydata, weights, vmin=vvmin.get(), vmax=vvmax.get(), s=s, alpha=alpha)
     else:
-        cax = ax.scatter(xdata, ydata, c=weights, s=s, alpha=alpha)
\ No newline at end of file
+        cax = lodScatter(ax, xdata, ydata, weights, s=s, alpha=alpha)
\ No newline at end of file
@@ -157,8 +157,7 @@ class ClusteringWindowVol(gui.Window):
     def _onResetClick(self, e=None):
         """ Clean the expression and the current selection. """
         self.expressionVar.set('')
-        for point in self.data:
-            point.setState(Point.NORMAL)
+        self.data.setStates(self.data.getVisibleMask(), Point.NORMAL)
         self._onUpdateClick()
 
     def _onCreateClick(self, e=None):
@@ -171,9 +170,7 @@ class ClusteringWindowVol(gui.Window):
         """
         value = self.expressionVar.get().strip()
         if value:
-            for point in self.data:
-                if point.eval(value):
-                    point.setState(Point.SELECTED)
+            self.data.setStates(self.data.evalExpression(value), Point.SELECTED)
 
     def _onUpdateClick(self, e=None):
         components = self.listbox.curselection()
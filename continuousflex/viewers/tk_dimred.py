@@ -6,7 +6,7 @@ from tkinter import Radiobutton
 import numpy as np
 import scipy as sp
 from continuousflex.protocols.data import Point, Data, PathData
-from sklearn.cluster import KMeans
+from continuousflex.viewers.dimred_clustering import ClusteringBackend
 
 TOOL_TRAJECTORY = 1
 TOOL_CLUSTERING = 2
@@ -21,6 +21,8 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
         self._alpha=self.alpha
         self._s=self.s
         self._clusterNumber = 0
+        # Keeps the features and the centers between the clusterings
+        self.clusteringBackend = ClusteringBackend(self.data)
 
     def _createContent(self, content):
         self._createModeBox(content)
@@ -258,16 +260,12 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
             return self.showError("Can not read number of clusters")
         self._onUpdateClick()
 
-        k_means = KMeans(init='k-means++', n_clusters=n_clusters)
-        selection = np.array(self.listbox.curselection())
-        data_arr = np.array([p.getData()[selection] for p in self.data])
-        k_means.fit(data_arr)
-
-        classes = k_means.labels_ + 1
-        i=0
-        for point in self.data:
-            point._weight = classes[i]
-            i+=1
+        selection = self.listbox.curselection()
+        try:
+            visible, classes = self.clusteringBackend.kmeans(n_clusters, selection)
+        except ValueError as e:
+            return self.showError(str(e))
+        self.data.setWeights(classes, visible)
         self.saveClusterBtn.config(state=tk.NORMAL)
         self._onUpdateClick()
         self.setClusterNumber(3)
@@ -277,7 +275,7 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
         traj_axis = self.trajAxisBtn.getValue()
         traj_type = self.trajTypeBtn.getValue()
 
-        data_axis = np.array([p.getData()[traj_axis] for p in self.data])
+        data_axis = self.data.getCoords()[self.data.getVisibleMask(), traj_axis]
         mean_axis =data_axis.mean()
         std_axis =data_axis.std()
         min_axis =data_axis.min()
@@ -310,14 +308,12 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
         self._onUpdateClick()
 
     def _onUpdateCluster(self):
-        traj_arr = np.array([p.getData() for p in self.pathData])
-        selection = np.array(self.listbox.curselection())
-        traj_sel = traj_arr[:, selection]
+        selection = self.listbox.curselection()
+        traj_sel = self.pathData.getCoords()[self.pathData.getVisibleMask()][:, selection]
 
-        for point in self.data:
-            point_sel = point.getData()[selection]
-            closet_point = np.argmin(np.linalg.norm(traj_sel - point_sel, axis=1))
-            point._weight = closet_point + 1
+        # Each point is assigned to the cluster of its closest trajectory point
+        visible, closest_point = self.clusteringBackend.nearest(traj_sel, selection)
+        self.data.setWeights(closest_point + 1, visible)
 
         self.saveClusterBtn.config(state=tk.NORMAL)
         self._onUpdateClick()
@@ -326,9 +322,7 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
 
     def _onCreateCluster(self):
         self.setClusterNumber(self.getClusterNumber() +1)
-        for point in self.data:
-            if point.getState() == Point.SELECTED:
-                point._weight =self.getClusterNumber()
+        self.data.setWeights(self.getClusterNumber(), self.data.getSelectedMask())
         self.saveClusterBtn.config(state=tk.NORMAL)
         ClusteringWindow._onResetClick(self)
 
@@ -336,9 +330,7 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
         self._clusterNumber = n
 
     def _onErase(self):
-        for point in self.data:
-            if point.getState() == Point.SELECTED:
-                point._weight =0.0
+        self.data.setWeights(0.0, self.data.getSelectedMask())
         self.saveClusterBtn.config(state=tk.NORMAL)
         ClusteringWindow._onResetClick(self)
 
@@ -351,8 +343,7 @@ class PCAWindowDimred(TrajectoriesWindow, ClusteringWindow):
         self.saveClusterBtn.config(state=tk.DISABLED)
         self.setClusterNumber(0)
 
-        for point in self.data:
-            point._weight = 0
+        self.data.setWeights(0, self.data.getVisibleMask())
         TrajectoriesWindow._onResetClick(self, e)
         self.generateBtn.config(state=tk.NORMAL)
 
@@ -206,8 +206,7 @@ class GenesisViewer(ProtocolViewer):
         ene = {}
         for i in self.getSimulationList():
             outputPrefix = self.getOutputPrefixAll(i)
-            for j in outputPrefix:
-                log_file = readLogFile(j + ".log")
+            for log_file in readLogFiles([j + ".log" for j in outputPrefix]):
                 for e in ene_default:
                     if e in log_file:
                         if e in ene :
@@ -231,8 +230,7 @@ class GenesisViewer(ProtocolViewer):
         ene = {}
         for i in self.getSimulationList():
             outputPrefix = self.getOutputPrefixAll(i)
-            for j in outputPrefix:
-                log_file = readLogFile(j+".log")
+            for log_file in readLogFiles([j + ".log" for j in outputPrefix]):
                 for e in ene_default:
                     if e in log_file:
                         if e in ene :
@@ -260,8 +258,7 @@ class GenesisViewer(ProtocolViewer):
                 labels.append("CC")
             else:
                 labels.append("CC %s" % str(i + 1))
-            for j in outputPrefix:
-                log_file = readLogFile(j + ".log")
+            for log_file in readLogFiles([j + ".log" for j in outputPrefix]):
                 if 'RESTR_CVS001' in log_file:
                     cc_rep.append(log_file['RESTR_CVS001'])
                 else:
@@ -330,26 +327,29 @@ class GenesisViewer(ProtocolViewer):
         rmsd = []
         labels=[]
         simlist = self.getSimulationList()
+        dcdFiles = []
+        inputPDBs = []
+        targetPDBs = []
+        nrep = []
         for i in simlist:
-            outputPrefix = self.getOutputPrefixAll(i)
             if len(simlist) == 1:
                 labels.append("RMSD")
             else:
                 labels.append("RMSD %s"%str(i+1))
-            rmsd_rep=[]
+            outputPrefix = self.getOutputPrefixAll(i)
             for outprf in outputPrefix:
-                rmsd_curr = []
-
-                inputPDB = ContinuousFlexPDBHandler(self.protocol.getInputPDBprefix(i)+".pdb")
-                targetPDB = ContinuousFlexPDBHandler(self.getTargetPDB(i))
-                rmsd_curr.append(inputPDB.getRMSD(reference_pdb=targetPDB, align=self.alignTarget.get(), idx_matching_atoms=idx_matchin_atoms))
-                coord_arr = dcd2numpyArr(outprf + ".dcd")
-                for i in range(len(coord_arr)):
-                    inputPDB.coords[:, :] = coord_arr[i]
-                    rmsd_curr.append(inputPDB.getRMSD(reference_pdb=targetPDB, align=self.alignTarget.get(), idx_matching_atoms=idx_matchin_atoms))
-
-                rmsd_rep.append(rmsd_curr)
-            rmsd.append(rmsd_rep)
+                dcdFiles.append(outprf + ".dcd")
+                inputPDBs.append(self.protocol.getInputPDBprefix(i)+".pdb")
+                targetPDBs.append(self.getTargetPDB(i))
+            nrep.append(len(outputPrefix))
+
+        # Trajectories are analysed in parallel, results are cached next to the DCD files
+        rmsd_all = rmsdTimeSeries(dcdFiles=dcdFiles, inputPDBs=inputPDBs, targetPDBs=targetPDBs,
+                                  idx_matching_atoms=idx_matchin_atoms, align=self.alignTarget.get())
+        start = 0
+        for n in nrep:
+            rmsd.append(rmsd_all[start:start + n])
+            start += n
 
         self.genesisPlotter(title="RMSD ($\AA$)", data=rmsd, ndata=len(simlist),
                             nrep=len(self.getOutputPrefixAll()), labels=labels)
@@ -360,33 +360,36 @@ class GenesisViewer(ProtocolViewer):
         ax = plotter.createSubPlot("RMSD ($\AA$)", "# Simulation", "RMSD ($\AA$)")
 
         # Get RMSD list
-        initial_mols = []
-        final_mols = []
-        target_mols = []
+        initialPDBs = []
+        finalPDBs = []
+        targetPDBs = []
         for i in self.getSimulationList():
-            inputPDB = self.protocol.getInputPDBprefix(i)+".pdb"
-            targetPDB = self.getTargetPDB(i)
+            initialPDBs.append(self.protocol.getInputPDBprefix(i)+".pdb")
+            targetPDBs.append(self.getTargetPDB(i))
             outputPrefs = self.getOutputPrefixAll(i)
-            target_mols.append(ContinuousFlexPDBHandler(targetPDB))
-            initial_mols.append(ContinuousFlexPDBHandler(inputPDB))
             for outputPrefix in outputPrefs:
-                outputPDB = outputPrefix +".pdb"
-                final_mols.append(ContinuousFlexPDBHandler(outputPDB))
+                finalPDBs.append(outputPrefix +".pdb")
 
         if self.referencePDB.get() != "":
             ref_mol = ContinuousFlexPDBHandler(self.referencePDB.get())
         else:
-            ref_mol = initial_mols[0]
-        idx_match = ref_mol.matchPDBatoms(reference_pdb=target_mols[0],ca_only=True)
+            ref_mol = ContinuousFlexPDBHandler(initialPDBs[0])
+        idx_match = ref_mol.matchPDBatoms(reference_pdb=ContinuousFlexPDBHandler(targetPDBs[0]),ca_only=True)
+
+        # Read each PDB only once
+        pdbFiles = list(set(initialPDBs + finalPDBs))
+        pdbCoords = dict(zip(pdbFiles, readPDBCoords(pdbFiles, atoms=idx_match[:, 0])))
+        targetFiles = list(set(targetPDBs))
+        targetCoords = dict(zip(targetFiles, readPDBCoords(targetFiles, atoms=idx_match[:, 1])))
+
         rmsdi=[]
         rmsdf=[]
         for i in range(len(self.getSimulationList())):
             for j in range(len(outputPrefs)):
-                rmsdi.append(initial_mols[i].getRMSD(reference_pdb=target_mols[i],
-                                                     idx_matching_atoms=idx_match,
-                                                     align=self.alignTarget.get()))
-                rmsdf.append(final_mols[i*len(outputPrefs) + j].getRMSD(reference_pdb=target_mols[i],
-                                                    idx_matching_atoms=idx_match, align=self.alignTarget.get()))
+                rmsdi.append(ContinuousFlexPDBHandler.getRMSDBatch(targetCoords[targetPDBs[i]],
+                                    pdbCoords[initialPDBs[i]][None], align=self.alignTarget.get())[0])
+                rmsdf.append(ContinuousFlexPDBHandler.getRMSDBatch(targetCoords[targetPDBs[i]],
+                                    pdbCoords[finalPDBs[i*len(outputPrefs) + j]][None], align=self.alignTarget.get())[0])
 
         ax.plot(rmsdf, "o", color="tab:blue", label="Final RMSD", markeredgecolor='black')
         ax.plot(rmsdi, "o", color="tab:green", label="Initial RMSD", markeredgecolor='black')
@@ -31,7 +31,6 @@ visualization program.
 import os
 from os.path import basename, join, exists, isfile
 import numpy as np
-import pwem.emlib.metadata as md
 from pyworkflow.utils.path import cleanPath, makePath, cleanPattern
 from pyworkflow.viewer import (ProtocolViewer, DESKTOP_TKINTER, WEB_DJANGO)
 from pyworkflow.protocol.params import StringParam, LabelParam
@@ -44,8 +43,9 @@ from continuousflex.viewers.nma_vol_gui import ClusteringWindowVolHeteroFlow
 from continuousflex.viewers.nma_vol_gui import TrajectoriesWindowVolHeteroFlow
 from pwem.viewers.viewer_chimera import Chimera
 
-from joblib import load, dump
+from joblib import load
 from continuousflex.protocols.utilities.spider_files3 import open_volume, save_volume
+from continuousflex.protocols.utilities.heteroflow_utilities import writeFlowComponents, LowRankFlows
 import matplotlib.pyplot as plt
 from pwem.emlib.image import ImageHandler
 
@@ -384,47 +384,24 @@ class FlexDimredHeteroFlowViewer(ProtocolViewer):
             # Find closest points in deformations
             deformations = [X[np.argmin(np.sum((Y - p) ** 2, axis=1))] for p in trajectoryPoints]
 
-        # get the original size of the input:
-        mdImgs = md.MetaData(self.protocol.inputOpFlow.get()._getExtraPath('volumes_out.xmd'))
-        N = 0
-        for objId in mdImgs:
-            N += 1
-
-        # reading back all optical flows
-        bigmat = []
-        if(isfile(self.protocol._getExtraPath('bigmat_inverse.pkl'))):
-            print('bigmat_inverse.txt found')
-            # bigmat_pinv = np.loadtxt(self.protocol._getExtraPath('bigmat_inverse.txt'))
-            bigmat_pinv = load(self.protocol._getExtraPath('bigmat_inverse.pkl'))
-        else:
-            if(isfile(self.protocol._getExtraPath('bigmat.pkl'))):
-                bigmat = load(self.protocol._getExtraPath('bigmat.pkl'))
-            else:
-                for j in range(1, N+1):
-                    flowj = self.read_optical_flow_by_number(j)
-                    flowj = np.reshape(flowj, [3 * np.shape(flowj)[1] * np.shape(flowj)[2] * np.shape(flowj)[3]])
-                    bigmat.append(flowj)
-                bigmat = np.array(bigmat)
-                print('bigmat created successfully')
-                # np.savetxt(self.protocol._getExtraPath('bigmat.txt'),bigmat)
-                dump(bigmat,self.protocol._getExtraPath('bigmat.pkl'))
-                print('bigmat.pkl saved successfully')
-            bigmat_pinv = np.linalg.pinv(bigmat)
-            bigmat = None  # removing it from the memory
-            # np.savetxt(self.protocol._getExtraPath('bigmat_inverse.txt'),bigmat_pinv)
-            dump(bigmat_pinv,self.protocol._getExtraPath('bigmat_inverse.pkl'))
-
-        line = np.matmul(bigmat_pinv, np.transpose(deformations))
-        bigmat_pinv = None # removing if from the memory
+        # The flows are reconstructed from their first components, computed by the protocol (or here for the
+        # runs that do not have them)
+        componentsFile = self.protocol.getFlowComponentsFile()
+        factorsFile = self.protocol.getFlowFactorsFile()
+        if not (isfile(componentsFile) and isfile(factorsFile)):
+            G = np.loadtxt(self.protocol.inputOpFlow.get()._getExtraPath('data.csv'), delimiter=',', ndmin=2)
+            writeFlowComponents(self.read_optical_flow_by_number, G, componentsFile, factorsFile,
+                                self.protocol.flowRank.get())
+        flows = LowRankFlows(componentsFile, factorsFile)
+
         fnref = self.protocol._getExtraPath('reference.spi')
-        shape = np.shape(open_volume(fnref))
+        # The reference is read once for all the frames
+        reference = open_volume(fnref)
 
-        for i, trash in enumerate(deformations):
-            flowi = np.transpose(line[:, i])
-            flowi = np.reshape(flowi, [3, shape[0], shape[1], shape[2]])
+        # Each frame is reconstructed, warped and written before the next one
+        for i, flowi in enumerate(flows.reconstruct(np.array(deformations))):
             pathi = animationRoot + str(i).zfill(3) + 'deformed_by_opflow.vol'
-            ref = open_volume(fnref)
-            ref = farneback3d.warp_by_flow(ref, np.float32(flowi))
+            ref = farneback3d.warp_by_flow(reference, np.float32(flowi))
             save_volume(ref, pathi)
             # command = '-i ' + pathi + ' --select below 0.6 --substitute value 0'
             # runJob(None,'xmipp_transform_threshold',command)
@@ -31,6 +31,8 @@ visualization program.
 
 from os.path import basename, join, exists, isfile
 import numpy as np
+from continuousflex.protocols.utilities.nma_utilities import NMADeformer
+from continuousflex.protocols.utilities.animation_utilities import AnimationBuilder
 from joblib import load
 from pyworkflow.utils.path import cleanPath, makePath, cleanPattern
 from pyworkflow.viewer import (ProtocolViewer, DESKTOP_TKINTER, WEB_DJANGO)
@@ -42,7 +44,6 @@ from continuousflex.protocols.protocol_nma_dimred import FlexProtDimredNMA
 from continuousflex.protocols.data import Point, Data
 from continuousflex.viewers.nma_plotter import FlexNmaPlotter
 from continuousflex.viewers.nma_gui import ClusteringWindow, TrajectoriesWindow
-from pwem.utils import runProgram
 from pyworkflow.protocol import params
 from continuousflex.protocols import FlexProtDeepHEMNMAInfer
 
@@ -383,54 +384,24 @@ class FlexDimredNMAViewer(ProtocolViewer):
             pdb = prot.getInputPdb()
             pdbFile = pdb.getFileName()
             modesFn = prot.getInputModes()
-            for i, d in enumerate(deformations):
-                atomsFn = animationRoot + 'atomsDeformed_%02d.pdb' % (i + 1)
-                cmd = '-o %s --pdb %s --nma %s --deformations ' % (atomsFn, pdbFile, modesFn)
-                for l in d:
-                    cmd += str(l) + ' '
-                # because it doesn't have an independent protocol we don't use self.runJob
-                runProgram('xmipp_pdb_nma_deform', cmd)
+            deformer = NMADeformer(pdbFile, modesFn)
+            builder = AnimationBuilder(deformer.pdb)
+            builder.setDeformations(deformer, np.array(deformations))
 
         elif prot.getDataChoice() == 'PDBs':
             # There is incompatibility issue with the rest of the code, we have to use the fahterPDB as one of the
             # deformed PDBs (the first one)
             # fatherPDB = prot._getExtraPath('pdb_file.pdb')
             fatherPDB = prot._getExtraPath('generated_pdbs/000001.pdb')
-            lines_father = self.readPDB(fatherPDB)
-            list_father = self.PDB2List(lines_father)
-            i = 0
-            for line in deformations:
-                # reshaped pdb xyz coordinates
-                list_xyz = np.reshape(line, np.shape(list_father))
-                lines_i = self.list2PDBlines(list_xyz, lines_father)
-                atomsFn = animationRoot + 'atomsDeformed_%02d.pdb' % (i + 1)
-                self.writePDB(lines_i, atomsFn)
-                i += 1
-            pass
+            builder = AnimationBuilder(fatherPDB)
+            # reshaped pdb xyz coordinates
+            builder.setFrames(np.array(deformations))
 
         # Join all deformations in a single pdb
         # iterating going up and down through all points
         # 1 2 3 ... n-2 n-1 n n-1 n-2 ... 3, 2
-        n = len(deformations)
-        r1 = list(range(1, n + 1))
-        r2 = list(range(2, n))  # Skip 1 at the end
-        r2.reverse()
-        loop = r1 + r2
-
         trajFn = animationRoot + '.pdb'
-        trajFile = open(trajFn, 'w')
-
-        for i in loop:
-            atomsFn = animationRoot + 'atomsDeformed_%02d.pdb' % i
-            atomsFile = open(atomsFn)
-            for line in atomsFile:
-                trajFile.write(line)
-            trajFile.write('TER\nENDMDL\n')
-            atomsFile.close()
-
-        trajFile.close()
-        # Delete temporary atom files
-        # cleanPattern(animationRoot + 'atomsDeformed_??.pdb')
+        builder.writePDB(trajFn, loop=True)
 
         # Generate the vmd script
         vmdFn = animationRoot + '.vmd'
@@ -473,44 +444,3 @@ class FlexDimredNMAViewer(ProtocolViewer):
                                     weight=particle._xmipp_cost.get()))
 
         return data
-
-    def readPDB(self, fnIn):
-        with open(fnIn) as f:
-            lines = f.readlines()
-        return lines
-
-    def PDB2List(self, lines):
-        newlines = []
-        for line in lines:
-            if line.startswith("ATOM "):
-                try:
-                    x = float(line[30:38])
-                    y = float(line[38:46])
-                    z = float(line[46:54])
-                    newline = [x, y, z]
-                    newlines.append(newline)
-                except:
-                    pass
-        return newlines
-
-    def list2PDBlines(self, list, lines):
-        newLines = []
-        i = 0
-        for line in lines:
-            if line.startswith("ATOM "):
-                try:
-                    x = list[i][0]
-                    y = list[i][1]
-                    z = list[i][2]
-                    newLine = line[0:30] + "%8.3f%8.3f%8.3f" % (x, y, z) + line[54:]
-                    i += 1
-                except:
-                    pass
-            else:
-                newLine = line
-            newLines.append(newLine)
-        return newLines
-
-    def writePDB(self, lines, fnOut):
-        with open(fnOut, mode='w') as f:
-            f.writelines(lines)
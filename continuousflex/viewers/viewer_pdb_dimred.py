@@ -41,7 +41,8 @@ from continuousflex.viewers.tk_dimred import PCAWindowDimred
 from continuousflex.protocols.data import Point, Data, PathData
 from pwem.viewers import VmdView
 from pyworkflow.utils.path import cleanPath, makePath
-from continuousflex.protocols.utilities.genesis_utilities import numpyArr2dcd, dcd2numpyArr
+from continuousflex.protocols.utilities.genesis_utilities import DCDTrajectory
+from continuousflex.protocols.utilities.animation_utilities import AnimationBuilder
 from continuousflex.protocols.utilities.pdb_handler import ContinuousFlexPDBHandler
 from pyworkflow.gui.browser import FileBrowserWindow
 from continuousflex.protocols.protocol_pdb_dimred import REDUCE_METHOD_PCA, REDUCE_METHOD_UMAP
@@ -268,31 +269,25 @@ class FlexProtPdbDimredViewer(ProtocolViewer):
                 coords_list.append(deformations[i].reshape((initPDB.n_atoms, 3)))
         else :
             # read save coordinates
-            coords = dcd2numpyArr(self.protocol._getExtraPath("coords.dcd"))
+            coords = DCDTrajectory(self.protocol._getExtraPath("coords.dcd"))
 
-            # get class dict
-            classDict = {}
-            count = 0 #CLUSTERINGTAG
-            for p in self.trajectoriesWindow.data:
-                clsId = str(int(p._weight)) #CLUSTERINGTAG
-                if clsId in classDict:
-                    classDict[clsId].append(count)
-                else:
-                    classDict[clsId] = [count]
-                count += 1
+            # get the class of each point #CLUSTERINGTAG
+            data = self.trajectoriesWindow.data
+            indices = np.flatnonzero(data.getVisibleMask())
+            classes = data.getWeights().astype(int)
 
             if animtype == ANIMATION_AVG:
-                # compute avg
-                for i in classDict:
-                    coord_avg = np.mean(coords[np.array(classDict[i])], axis=0)
+                # compute avg, the classes are in the order of their first point
+                clsIds, first = np.unique(classes, return_index=True)
+                for clsId in clsIds[np.argsort(first)]:
+                    coord_avg = np.mean(coords.frames(indices[classes == clsId]), axis=0, dtype=np.float64)
                     coords_list.append(coord_avg.reshape((initPDB.n_atoms, 3)))
-
+            coords.close()
 
         # Generate DCD trajectory
-        initdcdcp = initPDB.copy()
-        initdcdcp.coords = coords_list[0]
-        initdcdcp.write_pdb(animationRoot+"trajectory.pdb")
-        numpyArr2dcd(arr = np.array(coords_list), filename=animationRoot+"trajectory.dcd")
+        builder = AnimationBuilder(initPDB)
+        builder.setFrames(np.array(coords_list))
+        builder.writeDCD(animationRoot+"trajectory.dcd", fnTopology=animationRoot+"trajectory.pdb")
 
         # Generate the vmd script
         vmdFn = animationRoot + 'trajectory.vmd'